@@ -0,0 +1,156 @@
+#! /usr/bin/env python
+# EditXT
+# Copyright 2007-2015 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Measure line scanning speed
+
+Compares finding each line with `Text.line_range` (one lineRangeForRange_
+call per line, the previous implementation of `iter_line_ranges`) with
+the batched `Text.iter_line_ranges` on generated text.
+
+The memory command compares the memory used to store line offsets in
+`LineStarts` with a list of ints (the previous implementation).
+
+Usage:
+    line_benchmark.py [--lines=<n>] [--width=<n>]
+    line_benchmark.py memory [--width=<n>] [<lines>...]
+    line_benchmark.py -h | --help
+
+Arguments:
+    <lines>         Numbers of lines to store (1000000 and 10000000 if
+                    not given).
+
+Options:
+    --lines=<n>     Number of lines of text [default: 1000000].
+    --width=<n>     Average line length [default: 40].
+    -h --help       Show this help screen.
+"""
+import random
+import sys
+import tracemalloc
+from os.path import abspath, dirname, join
+from time import perf_counter
+
+import docopt
+
+THIS_PATH = abspath(dirname(__file__))
+
+sys.path.append(join(dirname(THIS_PATH)))
+import editxt.platform as platform
+platform.init("test", False)
+from editxt.linenumbers import LineNumbers, LineStarts
+from editxt.platform.text import Text
+
+
+def main(args=None):
+    opts = docopt.docopt(__doc__, args)
+    if opts["memory"]:
+        counts = [int(n) for n in opts["<lines>"]] or [1000000, 10000000]
+        return memory(counts, int(opts["--width"]))
+    text = Text(generate_text(int(opts["--lines"]), int(opts["--width"])))
+    print("{:,} lines, {:,} characters".format(int(opts["--lines"]), len(text)))
+
+    def per_line():
+        index = 0
+        length = len(text)
+        line_range = text.line_range
+        count = 0
+        while index < length:
+            index = sum(line_range((index, 0)))
+            count += 1
+        return count
+
+    def batched():
+        count = 0
+        for rng in text.iter_line_ranges():
+            count += 1
+        return count
+
+    def line_numbers():
+        lines = LineNumbers(text)
+        return lines[len(text) - 1]
+
+    base = None
+    for label, func in [
+        ("line_range", per_line),
+        ("iter_line_ranges", batched),
+        ("LineNumbers", line_numbers),
+    ]:
+        seconds, count = measure(func)
+        rate = count / seconds
+        speedup = " ({:.1f}x)".format(rate / base) if base else ""
+        base = base or rate
+        print("{:<18} {:>8.3f}s {:>14,.0f} lines/s{}".format(
+            label, seconds, rate, speedup))
+
+
+def memory(counts, width):
+    """Compare memory used by line offset storage"""
+    def int_list(count):
+        lines = [0]
+        for x in range(1, count):
+            lines.append(x * width)
+        return lines
+
+    def line_starts(count):
+        lines = LineStarts()
+        for x in range(1, count):
+            lines.append(x * width)
+        return lines
+
+    for count in counts:
+        print("{:,} lines".format(count))
+        base = None
+        for label, func in [("list", int_list), ("LineStarts", line_starts)]:
+            tracemalloc.start()
+            lines = func(count)
+            size = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            del lines
+            ratio = " ({:.1f}x smaller)".format(base / size) if base else ""
+            base = base or size
+            print("  {:<12} {:>8.1f} MB {:>6.1f} bytes/line{}".format(
+                label, size / 1024 / 1024, size / count, ratio))
+
+
+def generate_text(lines, width):
+    rand = random.Random(0)
+    words = "lorem ipsum dolor sit amet consectetur adipiscing elit".split()
+    result = []
+    for x in range(lines):
+        line = []
+        size = rand.randint(0, width * 2)
+        while sum(len(w) + 1 for w in line) < size:
+            line.append(rand.choice(words))
+        result.append(" ".join(line))
+    return "\n".join(result)
+
+
+def measure(func):
+    """Measure function run time
+
+    :returns: A two-tuple `(seconds, result)`.
+    """
+    start = perf_counter()
+    result = func()
+    return perf_counter() - start, result
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,679 @@
+#! /usr/bin/env python
+# EditXT
+# Copyright 2007-2015 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Measure syntax highlighting throughput
+
+Load all syntax definitions in resources/syntax and highlight generated
+and real-world text of several sizes with each one. Generated text is
+made of words and delimiters taken from the syntax definition. Real
+text is the content of files (found in the EditXT source tree and in
+the given paths) that map to the syntax definition; it is repeated to
+fill the requested size.
+
+Throughput (MB/s of UTF-8 text), highlighted tokens per second, and
+peak memory allocated (by Python) while highlighting are reported for
+each definition, corpus and size. The number of color attribute writes
+to the text storage is recorded in saved results. The full suite is
+
+    syntax_benchmark.py run --sizes=10K,100K,1M,10M,50M
+
+Results may be saved as JSON and compared with those of another
+revision to find regressions. The exit status of compare is 1 if a
+regression was found.
+
+The profile command times each named group of the regular expressions
+of every lexer state (reachable from the root state of a definition)
+on the corpus, and reports the slowest groups along with the rule
+that produced them. Each group is also matched against adversarial
+text (runs of the literal characters of its pattern) of increasing
+length; groups whose match time grows much faster than the length of
+the text (which usually means they backtrack) are flagged along with
+the growth of match time when the length was doubled.
+
+Usage:
+    syntax_benchmark.py run [options] [<path>...]
+    syntax_benchmark.py compare [--threshold=<pct>] <baseline> <results>
+    syntax_benchmark.py profile [options] [<path>...]
+    syntax_benchmark.py -h | --help
+
+Arguments:
+    <path>              Directories with files to be used as real text.
+    <baseline>          JSON results file of the baseline revision.
+    <results>           JSON results file to compare with baseline.
+
+Options:
+    --lang=<ids>        Comma-delimited list of syntax definition ids to
+                        benchmark. Default: all.
+    --sizes=<sizes>     Comma-delimited list of text sizes. K and M
+                        suffixes are supported [default: 10K,100K,1M].
+    --corpus=<kinds>    Comma-delimited list of corpus kinds to use
+                        [default: generated,real].
+    --repeat=<n>        Repeat each measurement and keep the fastest
+                        [default: 1].
+    --no-memory         Do not measure peak memory (saves one highlight
+                        pass per measurement).
+    --output=<file>     Save results as JSON.
+    --syntax=<dirs>     Comma-delimited list of additional directories
+                        of syntax definitions (for example, definitions
+                        generated by hljs2xt.py).
+    --threshold=<pct>   Percent change considered a regression
+                        [default: 10].
+    --size=<size>       Size of corpus text to profile [default: 100K].
+    --depth=<n>         Profile lexer states up to this many transitions
+                        from the root state [default: 2].
+    --top=<n>           Number of slowest groups to report for each
+                        definition [default: 5].
+    -h --help           Show this help screen.
+"""
+import json
+import os
+import platform as _platform
+import random
+import re
+import sre_constants as sre
+import sre_parse
+import subprocess
+import sys
+import tracemalloc
+from datetime import datetime
+from os.path import abspath, dirname, join
+from itertools import count
+from time import perf_counter
+
+import docopt
+
+THIS_PATH = abspath(dirname(__file__))
+ROOT_PATH = dirname(THIS_PATH)
+SYNTAX_PATH = join(ROOT_PATH, "resources", "syntax")
+RESULTS_FORMAT = 1
+
+sys.path.append(ROOT_PATH)
+import editxt.platform as platform
+platform.init("test", False)
+from editxt.config import Config
+from editxt.platform.text import Text
+from editxt.syntax import (PLAIN_TEXT, Highlighter, MatchInfo,
+    SyntaxDefinition, SyntaxFactory)
+from editxt.theme import Theme
+
+
+def main(args=None):
+    opts = docopt.docopt(__doc__, args)
+    if opts["compare"]:
+        threshold = float(opts["--threshold"])
+        sys.exit(compare(opts["<baseline>"], opts["<results>"], threshold))
+    langs = opts["--lang"].split(",") if opts["--lang"] else None
+    kinds = opts["--corpus"].split(",")
+    paths = [ROOT_PATH] + opts["<path>"]
+    syntax_paths = opts["--syntax"].split(",") if opts["--syntax"] else []
+    if opts["profile"]:
+        results = profile(
+            langs=langs,
+            size=parse_size(opts["--size"]),
+            kinds=kinds,
+            paths=paths,
+            syntax_paths=syntax_paths,
+            depth=int(opts["--depth"]),
+            top=int(opts["--top"]),
+        )
+    else:
+        results = run(
+            langs=langs,
+            sizes=[parse_size(size) for size in opts["--sizes"].split(",")],
+            kinds=kinds,
+            paths=paths,
+            syntax_paths=syntax_paths,
+            repeat=int(opts["--repeat"]),
+            memory=not opts["--no-memory"],
+        )
+    if opts["--output"]:
+        with open(opts["--output"], "w", encoding="utf-8") as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+
+
+def run(langs, sizes, kinds, paths, syntax_paths=(), repeat=1, memory=True):
+    """Run benchmarks and print results
+
+    :returns: A dict of results, which can be serialized as JSON.
+    """
+    factory, definitions, load_seconds = load(langs, syntax_paths)
+    sources = find_sources(factory, paths) if "real" in kinds else {}
+    print(HEADER)
+
+    theme = Theme(Config(None))
+    results = []
+    for sdef in sorted(definitions, key=lambda sdef: sdef.id):
+        start = perf_counter()
+        sdef.regex, sdef.wordinfo  # compile
+        compile_seconds = perf_counter() - start
+        corpora = []
+        if "generated" in kinds:
+            corpora.append(("generated", generate_text(sdef)))
+        if sources.get(sdef.id):
+            corpora.append(("real", "".join(sources[sdef.id])))
+        for kind, sample in corpora:
+            for size in sizes:
+                text = fill(sample, size)
+                result = measure(sdef, theme, text, repeat, memory)
+                result.update(
+                    lang=sdef.id,
+                    name=sdef.name,
+                    corpus=kind,
+                    size=size,
+                    compile_seconds=compile_seconds,
+                )
+                results.append(result)
+                print(format_result(result))
+    return {
+        "format": RESULTS_FORMAT,
+        "revision": get_revision(),
+        "created": datetime.now().isoformat(),
+        "python": sys.version.split()[0],
+        "platform": _platform.platform(),
+        "load_seconds": load_seconds,
+        "results": results,
+    }
+
+
+def load(langs, syntax_paths=()):
+    """Load syntax definitions
+
+    :returns: A tuple `(factory, definitions, load_seconds)` where
+    `definitions` is a list of definitions selected by `langs`.
+    """
+    start = perf_counter()
+    factory = SyntaxFactory()
+    for path in [SYNTAX_PATH] + list(syntax_paths):
+        factory.load_definitions(path, False)
+    factory.index_definitions()
+    load_seconds = perf_counter() - start
+    definitions = [sdef for sdef in factory.definitions
+                   if sdef is not PLAIN_TEXT
+                   and (langs is None or sdef.id in langs)]
+    print("loaded {} definitions in {:.3f}s".format(
+        len(factory.definitions), load_seconds))
+    return factory, definitions, load_seconds
+
+
+def measure(sdef, theme, string, repeat=1, memory=True):
+    """Measure highlighting performance
+
+    :returns: A dict of measurements.
+    """
+    nbytes = len(string.encode("utf-8"))
+    seconds = None
+    for i in range(repeat):
+        text = Text(string)
+        highlighter = CountingHighlighter(theme)
+        highlighter.syntaxdef = sdef
+        start = perf_counter()
+        highlighter.color_text(text)
+        elapsed = perf_counter() - start
+        if seconds is None or elapsed < seconds:
+            seconds = elapsed
+    tokens = highlighter.tokens
+    writes = highlighter.attribute_writes
+    if memory:
+        text = Text(string)
+        highlighter = CountingHighlighter(theme)
+        highlighter.syntaxdef = sdef
+        tracemalloc.start()
+        try:
+            highlighter.color_text(text)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    else:
+        peak = None
+    seconds = max(seconds, 1e-9)
+    return {
+        "bytes": nbytes,
+        "seconds": seconds,
+        "mb_per_s": nbytes / seconds / 1e6,
+        "tokens": tokens,
+        "tokens_per_s": tokens / seconds,
+        "attribute_writes": writes,
+        "peak_memory": peak,
+    }
+
+
+class CountingHighlighter(Highlighter):
+    """Highlighter that counts highlighted tokens"""
+
+    tokens = 0
+
+    def apply_batch(self, text, batch):
+        self.tokens += sum(1 for start, (info, key) in batch.runs
+                           if isinstance(info, MatchInfo))
+        super().apply_batch(text, batch)
+
+
+def generate_text(sdef, lines=2000, seed=0):
+    """Generate text containing tokens of the given syntax definition
+
+    :returns: A string of approximately `lines * 60` characters.
+    """
+    rand = random.Random(seed)
+    words = sorted(set(iter_words(sdef.rules)))
+    filler = ["x", "value", "foo_bar", "42", "3.14", "=", ",", ";", "(", ")"]
+    words = words + filler if words else filler
+    result = []
+    for i in range(lines):
+        line = []
+        length = 0
+        while length < 60:
+            word = rand.choice(words)
+            line.append(word)
+            length += len(word) + 1
+        result.append(" ".join(line))
+    return "\n".join(result) + "\n"
+
+
+def iter_words(rules):
+    """Generate literal words and delimited ranges from syntax rules"""
+    def strings(value):
+        if isinstance(value, (list, tuple)) and value \
+                and all(isinstance(v, str) for v in value):
+            return value
+        return []
+    for rule in rules:
+        if len(rule) == 2:
+            yield from strings(rule[1])
+        elif len(rule) > 2:
+            starts = strings(rule[1])
+            ends = strings(rule[2])
+            for start in starts:
+                yield start
+                for end in ends:
+                    if "\n" not in end:
+                        yield "{} body {}".format(start, end)
+
+
+def find_sources(factory, paths):
+    """Find files with content to be used as real text
+
+    :returns: A dict of lists of strings keyed by syntax definition id.
+    """
+    sources = {}
+    for path in paths:
+        for root, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+            for name in sorted(files):
+                sdef = factory.get_definition(name)
+                if sdef is PLAIN_TEXT:
+                    continue
+                try:
+                    with open(join(root, name), encoding="utf-8") as fh:
+                        content = fh.read()
+                except (OSError, UnicodeDecodeError):
+                    continue
+                if content:
+                    sources.setdefault(sdef.id, []).append(content)
+    return sources
+
+
+def fill(sample, size):
+    """Repeat sample to fill (approximately) size bytes
+
+    The result ends with a complete line of the sample if possible.
+    """
+    nbytes = max(len(sample.encode("utf-8")), 1)
+    string = sample * (size // nbytes + 1)
+    result = string[:size]
+    end = result.rfind("\n") + 1
+    return result[:end] if end else result
+
+
+def parse_size(value):
+    value = value.strip().upper()
+    scale = {"K": 1000, "M": 1000 ** 2}.get(value[-1:])
+    if scale:
+        return int(float(value[:-1]) * scale)
+    return int(value)
+
+
+def format_size(size):
+    for scale, suffix in [(1000 ** 2, "M"), (1000, "K")]:
+        if size >= scale:
+            return "{:g}{}".format(size / scale, suffix)
+    return str(size)
+
+
+HEADER = "{:<24} {:<9} {:>6} {:>10} {:>12} {:>11}".format(
+    "lang", "corpus", "size", "MB/s", "tokens/s", "peak KB")
+
+
+def format_result(result):
+    peak = result["peak_memory"]
+    return "{:<24} {:<9} {:>6} {:>10.3f} {:>12,.0f} {:>11}".format(
+        result["lang"],
+        result["corpus"],
+        format_size(result["size"]),
+        result["mb_per_s"],
+        result["tokens_per_s"],
+        "-" if peak is None else "{:,.0f}".format(peak / 1000),
+    )
+
+
+def get_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=ROOT_PATH, stderr=subprocess.DEVNULL,
+        ).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline_path, results_path, threshold):
+    """Compare two sets of results
+
+    Slower throughput, larger peak memory (both by more than threshold
+    percent), more attribute writes and a different number of tokens
+    (which means the highlighter or syntax definition behaves
+    differently) are reported as regressions.
+
+    :returns: 1 if there were regressions, otherwise 0.
+    """
+    def load(path):
+        with open(path, encoding="utf-8") as fh:
+            data = json.load(fh)
+        if data.get("format") != RESULTS_FORMAT:
+            raise SystemExit("{}: unknown results format: {}".format(
+                path, data.get("format")))
+        return data, {(r["lang"], r["corpus"], r["size"]): r
+                      for r in data["results"]}
+
+    old_data, old = load(baseline_path)
+    new_data, new = load(results_path)
+    print("baseline: {}  results: {}".format(
+        old_data["revision"], new_data["revision"]))
+    print("{:<24} {:<9} {:>6} {:>10} {:>10} {:>8}  {}".format(
+        "lang", "corpus", "size", "old MB/s", "new MB/s", "change", "notes"))
+    limit = threshold / 100
+    regressions = 0
+    for key in sorted(set(old) & set(new)):
+        a = old[key]
+        b = new[key]
+        change = b["mb_per_s"] / a["mb_per_s"] - 1
+        notes = []
+        if change < -limit:
+            notes.append("SLOWER")
+        if a["tokens"] != b["tokens"]:
+            notes.append("TOKENS {} -> {}".format(a["tokens"], b["tokens"]))
+        writes = a.get("attribute_writes"), b.get("attribute_writes")
+        if None not in writes and writes[0] < writes[1]:
+            notes.append("WRITES {} -> {}".format(*writes))
+        if a["peak_memory"] and b["peak_memory"] and \
+                b["peak_memory"] / a["peak_memory"] - 1 > limit:
+            notes.append("MEMORY {:+.0%}".format(
+                b["peak_memory"] / a["peak_memory"] - 1))
+        if notes:
+            regressions += 1
+        lang, corpus, size = key
+        print("{:<24} {:<9} {:>6} {:>10.3f} {:>10.3f} {:>+8.1%}  {}".format(
+            lang, corpus, format_size(size),
+            a["mb_per_s"], b["mb_per_s"], change, " ".join(notes)))
+    for label, keys in [
+        ("missing from results", set(old) - set(new)),
+        ("not in baseline", set(new) - set(old)),
+    ]:
+        for lang, corpus, size in sorted(keys):
+            print("{} {} {}: {}".format(lang, corpus, format_size(size), label))
+    print("{} regression(s)".format(regressions))
+    return 1 if regressions else 0
+
+
+ADVERSARIAL_LENGTH = 4096
+SUPERLINEAR_RATIO = 3  # linear match time doubles with twice longer text
+SUPERLINEAR_MIN_SECONDS = 0.005
+EXPONENTIAL_RATIO = 16
+EXPONENTIAL_MIN_SECONDS = 0.0001
+GROUP_KINDS = {"w": "word", "r": "range", "e": "end"}
+NAMED_GROUP = re.compile(r"^\(\?P<\w+>")
+
+
+def profile(langs, size, kinds, paths, syntax_paths=(), depth=2, top=5):
+    """Profile regular expression groups of syntax definitions
+
+    :returns: A dict of results, which can be serialized as JSON.
+    """
+    factory, definitions, load_seconds = load(langs, syntax_paths)
+    sources = find_sources(factory, paths) if "real" in kinds else {}
+    filenames = {sdef.name: sdef.filename for sdef in factory.by_id.values()
+                 if isinstance(sdef, SyntaxDefinition)}
+    adversarial = {}
+    results = []
+    for sdef in sorted(definitions, key=lambda sdef: sdef.id):
+        sample = []
+        if "generated" in kinds:
+            sample.append(generate_text(sdef))
+        sample.extend(sources.get(sdef.id, []))
+        corpus = fill("".join(sample), size)
+        timings = {}
+        groups = []
+        for state in iter_states(sdef, depth):
+            try:
+                groups.extend(profile_state(
+                    state, corpus, timings, adversarial, filenames))
+            except Exception as err:
+                print("{} {}: {}".format(sdef.id, state.key, err))
+        groups.sort(key=lambda group: group["seconds"], reverse=True)
+        print_profile(sdef, groups, top)
+        results.append({
+            "lang": sdef.id,
+            "name": sdef.name,
+            "size": size,
+            "groups": groups,
+        })
+    return {
+        "revision": get_revision(),
+        "created": datetime.now().isoformat(),
+        "python": sys.version.split()[0],
+        "platform": _platform.platform(),
+        "load_seconds": load_seconds,
+        "profile": results,
+    }
+
+
+def iter_states(sdef, depth):
+    """Generate lexer states reachable from the given root state
+
+    :param depth: Maximum number of transitions from the root state.
+    """
+    seen = set()
+    states = [sdef]
+    for i in range(depth + 1):
+        nexts = []
+        for state in states:
+            if id(state) in seen or not isinstance(state, SyntaxDefinition):
+                continue
+            seen.add(id(state))
+            yield state
+            nexts.extend(info.next for info in state.wordinfo.values()
+                         if getattr(info, "next", None) is not None)
+        states = nexts
+
+
+def profile_state(state, corpus, timings, adversarial, filenames):
+    """Time each named group of the regular expression of a lexer state
+
+    :param timings: Corpus timings cache, keyed by pattern.
+    :param adversarial: Adversarial text timings cache, keyed by pattern.
+    :param filenames: A dict of syntax definition file names keyed by
+    definition name. States derived from a definition referenced by
+    another have the file name of the referencing definition.
+    :returns: A list of dicts, one for each group.
+    """
+    idgen = ("%X" % i for i in count())
+    result = []
+    for phrase, ident, info in state.iter_group_info(idgen):
+        key = (NAMED_GROUP.sub("(?:", phrase, 1), state.flags)
+        try:
+            regex = re.compile(*key)
+        except re.error as err:
+            print("{} {}: cannot compile {}: {}".format(
+                state.name, ident, phrase, err))
+            continue
+        if key not in timings:
+            start = perf_counter()
+            matches = sum(1 for match in regex.finditer(corpus))
+            timings[key] = (perf_counter() - start, matches)
+        if key not in adversarial:
+            adversarial[key] = find_superlinear(regex, *key)
+        seconds, matches = timings[key]
+        item = {
+            "state": state.key,
+            "group": ident,
+            "kind": GROUP_KINDS.get(ident[0], ident[0]),
+            "token": str(info),
+            "seconds": seconds,
+            "matches": matches,
+            "superlinear": adversarial[key],
+        }
+        filename = filenames.get(state.name, state.filename)
+        item.update(find_rule(state, info, filename))
+        result.append(item)
+    return result
+
+
+def find_superlinear(regex, pattern, flags):
+    """Find adversarial text on which match time grows superlinearly
+
+    Text is made of runs of literal characters of the pattern (and a
+    few common characters). The length of each run is doubled, up to
+    `ADVERSARIAL_LENGTH`, until match time grows by `SUPERLINEAR_RATIO`
+    or more in one step. Doubling stops early if match time grows by
+    `EXPONENTIAL_RATIO` since catastrophic backtracking would take
+    forever on longer text.
+
+    :returns: A dict describing the text having the largest match time
+    or `None` if match time did not grow superlinearly on any text.
+    """
+    def elapsed(text, repeat=3):
+        seconds = []
+        for i in range(repeat):
+            start = perf_counter()
+            for match in regex.finditer(text):
+                pass
+            seconds.append(perf_counter() - start)
+        return min(seconds)
+
+    worst = None
+    units = set(literal_chars(pattern, flags)) | {"a", "0", " "}
+    for char in sorted(units):
+        for unit in [char] if char == "a" else [char, char + "a"]:
+            length = 8
+            before = None
+            while length <= ADVERSARIAL_LENGTH:
+                text = unit * (length // len(unit))
+                seconds = elapsed(text)
+                ratio = seconds / max(before, 1e-9) if before else 0
+                if (ratio >= SUPERLINEAR_RATIO
+                        and seconds >= SUPERLINEAR_MIN_SECONDS) or \
+                        (ratio >= EXPONENTIAL_RATIO
+                        and seconds >= EXPONENTIAL_MIN_SECONDS):
+                    if worst is None or ratio > worst["ratio"]:
+                        worst = {
+                            "text": "{!r} * {}".format(
+                                unit, len(text) // len(unit)),
+                            "seconds": seconds,
+                            "ratio": ratio,
+                        }
+                    break
+                before = seconds
+                length *= 2
+    return worst
+
+
+def literal_chars(pattern, flags=0):
+    """Get the set of literal characters of a regular expression"""
+    chars = set()
+    def walk(value):
+        if isinstance(value, sre_parse.SubPattern):
+            for op, av in value:
+                if op is sre.LITERAL:
+                    chars.add(chr(av))
+                else:
+                    walk(av)
+        elif isinstance(value, (list, tuple)):
+            if len(value) == 2 and value[0] is sre.LITERAL:
+                chars.add(chr(value[1]))
+            else:
+                for item in value:
+                    walk(item)
+    walk(sre_parse.parse(pattern, flags))
+    return chars
+
+
+def find_rule(state, info, filename, sources={}):
+    """Find the rule of a state that produced a group
+
+    The line number is that of the first line in the syntax definition
+    file containing the quoted rule name, which is usually the line of
+    the rule.
+
+    :returns: A dict with `rule`, `file` and `line` keys.
+    """
+    prefix = state.name + " "
+    name = info[len(prefix):] if info.startswith(prefix) else str(info)
+    if filename not in sources:
+        try:
+            with open(filename, encoding="utf-8") as fh:
+                sources[filename] = fh.read().splitlines()
+        except (OSError, TypeError):
+            sources[filename] = []
+    quoted = re.compile(r"""(['"]){}\1""".format(re.escape(name)))
+    line = next((num for num, text in enumerate(sources[filename], 1)
+                 if quoted.search(text)), None)
+    if filename and filename.startswith(ROOT_PATH + os.sep):
+        filename = filename[len(ROOT_PATH) + 1:]
+    return {"rule": name, "file": filename, "line": line}
+
+
+def print_profile(sdef, groups, top):
+    print("{} ({}): {} groups, {:.4f}s".format(
+        sdef.id, sdef.name, len(groups),
+        sum(group["seconds"] for group in groups)))
+    def where(group):
+        return "{} {}:{} {} {}".format(
+            group["rule"],
+            group["file"],
+            group["line"] or "?",
+            group["kind"],
+            group["state"] or "root",
+        )
+    for group in groups[:top]:
+        print("  {:>9.4f}s {:>8} matches  {}".format(
+            group["seconds"], group["matches"], where(group)))
+    seen = set()
+    for group in groups:
+        worst = group["superlinear"]
+        if worst is not None:
+            line = "  SUPERLINEAR x{:.0f} {:.4f}s on {}  {}".format(
+                worst["ratio"], worst["seconds"], worst["text"], where(group))
+            key = (worst["text"], group["rule"], group["file"], group["kind"])
+            if key not in seen:
+                seen.add(key)
+                print(line)
+
+
+if __name__ == "__main__":
+    main()
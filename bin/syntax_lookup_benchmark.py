@@ -0,0 +1,115 @@
+#! /usr/bin/env python
+# EditXT
+# Copyright 2007-2015 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Measure file name to syntax definition lookup speed
+
+Compares `SyntaxFactory.get_definition` with a linear `fnmatch` scan of
+all registered patterns (the previous implementation) using all syntax
+definitions in resources/syntax.
+
+Usage:
+    syntax_lookup_benchmark.py [--seconds=<n>] [<path>...]
+    syntax_lookup_benchmark.py -h | --help
+
+Arguments:
+    <path>          Directories with files whose names will be added
+                    to the set of names looked up.
+
+Options:
+    --seconds=<n>   Approximate time to spend on each benchmark [default: 2].
+    -h --help       Show this help screen.
+"""
+import os
+import sys
+from fnmatch import fnmatch
+from os.path import abspath, dirname, join
+from time import perf_counter
+
+import docopt
+
+THIS_PATH = abspath(dirname(__file__))
+SYNTAX_PATH = join(dirname(THIS_PATH), "resources", "syntax")
+
+sys.path.append(join(dirname(THIS_PATH)))
+import editxt.platform as platform
+platform.init("test", False)
+from editxt.syntax import PLAIN_TEXT, SyntaxFactory
+
+
+def main(args=None):
+    opts = docopt.docopt(__doc__, args)
+    seconds = float(opts["--seconds"])
+    factory = SyntaxFactory()
+    factory.load_definitions(SYNTAX_PATH, False)
+    names = generate_names(factory.registry)
+    for path in opts["<path>"]:
+        for root, dirs, files in os.walk(path):
+            names.extend(files)
+    print("{} patterns, {} file names".format(len(factory.registry), len(names)))
+
+    def linear(filename, registry=factory.registry):
+        for pattern, sdef in registry.items():
+            if fnmatch(filename, pattern):
+                return sdef
+        return PLAIN_TEXT
+
+    for name in names:
+        assert linear(name) is factory.get_definition(name), name
+
+    base = None
+    for label, lookup in [
+        ("fnmatch scan", linear),
+        ("get_definition", factory.get_definition),
+    ]:
+        rate = measure(lookup, names, seconds)
+        speedup = " ({:.0f}x)".format(rate / base) if base else ""
+        base = base or rate
+        print("{:<16} {:>12,.0f} lookups/s{}".format(label, rate, speedup))
+
+
+def generate_names(registry):
+    """Generate a list of file names matching (and not matching) patterns"""
+    names = []
+    for pattern in registry:
+        name = pattern.replace("*", "file").replace("?", "x")
+        names.append(name.replace("[", "").replace("]", ""))
+        names.append("file.unknown")
+    return names
+
+
+def measure(lookup, names, seconds):
+    """Measure lookup rate
+
+    :returns: Lookups per second.
+    """
+    count = 0
+    start = perf_counter()
+    end = start + seconds
+    while True:
+        for name in names:
+            lookup(name)
+        count += len(names)
+        now = perf_counter()
+        if now > end:
+            return count / (now - start)
+
+
+if __name__ == "__main__":
+    main()
@@ -111,7 +111,10 @@ class Application(object):
 
     def init_syntax_definitions(self):
         from editxt.syntax import SyntaxFactory
-        self.syntax_factory = sf = SyntaxFactory()
+        if self.syntax_factory is not None:
+            self.syntax_factory.save_cache()
+        cache_dir = os.path.join(self.profile_path, const.CACHE_DIR)
+        self.syntax_factory = sf = SyntaxFactory(cache_dir)
         paths = [(self.resource_path(), False), (self.profile_path, True)]
         for path, log_info in paths:
             path = os.path.join(path, const.SYNTAX_DEFS_DIR)
@@ -530,6 +533,10 @@ class Application(object):
     def will_terminate(self):
         self.terminating = True
         self.save_window_states()
+        for document in self.documents:
+            document.save_highlight()
+        if self.syntax_factory is not None:
+            self.syntax_factory.save_cache()
 
 
 class StateLoadFailure(object):
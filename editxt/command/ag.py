@@ -116,8 +116,10 @@ def ag(editor, args):
 def find_definition(editor, args):
     """Find definition
 
-    Search in files for definitions matching the specified pattern
-    based on current file's definition syntax rules.
+    Jump to the next definition matching the specified pattern in the
+    current file if there is one (other than the selection). Otherwise
+    search in files for definitions matching the pattern based on
+    current file's definition syntax rules.
     See `editxt.syntax.SyntaxDefinition.definition_rules`
     """
     if _should_exit_early(editor, args, "def"):
@@ -130,6 +132,8 @@ def find_definition(editor, args):
             "{} language definition has no definition delimiters"
             .format(editor.syntaxdef.name)
         )
+    if goto_symbol(editor, def_pattern):
+        return
     args.pattern = RegexPattern(
         "|".join(start + def_pattern + end for start, end in delims),
         def_pattern.flags,
@@ -138,6 +142,30 @@ def find_definition(editor, args):
     ag(editor, args)
 
 
+def goto_symbol(editor, pattern):
+    """Select the next definition matching pattern in the current file
+
+    Definitions are looked up in the symbol index of the document,
+    which is updated as the document is highlighted.
+
+    :returns: True if a definition other than the current selection
+    was selected.
+    """
+    if editor.text_view is None:
+        return False
+    regex = re.compile(pattern, pattern.flags)
+    selection = tuple(editor.selection)
+    found = [(offset, len(name))
+        for offset, name in editor.document.syntaxer.symbols.find(regex)
+        if (offset, len(name)) != selection]
+    if not found:
+        return False
+    rng = next((r for r in found if r[0] > selection[0]), found[0])
+    editor.selection = rng
+    editor.text_view.scrollRangeToVisible_(rng)
+    return True
+
+
 def _should_exit_early(editor, args, command_name):
     if args is None:
         from editxt.commands import show_command_bar
@@ -28,6 +28,7 @@ import Foundation as fn
 from objc import super
 
 import editxt.constants as const
+import editxt.regex as regex
 from editxt.command.base import command, CommandError, objc_delegate, PanelController
 from editxt.command.parser import Choice, Regex, RegexPattern, CommandParser, Options
 from editxt.command.util import make_command_predicate
@@ -394,22 +395,22 @@ class Finder(object):
         if options.ignore_case:
             flags |= re.IGNORECASE
         try:
-            regex = re.compile(ftext, flags)
+            pattern = regex.compile(ftext, flags, const.FIND_MATCH_TIMEOUT)
         except re.error as err:
             raise CommandError(
                 "cannot compile regex {!r} : {}".format(ftext, err))
-        else:
+        try:
             FoundRange = make_found_range_factory(options)
             backward = (direction == BACKWARD)
             wrapped = False
             endindex = sum(range)
             while True:
                 if range[1] > 0:
-                    itr = text.finditer(regex, range[0], endindex)
+                    itr = text.finditer(pattern, range[0], endindex)
                 elif (wrapped and backward) or (not wrapped and not backward):
-                    itr = text.finditer(regex, range[0])
+                    itr = text.finditer(pattern, range[0])
                 else:
-                    itr = text.finditer(regex, 0, range[0])
+                    itr = text.finditer(pattern, 0, range[0])
                 if backward:
                     itr = reversed(list(itr))
                 for match in itr:
@@ -423,6 +424,8 @@ class Finder(object):
                     wrapped = True
                 else:
                     break
+        except TimeoutError:
+            raise CommandError("search timed out: {!r}".format(ftext))
 
 
 class FindController(PanelController):
@@ -692,7 +695,7 @@ class FindController(PanelController):
                 flags |= re.IGNORECASE
             error = None
             try:
-                regex = re.compile(ftext, flags)
+                regex.compile(ftext, flags)
                 if self.options.python_replace:
                     make_found_range_factory(self.options)
             except re.error as err:
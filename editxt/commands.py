@@ -473,6 +473,7 @@ def _default_cprofile_delay(editor=None):
         File("path", directory=True, default=_default_project_path),
     ),
     SubArgs("mem-profile"),
+    SubArgs("syntax-report"),
     SubArgs("error"),
     SubArgs("unhandled-error"),
     SubArgs("exec", VarArgs("command", String("command", default=""))),
@@ -487,6 +488,8 @@ def debug(editor, opts):
         indefinitely until stopped if 0).
       - path: directory in which to write profile output.
     - mem-profile: write memory profile in EditXT Log.
+    - syntax-report: write expanded grammar states, regex sizes, and
+      memory of each loaded syntax definition in EditXT Log.
     - error: raise an error immediately.
     - error: raise an unhandled error immediately.
     - exec: execute a python expression. `app` and `editor` are locals
@@ -500,6 +503,9 @@ def debug(editor, opts):
     if sub.name == "mem-profile":
         editor.document.app.open_error_log()
         mem_profile()
+    elif sub.name == "syntax-report":
+        editor.document.app.open_error_log()
+        log.info("syntax definitions:\n%s", editor.app.syntax_factory.report())
     elif sub.name == "error":
         raise Exception("raised by debug command")
     elif sub.name == "unhandled-error":
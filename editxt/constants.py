@@ -41,6 +41,10 @@ PROJECT_EXT = "edxt"
 TEXT_DOCUMENT = "public.plain-text"
 SYNTAX_DEFS_DIR = "syntax"
 SYNTAX_DEF_EXTENSION = ".syntax.py"
+SYNTAX_MANIFEST = "syntax-manifest.json"
+GRAMMAR_CACHE_DIR = "grammars"
+HIGHLIGHT_CACHE_DIR = "highlights"
+CACHE_DIR = 'cache'
 STATE_DIR = 'state'
 CLOSED_DIR = 'closed'
 EDITOR_STATE = 'editor-{}.yaml'
@@ -62,6 +66,27 @@ WINDOW_CONTROLLERS_DEFAULTS_KEY = "window_controllers"
 
 LARGE_NUMBER_FOR_TEXT = 1e7
 
+# documents longer than this are highlighted in a background thread
+BACKGROUND_HIGHLIGHT_LENGTH = 100000
+
+# highlight snapshots are saved for documents at least this long
+HIGHLIGHT_SNAPSHOT_LENGTH = 10000
+# maximum total size (bytes) of saved highlight snapshots
+HIGHLIGHT_CACHE_SIZE = 50 * 1024 * 1024
+
+# files at least this large (bytes) are loaded in chunks of LOAD_CHUNK_SIZE
+# bytes; the first chunk is displayed while the rest are read in a thread
+PROGRESSIVE_LOAD_SIZE = 4 * 1024 * 1024
+LOAD_CHUNK_SIZE = 1024 * 1024
+
+# maximum time (seconds) a single regex match may take (see editxt.regex)
+SYNTAX_MATCH_TIMEOUT = 1.0
+FIND_MATCH_TIMEOUT = 5.0
+
+# the status bar shows the length (in hexichars) of selections longer
+# than this rather than counting composed characters
+MAX_COMPOSED_COUNT = 100000
+
 DEFAULT_RIGHT_MARGIN = 80
 DEFAULT_WRAP_COLUMN = 79
 
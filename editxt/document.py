@@ -17,6 +17,7 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+import codecs
 import logging
 import objc
 import os
@@ -32,7 +33,8 @@ import editxt.platform.constants as platform_const
 
 from editxt.command.util import calculate_indent_mode_and_size
 from editxt.platform.alert import Alert
-from editxt.platform.events import call_later, debounce
+from editxt.platform.events import (call_in_main_thread, call_in_thread,
+    call_later, debounce)
 from editxt.platform.fileref import FileRef
 from editxt.platform.kvo import KVOLink, KVOProxy
 from editxt.platform.text import Text
@@ -46,6 +48,16 @@ log = logging.getLogger(__name__)
 EOLREF = dict((ch, m) for m, ch in const.EOLS.items())
 ALL = object()
 
+# codecs of character encodings that can be decoded progressively, starting
+# at any byte following a newline byte
+PROGRESSIVE_CODECS = {
+    fn.NSUTF8StringEncoding: "utf-8",
+    fn.NSASCIIStringEncoding: "ascii",
+    fn.NSISOLatin1StringEncoding: "latin-1",
+    fn.NSWindowsCP1252StringEncoding: "cp1252",
+    fn.NSMacOSRomanStringEncoding: "mac-roman",
+}
+
 
 class DocumentController(object):
     """A document controller maintains a set of open documents
@@ -149,6 +161,7 @@ class TextDocument(object):
         self.highlight_selected_text = app.config["theme.highlight_selected_text.enabled"]
         self.syntax_needs_color = False
         self._edit_range = None
+        self._loader = None
 
         app.on_reload_config(self.reset_text_attributes, self)
         #self.save_hooks = []
@@ -201,7 +214,7 @@ class TextDocument(object):
             return self._text_storage
         except AttributeError:
             self.text_storage = Text()
-            self._load()
+            self._load(progressive=True)
         return self._text_storage
     @text_storage.setter
     def text_storage(self, value):
@@ -283,14 +296,20 @@ class TextDocument(object):
         }
         return attrs
 
-    def _load(self):
+    def _load(self, progressive=False):
         """Load the document's file contents from disk
 
+        :param progressive: Load large files progressively if true (see
+        `_load_progressively`).
         :returns: True if the file was loaded from disk, otherwise False.
         """
         self.persistent_path = self.file_path
         self._refresh_file_mtime()
         if self._filestat is not None:
+            if progressive and \
+                    self._filestat.st_size >= const.PROGRESSIVE_LOAD_SIZE \
+                    and self._load_progressively():
+                return True
             data = ak.NSData.dataWithContentsOfFile_(self.file_path)
             success, err = self.read_from_data(data)
             if success:
@@ -302,6 +321,89 @@ class TextDocument(object):
         self.reset_text_attributes()
         return False
 
+    def _load_progressively(self):
+        """Load the first chunk of the file and read the rest in a thread
+
+        The first chunk (up to its last newline) is decoded with the
+        usual character encoding detection, and is analyzed and shown
+        immediately. Remaining chunks are decoded with the same encoding
+        and appended to the text in the main thread. The document cannot
+        be edited (see `is_loading`) and syntax highlighting is deferred
+        until the load is complete. If a later chunk cannot be decoded
+        with the detected encoding the whole file is loaded again with
+        the normal (non-progressive) loader.
+
+        :returns: True if loading has started, False if the file cannot
+        be loaded progressively (the first chunk has no newline, or the
+        detected encoding cannot be decoded progressively).
+        """
+        path = self.file_path
+        total = self._filestat.st_size
+        with open(path, "rb") as fh:
+            data = fh.read(const.LOAD_CHUNK_SIZE)
+        end = data.rfind(b"\n") + 1
+        if not end:
+            return False
+        data = ak.NSData.dataWithBytes_length_(data[:end], end)
+        success, err = self.read_from_data(data)
+        codec = PROGRESSIVE_CODECS.get(self.character_encoding)
+        if not success or codec is None:
+            return False
+        self.analyze_content()
+        self.reset_text_attributes()
+        self._loader = loader = object()
+
+        def read():
+            decoder = codecs.getincrementaldecoder(codec)()
+            offset = end
+            with open(path, "rb") as fh:
+                fh.seek(offset)
+                while self._loader is loader:
+                    data = fh.read(const.LOAD_CHUNK_SIZE)
+                    offset += len(data)
+                    try:
+                        text = decoder.decode(data, not data)
+                    except UnicodeDecodeError:
+                        call_in_main_thread(self._loaded, loader, None, None)
+                        break
+                    progress = min(offset / total, 1.0) if data else None
+                    call_in_main_thread(self._loaded, loader, text, progress)
+                    if not data:
+                        break
+
+        call_in_thread(read)
+        return True
+
+    def _loaded(self, loader, text, progress):
+        """Append a progressively loaded chunk of text
+
+        :param text: Text to append, or `None` if the rest of the file
+        could not be decoded, in which case the whole file is reloaded.
+        :param progress: Fraction of the file that has been read, or
+        `None` if loading is complete.
+        """
+        if self._loader is not loader:
+            return
+        if text is None:
+            self._loader = None
+            self._load()
+        elif text:
+            store = self._text_storage
+            store[(len(store), 0)] = text
+        if progress is None:
+            self._loader = None
+            self.color_text()
+        for editor in self.app.iter_editors_of_document(self):
+            editor.show_load_progress(progress)
+
+    @property
+    def is_loading(self):
+        """True if the document is being loaded progressively
+
+        The document should not be edited while it is loading.
+        """
+        return self._loader is not None
+
     def read_from_data(self, data):
         options = {ak.NSDefaultAttributesDocumentOption: self.default_text_attributes()}
         options.update(self.document_attrs)
@@ -323,6 +425,9 @@ class TextDocument(object):
 
         :raises: Error if the document does not have a real path.
         """
+        if self.is_loading:
+            raise Error("cannot save document while it is loading: {}"
+                        .format(self.file_path))
         if not self.has_real_path():
             if isabs(self.file_path):
                 raise Error("parent directory is missing: {}".format(self.file_path))
@@ -451,6 +556,7 @@ class TextDocument(object):
         """
         if not self.file_exists():
             return
+        self._loader = None
         textstore = self._text_storage
         self._text_storage = Text()
         try:
@@ -568,10 +674,60 @@ class TextDocument(object):
 
     @debounce(0.05, _coalesce_edit_ranges)
     def color_text(self, rng):
-        if self.text_storage is not None:
-            self.syntaxer.color_text(self.text_storage, rng, timeout=0.05)
+        if self.text_storage is not None and not self.is_loading:
+            text = self.text_storage
+            threaded = len(text) > const.BACKGROUND_HIGHLIGHT_LENGTH
+            runs = self.load_highlight() if rng is None else None
+            if runs is not None:
+                self.syntaxer.restore(text, runs, timeout=0.05,
+                    threaded=threaded)
+            else:
+                self.syntaxer.color_text(text, rng, timeout=0.05,
+                    threaded=threaded, priority=self.visible_range())
             self._edit_range = None
 
+    def load_highlight(self):
+        """Load highlight snapshot of this document
+
+        :returns: A list of snapshot runs (see `HighlightCache.load`)
+        or `None` if there is no valid snapshot.
+        """
+        cache = self._highlight_cache()
+        if cache is None:
+            return None
+        return cache.load(self.file_path, self.text_storage, self.syntaxdef)
+
+    def save_highlight(self):
+        """Save highlight snapshot of this document
+
+        Nothing is saved if the document has unsaved changes or if it
+        has not been completely highlighted.
+        """
+        cache = self._highlight_cache()
+        if cache is not None and not self.is_dirty():
+            cache.save(self.file_path, self.text_storage,
+                       self.syntaxer.spans, self.syntaxdef)
+
+    def _highlight_cache(self):
+        cache = getattr(self.app.syntax_factory, "highlight_cache", None)
+        text = getattr(self, "_text_storage", None)
+        if cache is None or text is None or self.is_loading \
+                or self.file_mtime is None \
+                or len(text) < const.HIGHLIGHT_SNAPSHOT_LENGTH \
+                or not self.app.config["highlight_snapshots"]:
+            return None
+        return cache
+
+    def visible_range(self):
+        """Get the range of text visible in an editor of this document
+
+        :returns: A range or `None` if the document is not visible.
+        """
+        for editor in self.app.iter_editors_of_document(self):
+            if editor.text_view is not None:
+                return editor.text_view.get_visible_char_range()
+        return None
+
     def __repr__(self):
         return "<%s 0x%x %s>" % (type(self).__name__, id(self), self.name)
 
@@ -580,6 +736,8 @@ class TextDocument(object):
         self.app.context.pop(info)(should_close)
 
     def close(self):
+        self.save_highlight()
+        self._loader = None
         self.text_storage = None
         self.props = None
         self.app.document_closed(self)
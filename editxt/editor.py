@@ -31,7 +31,7 @@ import editxt.platform.constants as platform_const
 from editxt.command.find import Finder, FindOptions
 from editxt.command.util import change_indentation, replace_newlines
 from editxt.document import DocumentController, Error as DocumentError
-from editxt.linenumbers import LineNumbers
+from editxt.linenumbers import Columns, LineNumbers
 from editxt.platform.alert import Alert
 from editxt.platform.document import setup_main_view, teardown_main_view
 from editxt.platform.events import debounce
@@ -234,7 +234,9 @@ class Editor(CommandSubject):
         self.text_view = None
         self.scroll_view = None
         self._goto_line = None
+        self._load_message = None
         self.line_numbers = LineNumbers(self.text)
+        self.columns = Columns(self.text)
         props = document.props
         self.kvolink = KVOLink([
             (props, "is_dirty", self.proxy, "is_dirty"),
@@ -452,7 +454,7 @@ class Editor(CommandSubject):
         :param select: select the edited text if true.
         :returns: true if the change was applied, otherwise false.
         """
-        should_change = (
+        should_change = not self.document.is_loading and (
             self.text_view is None or
             self.text_view.shouldChangeTextInRange_replacementString_(rng, text)
         )
@@ -599,6 +601,37 @@ class Editor(CommandSubject):
         else:
             self.soft_wrap = self.app.config["soft_wrap"]
 
+    def show_load_progress(self, progress):
+        """Show document load progress in the command view
+
+        Progress is not shown over other messages (the result of a
+        command run while the document is loading, for example), and
+        the message is cleared on completion only if it is still shown.
+        The text view is made editable when loading is complete.
+
+        :param progress: Fraction of the document that has been loaded,
+        or `None` if loading is complete.
+        """
+        if progress is None and self.text_view is not None:
+            self.text_view.setEditable_(True)
+        view = self.command_view
+        if view is None:
+            return
+        current = view.message_text
+        shown = current and current == self._load_message
+        if progress is None:
+            self._load_message = None
+            output = self.command_output
+            if output is None or output.process is None:
+                view.is_waiting(False)
+            if shown:
+                self.message("")
+        elif shown or not current:
+            message = "Loading {}... {:.0%}".format(self.name, progress)
+            self.message(message, msg_type=const.INFO)
+            self._load_message = view.message_text
+            view.is_waiting(True)
+
     def goto_line(self, line):
         if self.text_view is None:
             self._goto_line = line
@@ -642,6 +675,7 @@ class Editor(CommandSubject):
         self.command_view = None
         self.proxy = None
         self.line_numbers.close()
+        self.columns.close()
 
     def __repr__(self):
         name = 'N/A' if self.document is None else self.name
@@ -678,12 +712,11 @@ class Editor(CommandSubject):
                         index, length, lines.end,
                         lines.newline_at_end, len(lines))
             line = len(lines)
-        line_index = self.line_numbers.index_of(line)
-        if line_index < index:
-            col = composed_length(text[line_index:index])
+        col = self.columns(self.line_numbers.index_of(line), index)
+        if range[1] > const.MAX_COMPOSED_COUNT:
+            sel = range[1]  # approximate
         else:
-            col = 0
-        sel = composed_length(text[range])
+            sel = composed_length(text[range])
         self.scroll_view.status_view.updateLine_column_selection_(line, col, sel)
 
         if self.document.highlight_selected_text:
@@ -17,18 +17,22 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
-from bisect import bisect
+from array import array
+from bisect import bisect_left
+
+from editxt.spans import OffsetTable
 
 
 class LineNumbers(object):
 
     def __init__(self, text):
         self.text = text
-        self.lines = [0]
+        self.lines = LineStarts()
+        self.length = len(text)
         self.end = None
         self.newline_at_end = None
         def process_edit(edit_range):
-            del self[edit_range[0]]
+            self.edit(*edit_range)
         self.close = text.on_edit(process_edit)
 
     def __getitem__(self, index):
@@ -41,7 +45,7 @@ class LineNumbers(object):
     def __delitem__(self, index):
         """Invalidate line numbers beyond the character at index"""
         if index < self.lines[-1]:
-            line = max(1, bisect(self.lines, index) - 1)
+            line = max(1, self.lines.bisect(index) - 1)
             del self.lines[line:]
         if self.end is not None:
             if index and index == self.lines[-1]:
@@ -49,6 +53,38 @@ class LineNumbers(object):
             self.end = None
             self.newline_at_end = None
 
+    def edit(self, start, length):
+        """Update line numbers after an edit
+
+        Lines within the edited range are re-scanned, and line offsets
+        following it are shifted (lazily, see `OffsetTable`), so the
+        cost of an edit does not depend on the number of lines after it.
+
+        :param start: Start of edited range.
+        :param length: Length of edited range (after edit).
+        """
+        text = self.text
+        text_length = len(text)
+        delta = text_length - self.length
+        self.length = text_length
+        lines = self.lines
+        if start > lines[-1]:
+            del self[start]
+            return
+        stop = start + length
+        # lines starting in the edited range may have changed
+        i = max(lines.bisect(start - 1), 1)
+        j = max(lines.bisect(stop - delta), i)
+        starts = []
+        for rng in text.iter_line_ranges(lines[i - 1], stop + 1):
+            index = sum(rng)
+            if index > stop or index >= text_length:
+                break
+            starts.append(index)
+        lines.splice(i, j, starts, delta)
+        self.end = None
+        self.newline_at_end = None
+
     def __len__(self):
         """Get the highest known line number
 
@@ -69,8 +105,9 @@ class LineNumbers(object):
         lines = self.lines
         index = lines[-1]
         if start <= index:
-            line = bisect(lines, start)
-            for line, index in enumerate(lines[line - 1:], start=line):
+            line = lines.bisect(start)
+            for line in range(line, len(lines) + 1):
+                index = lines[line - 1]
                 yield line, index
             start = index
             prev_line = line
@@ -109,3 +146,128 @@ class LineNumbers(object):
         if self.newline_at_end and len(lines) + 1 == line:
             return self.end
         raise ValueError(line)
+
+
+class Columns(object):
+    """Column number cache
+
+    The columns of requested indexes (anchors) are remembered for the
+    most recently used lines so the column of an index can be found by
+    counting only the characters between it and the nearest anchor or
+    the beginning of its line. Moving the caret along a very long line,
+    back to either end of it, or between long lines is fast as a result.
+    Anchors at or beyond an edit are discarded.
+    """
+
+    # maximum number of lines for which anchors are kept
+    MAX_LINES = 8
+    # minimum number of characters between anchors on a line
+    ANCHOR_SPACING = 1000
+
+    def __init__(self, text):
+        self.text = text
+        self.lines = {}  # line start -> (anchor indexes, anchor columns)
+        def process_edit(edit_range):
+            start = edit_range[0]
+            for line_start in list(self.lines):
+                if line_start > start:
+                    del self.lines[line_start]
+                else:
+                    indexes, columns = self.lines[line_start]
+                    i = bisect_left(indexes, start)
+                    del indexes[i:], columns[i:]
+        self.close = text.on_edit(process_edit)
+
+    def __call__(self, line_start, index):
+        """Get the column of index
+
+        :param line_start: Index of the first character of the line
+        containing index.
+        :param index: Character index.
+        :returns: The number of composed characters between line_start
+        and index.
+        """
+        from editxt.platform.text import composed_length
+        if index <= line_start:
+            return 0
+        text = self.text
+        lines = self.lines
+        if line_start in lines:
+            indexes, columns = lines.pop(line_start)
+        else:
+            indexes, columns = array("q"), array("q")
+            if len(lines) >= self.MAX_LINES:
+                del lines[next(iter(lines))]  # least recently used
+        lines[line_start] = indexes, columns
+        i = bisect_left(indexes, index)
+        if i:
+            prev, column = indexes[i - 1], columns[i - 1]
+        else:
+            prev, column = line_start, 0
+        if i < len(indexes) and indexes[i] - index < index - prev:
+            distance = indexes[i] - index
+            column = columns[i]
+            if distance:
+                column -= composed_length(text[index:indexes[i]])
+        else:
+            distance = index - prev
+            column += composed_length(text[prev:index])
+        if distance >= self.ANCHOR_SPACING:
+            indexes.insert(i, index)
+            columns.insert(i, column)
+        return column
+
+
+class LineStarts(OffsetTable):
+    """Index of the first character of each line
+
+    A list-like `OffsetTable` supporting the subset of list operations
+    used by `LineNumbers`. Only offsets are stored (in an array of 8-byte
+    integers), not values, so each line costs 8 bytes rather than the
+    36 bytes of an int in a list.
+    """
+
+    def clear(self):
+        self.offsets = array("q", [0])
+        self.values = None
+        self._pivot = 1
+        self._delta = 0
+
+    def copy(self):
+        other = type(self).__new__(type(self))
+        other.__dict__.update(self.__dict__)
+        other.offsets = array("q", self.offsets)
+        return other
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self.offsets)
+        return self._offset(i)
+
+    def __iter__(self):
+        for i in range(len(self.offsets)):
+            yield self._offset(i)
+
+    def __delitem__(self, index):
+        i = index.start
+        del self.offsets[i:]
+        self._pivot = min(self._pivot, i)
+
+    def append(self, offset):
+        self.offsets.append(offset - self._delta)
+
+    def pop(self):
+        offset = self[-1]
+        del self[len(self.offsets) - 1:]
+        return offset
+
+    def bisect(self, offset):
+        """Get the index of the first line starting beyond offset"""
+        return self._index(offset)
+
+    def splice(self, i, j, offsets, delta):
+        """Replace lines `[i:j]` and shift the following lines by delta"""
+        self._move_pivot(j)
+        self.offsets[i:j] = array("q", offsets)
+        self._pivot = i + len(offsets)
+        self._delta += delta
@@ -44,6 +44,7 @@ def setup_scroll_view(editor, frame):
 
     text = TextView(editor, frame, container)
     text.setAllowsUndo_(True)
+    text.setEditable_(not editor.document.is_loading)
     text.setVerticallyResizable_(True)
     text.setMaxSize_(fn.NSMakeSize(LARGE_NUMBER_FOR_TEXT, LARGE_NUMBER_FOR_TEXT))
     # setTextContainerInset() with height > 0 causes a strange bug with
@@ -17,10 +17,21 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+import re
+from array import array
+from bisect import bisect_left
+
 import AppKit as ak
 import Foundation as fn
 from objc import NULL, python_method
 
+# initial and maximum number of hexichars scanned by line_batch
+LINE_BATCH_SIZE = 4096
+MAX_LINE_BATCH_SIZE = 1024 * 1024
+
+# line terminators recognized by NSString.lineRangeForRange_
+EOL = re.compile("\r\n|[\n\r\x85\u2028\u2029]")
+
 
 class Text(object):
     """Text storage class
@@ -34,18 +45,27 @@ class Text(object):
         self.store = ak.NSTextStorage.alloc() \
             .initWithString_attributes_(value, {})
         self._delegate = TextStorageDelegate.alloc().init_(self.store)
-        self._surrogates = []
+        # hexichar and code point indexes of surrogate pairs, or None if
+        # there are none. Pairs before _surrogates_end have been indexed.
+        self._surrogates = array("q")
+        self._surrogate_codepoints = array("q")
+        self._surrogates_end = 0
         def prune_surrogates(rng):
             items = self._surrogates
             if items is None:
                 rng = self.string().rangeOfCharacterFromSet_options_range_(
                         UNICODE_SUPPLEMENTARY_PLANES, 0, rng)
                 if rng[0] != ak.NSNotFound:
-                    self._surrogates = [rng[0]]
+                    self._surrogates = array("q")
+                    self._surrogate_codepoints = array("q")
+                    self._surrogates_end = 0
             else:
                 start = rng[0]
-                while items and items[-1] > start:
-                    items.pop()
+                if start < self._surrogates_end:
+                    index = bisect_left(items, start)
+                    del items[index:]
+                    del self._surrogate_codepoints[index:]
+                    self._surrogates_end = start
         self.on_edit(prune_surrogates)
 
     def on_edit(self, callback):
@@ -96,6 +116,10 @@ class Text(object):
     def iter_line_ranges(self, start=0, stop=None):
         """Generate line ranges
 
+        Lines after the first are found in batches by scanning chunks of
+        text for line terminators, which is much faster than finding
+        each line with `line_range`.
+
         :param start: Hexichar index from which to start iterating.
         The default is zero (0).
         :param stop: The last hexichar index to consider. The default is
@@ -105,13 +129,22 @@ class Text(object):
         of the line including newline character(s) in hexichars.
         """
         string = self.store.string()
-        index = start
+        length = string.length()
         if stop is None:
-            stop = string.length()
+            stop = length
+        if start >= stop:
+            return
+        rng = string.lineRangeForRange_((start, 0))
+        yield rng
+        index = sum(rng)
+        size = LINE_BATCH_SIZE
         while index < stop:
-            rng = string.lineRangeForRange_((index, 0))
-            yield rng
+            for rng in line_batch(string, index, length, size):
+                if rng[0] >= stop:
+                    return
+                yield rng
             index = sum(rng)
+            size = min(size * 2, MAX_LINE_BATCH_SIZE)
 
     def iterlines(self, start=0, stop=None):
         """Generate lines of text
@@ -209,36 +242,52 @@ class Text(object):
 
         Or the opposite if direction is `-1`
         """
-        surrs = self._surrogates
         length = len(self)
         if index < 0 or index > length:
             raise IndexError("index {} out of bounds; string length {}".format(
                 index, length))
-        # TODO binary search
-        for i in surrs:
-            if i >= index:
+        if direction > 0:
+            self._index_surrogates(index, codepoint=True)
+            if self._surrogates is None:
                 return index
-            index += direction
+            return index + bisect_left(self._surrogate_codepoints, index)
+        self._index_surrogates(index)
+        if self._surrogates is None:
+            return index
+        return index - bisect_left(self._surrogates, index)
+
+    def _index_surrogates(self, index, codepoint=False):
+        """Find surrogate pairs (if not already found) before index
+
+        :param index: Hexichar index, or code point index if `codepoint`
+        is true.
+        """
+        surrs = self._surrogates
+        codepoints = self._surrogate_codepoints
+        start = self._surrogates_end
+        length = len(self)
+        if codepoint:
+            index += len(surrs)
+        if start >= index or start >= length:
+            return
         get_range = self.string().rangeOfCharacterFromSet_options_range_
         notfound = ak.NSNotFound
         chars = UNICODE_SUPPLEMENTARY_PLANES # surrogate pairs
-        start = (surrs[-1] + 1) if surrs else 0
-        while start < length:
+        while start < index:
             rng = get_range(chars, 0, (start, length - start))
             i = rng[0]
             if i == notfound:
+                start = length
                 break
             assert rng[1] == 2, rng
             surrs.append(i)
-            if i > index:
-                return index
-            index += direction
+            codepoints.append(i - len(codepoints))
             start = i + 2
-        if not surrs:
+            if codepoint and i < index:
+                index += 1
+        self._surrogates_end = start
+        if not surrs and start >= length:
             self._surrogates = None
-        else:
-            surrs.append(length + 1)
-        return index
 
     def count_chars(self, chars, start, end=None):
         """Count the number of characters starting at index
@@ -266,6 +315,48 @@ class Text(object):
         return index - start
 
 
+def line_batch(string, index, length, size=LINE_BATCH_SIZE):
+    """Get ranges of lines in a chunk of text
+
+    :param string: NSString.
+    :param index: Hexichar index of the beginning of a line.
+    :param length: Length of string.
+    :param size: Approximate number of hexichars to scan.
+    :returns: A list of one or more `(location, length)` line ranges.
+    """
+    final = length - index <= size
+    if final:
+        size = length - index
+    else:
+        # do not split surrogate pairs
+        rng = string.rangeOfComposedCharacterSequencesForRange_((index, size))
+        size = sum(rng) - index
+    chunk = string.substringWithRange_((index, size))
+    wide = len(chunk) != size
+    lines = []
+    prev = 0
+    for match in EOL.finditer(chunk):
+        end = match.end()
+        if end == len(chunk) and not final and chunk[-1] == "\r":
+            break  # may be the first half of \r\n
+        width = utf16_length(chunk[prev:end]) if wide else end - prev
+        lines.append((index, width))
+        index += width
+        prev = end
+    if final and prev < len(chunk):
+        width = utf16_length(chunk[prev:]) if wide else len(chunk) - prev
+        lines.append((index, width))
+    elif not lines:
+        # line is longer than chunk
+        lines.append(string.lineRangeForRange_((index, 0)))
+    return lines
+
+
+def utf16_length(string):
+    """Get the number of UTF-16 code units (hexichars) in string"""
+    return len(string.encode("utf-16-le", "surrogatepass")) // 2
+
+
 def composed_length(string, enumerate=False):
     """Get the length of the string as seen by a human
 
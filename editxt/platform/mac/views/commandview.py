@@ -159,6 +159,11 @@ class CommandView(DualView):
     def output_text(self):
         return self.output.textStorage()
 
+    @property
+    def message_text(self):
+        """The plain text of the message in the output pane"""
+        return self.output.string()
+
     @python_method
     def activate(self, command, initial_text="", select=False):
         new_activation = not self.active
@@ -0,0 +1,580 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2015 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+"""Pure-Python text storage
+
+A rope (balanced binary tree of string chunks) implementing the API of
+`editxt.platform.mac.text.Text` without AppKit. Edits are O(log n).
+Each node caches the number of code points, UTF-16 code units and line
+terminators beneath it, so index conversion and line lookups are also
+O(log n) (plus the length of a leaf).
+"""
+import re
+import unicodedata
+
+# maximum number of code points in a leaf
+LEAF_SIZE = 1024
+
+# line terminators recognized by NSString.lineRangeForRange_
+EOL_CHARS = "\n\r\x85\u2028\u2029"
+EOL = re.compile("[{}]".format(EOL_CHARS))
+
+
+class Text(object):
+    """Text storage class
+
+    All indexes used by this class are hexichar indexes (what Apple
+    calls *unichar*), which are UTF-16-encoded code units.
+    See `editxt.platform.mac.text.Text`
+    """
+
+    def __init__(self, value=""):
+        self._root = _build(str(value))
+        self._string = None
+        self._callbacks = set()
+
+    def on_edit(self, callback):
+        self._callbacks.add(callback)
+        return lambda: self._callbacks.discard(callback)
+
+    def __getitem__(self, index):
+        """Get a string for the given index or slice
+
+        Index must be a hexichar index. In the case of slices or ranges,
+        all must use hexichar indices.
+        """
+        start, stop = self._char_range(index)
+        return "".join(_iter_chunks(self._root, start, stop))
+
+    def __setitem__(self, index, value):
+        start, stop = self._char_range(index)
+        value = str(value)
+        self._root = _replace(self._root, start, stop, value)
+        self._string = None
+        rng = (self._hexichar_index(start), _units(value))
+        for callback in list(self._callbacks):
+            callback(rng)
+
+    def _char_range(self, index):
+        """Convert hexichar index, slice or range to code point range"""
+        length = len(self)
+        start, size = index_to_range(index, length)
+        if start < 0 or size < 0 or start + size > length:
+            raise IndexError("range {} out of bounds; string length {}"
+                             .format((start, size), length))
+        return self._codepoint_index(start), self._codepoint_index(start + size)
+
+    def __contains__(self, value):
+        return value in self.string()
+
+    def __len__(self):
+        return self._root.units
+
+    def length(self):
+        return self._root.units
+
+    def string(self):
+        if self._string is None:
+            root = self._root
+            self._string = "".join(_iter_chunks(root, 0, root.chars))
+        return self._string
+
+    __str__ = string
+
+    def __repr__(self):
+        return repr(self.string())
+
+    def line_range(self, rng):
+        """Get line range for a range of text"""
+        root = self._root
+        first = start = self._codepoint_index(rng[0])
+        stop = self._codepoint_index(rng[0] + rng[1]) if rng[1] else start
+        if 0 < start < root.chars and _char_at(root, start) == "\n" \
+                and _char_at(root, start - 1) == "\r":
+            start -= 1
+        start = _rfind_eol(root, start) + 1
+        last = stop - 1 if stop > first else first
+        end = _find_eol(root, last)
+        if end < 0:
+            end = root.chars
+        else:
+            if _char_at(root, end) == "\r" and end + 1 < root.chars \
+                    and _char_at(root, end + 1) == "\n":
+                end += 1
+            end += 1
+        start = self._hexichar_index(start)
+        return (start, self._hexichar_index(end) - start)
+
+    def iter_line_ranges(self, start=0, stop=None):
+        """Generate line ranges
+
+        :param start: Hexichar index from which to start iterating.
+        The default is zero (0).
+        :param stop: The last hexichar index to consider. The default is
+        the last hexichar index.
+        :yields: Two-tuples `(location, length)`. `location` is the
+        beginning of the line in hexichars, and `length` is the length
+        of the line including newline character(s) in hexichars.
+        """
+        index = start
+        if stop is None:
+            stop = len(self)
+        while index < stop:
+            rng = self.line_range((index, 0))
+            yield rng
+            index = sum(rng)
+
+    def iterlines(self, start=0, stop=None):
+        """Generate lines of text
+
+        See `iter_line_ranges`
+        """
+        for rng in self.iter_line_ranges(start, stop):
+            yield self[rng]
+
+    def ends_with_newline(self):
+        root = self._root
+        return bool(root.chars) and _char_at(root, root.chars - 1) in EOL_CHARS
+
+    def find(self, sub, start=None, end=None):
+        """Find substring"""
+        return self.find_range(sub, start, end)[0]
+
+    def rfind(self, sub, start=None, end=None):
+        """Reverse find substring"""
+        return self.find_range(sub, start, end, True)[0]
+
+    def find_range(self, sub, start=None, end=None, reverse=False, matchcase=True):
+        """Find range of substring
+
+        Unlike the AppKit implementation this is not locale-aware.
+
+        :returns: A range tuple `(offset, length)`, `(-1, 0)` if not found.
+        """
+        if start is None:
+            start = 0
+        else:
+            start = index_to_range(start, 0)[0]
+        if end is None:
+            end = len(self)
+        else:
+            end = index_to_range(end, 0)[0]
+        assert start >= 0, start
+        assert end >= start, (start, end)
+        offset = self._codepoint_index(start)
+        string = "".join(_iter_chunks(
+            self._root, offset, self._codepoint_index(end)))
+        if not matchcase:
+            string = string.lower()
+            sub = sub.lower()
+        index = string.rfind(sub) if reverse else string.find(sub)
+        if index < 0:
+            return (-1, 0)
+        index = self._hexichar_index(offset + index)
+        return (index, _units(sub))
+
+    def search(self, regex, pos=None, endpos=None):
+        """Search this text with the given regex
+
+        Indexes passed to this object are expected to be NSString
+        hexichar indexes. Indexes retrieved from the resulting match
+        object (if any) will be NSString hexichar indexes.
+        """
+        pos = 0 if pos is None else self._codepoint_index(pos)
+        if self._root.units == self._root.chars:
+            if endpos is None:
+                return regex.search(self.string(), pos)
+            return regex.search(self.string(), pos, endpos)
+        end = self._codepoint_index(len(self) if endpos is None else endpos)
+        match = regex.search(self.string(), pos, end)
+        return TextMatch(match, self) if match is not None else None
+
+    def finditer(self, regex, pos=None, endpos=None):
+        """Iterfind on this text with the given regex
+
+        Indexes passed to this object are expected to be NSString
+        hexichar indexes. Indexes retrieved from the resulting match
+        object (if any) will be NSString hexichar indexes.
+        """
+        pos = 0 if pos is None else self._codepoint_index(pos)
+        if self._root.units == self._root.chars:
+            if endpos is None:
+                return regex.finditer(self.string(), pos)
+            return regex.finditer(self.string(), pos, endpos)
+        end = self._codepoint_index(len(self) if endpos is None else endpos)
+        return (TextMatch(match, self)
+            for match in regex.finditer(self.string(), pos, end))
+
+    def _codepoint_index(self, hexichar_index):
+        """hexichar index -> codepoint index"""
+        root = self._root
+        if root.units == root.chars:
+            return hexichar_index
+        if hexichar_index < 0 or hexichar_index > root.units:
+            raise IndexError("index {} out of bounds; string length {}"
+                             .format(hexichar_index, root.units))
+        return _char_index(root, hexichar_index)
+
+    def _hexichar_index(self, codepoint_index):
+        """codepoint index -> hexichar index"""
+        root = self._root
+        if root.units == root.chars:
+            return codepoint_index
+        if codepoint_index < 0 or codepoint_index > root.chars:
+            raise IndexError("index {} out of bounds; string length {}"
+                             .format(codepoint_index, root.chars))
+        return _unit_index(root, codepoint_index)
+
+    def count_chars(self, chars, start, end=None):
+        """Count the number of characters starting at index
+
+        :param chars: A set of characters to match while counting.
+        Counting stops when a character is found that is not in this
+        set.
+        :param start: The index from which to start counting.
+        :param end: The index at which to stop counting. Defaults to the
+        length of the string.
+        :returns: A number greater than or equal to zero.
+        """
+        length = len(self)
+        if start < 0:
+            raise NotImplementedError('not tested, or needed yet')
+        if end is None or end > length:
+            end = length
+        elif end < 0:
+            raise NotImplementedError('not tested, or needed yet')
+        if start >= end:
+            return 0
+        count = 0
+        root = self._root
+        chunks = _iter_chunks(
+            root, self._codepoint_index(start), self._codepoint_index(end))
+        for chunk in chunks:
+            for char in chunk:
+                if char not in chars:
+                    return count
+                count += 2 if char > "\uffff" else 1
+        return count
+
+
+def composed_length(string, enumerate=False):
+    """Get the length of the string as seen by a human
+
+    This counts code points after canonical composition, which is an
+    approximation of `editxt.platform.mac.text.composed_length`.
+
+    :param string: A string.
+    :param enumerate: Ignored.
+    """
+    return len(unicodedata.normalize("NFC", str(string)))
+
+
+def index_to_range(index, length):
+    if isinstance(index, int):
+        return (index, 1)
+    if isinstance(index, tuple):
+        return index
+    if not isinstance(index, slice) or index.step is not None:
+        raise ValueError("cannot convert {!r} to range".format(index))
+    start = min(0 if index.start is None else index.start, length)
+    if start < 0:
+        start = convert_negative_index(start, length, 0)
+    stop = min(length if index.stop is None else index.stop, length)
+    if stop < 0:
+        stop = convert_negative_index(stop, length, 0)
+    if start > stop:
+        raise ValueError(index)
+    return start, stop - start
+
+
+def convert_negative_index(index, length, underflow=None):
+    if index >= 0:
+        raise ValueError("expected negative index")
+    value = length + index
+    if value < 0:
+        if underflow is None:
+            raise IndexError(index)
+        value = underflow
+    return value
+
+
+class TextMatch:
+
+    def __init__(self, match, text):
+        self.match = match
+        self.text = text
+
+    def __getattr__(self, name):
+        return getattr(self.match, name)
+
+    def __repr__(self):
+        try:
+            value = "{!r} span={}".format(self[0], self.span())
+        except Exception:
+            value = repr(self.match)
+        return "<{} {}>".format(type(self).__name__, value)
+
+    __str__ = __repr__
+
+    def start(self, *group):
+        return self.text._hexichar_index(self.match.start(*group))
+
+    def end(self, *group):
+        return self.text._hexichar_index(self.match.end(*group))
+
+    def span(self, *group):
+        start, end = self.match.span(*group)
+        return self.text._hexichar_index(start), self.text._hexichar_index(end)
+
+
+def _units(string):
+    """Get the number of UTF-16 code units in string"""
+    return len(string.encode("utf-16-le", "surrogatepass")) // 2
+
+
+class Leaf(object):
+    """Rope leaf containing a chunk of text"""
+
+    __slots__ = ("text", "chars", "units", "eols")
+    height = 0
+
+    def __init__(self, text):
+        self.text = text
+        self.chars = len(text)
+        self.units = _units(text)
+        self.eols = sum(text.count(c) for c in EOL_CHARS)
+
+    def __repr__(self):
+        return "<Leaf {!r}>".format(self.text)
+
+
+class Node(object):
+    """Rope branch node
+
+    Use `_join` rather than creating these directly to keep the tree
+    balanced.
+    """
+
+    __slots__ = ("left", "right", "chars", "units", "eols", "height")
+    text = None
+
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+        self.chars = left.chars + right.chars
+        self.units = left.units + right.units
+        self.eols = left.eols + right.eols
+        self.height = max(left.height, right.height) + 1
+
+    def __repr__(self):
+        return "<Node {!r} {!r}>".format(self.left, self.right)
+
+
+def _build(string):
+    """Build a balanced rope from a string"""
+    nodes = [Leaf(string[i:i + LEAF_SIZE])
+             for i in range(0, len(string), LEAF_SIZE)]
+    if not nodes:
+        return Leaf("")
+    while len(nodes) > 1:
+        nodes = [_join(*nodes[i:i + 2]) for i in range(0, len(nodes), 2)]
+    return nodes[0]
+
+
+def _node(left, right):
+    """Make a node from balanced trees with heights differing by <= 2"""
+    lh = left.height
+    rh = right.height
+    if lh > rh + 1:
+        if left.left.height >= left.right.height:
+            return Node(left.left, Node(left.right, right))
+        mid = left.right
+        return Node(Node(left.left, mid.left), Node(mid.right, right))
+    if rh > lh + 1:
+        if right.right.height >= right.left.height:
+            return Node(Node(left, right.left), right.right)
+        mid = right.left
+        return Node(Node(left, mid.left), Node(mid.right, right.right))
+    return Node(left, right)
+
+
+def _join(left, right=None):
+    """Concatenate two balanced trees, either of which may be `None`"""
+    if left is None or not left.chars:
+        return right
+    if right is None or not right.chars:
+        return left
+    lh = left.height
+    rh = right.height
+    if lh > rh + 1:
+        return _node(left.left, _join(left.right, right))
+    if rh > lh + 1:
+        return _node(_join(left, right.left), right.right)
+    if not lh and not rh and left.chars + right.chars <= LEAF_SIZE:
+        return Leaf(left.text + right.text)
+    return Node(left, right)
+
+
+def _split(node, index):
+    """Split tree at code point index
+
+    :returns: A two-tuple of trees, either of which may be `None`.
+    """
+    if index <= 0:
+        return None, node
+    if index >= node.chars:
+        return node, None
+    if node.text is not None:
+        return Leaf(node.text[:index]), Leaf(node.text[index:])
+    size = node.left.chars
+    if index < size:
+        left, right = _split(node.left, index)
+        return left, _join(right, node.right)
+    if index > size:
+        left, right = _split(node.right, index - size)
+        return _join(node.left, left), right
+    return node.left, node.right
+
+
+def _find_leaf(node, index):
+    """Find leaf containing code point index
+
+    :returns: A two-tuple `(offset, leaf)`.
+    """
+    offset = 0
+    while node.text is None:
+        size = node.left.chars
+        if index < size:
+            node = node.left
+        else:
+            index -= size
+            offset += size
+            node = node.right
+    return offset, node
+
+
+def _replace(root, start, stop, value):
+    """Replace code points between start and stop with value
+
+    The leaves containing start and stop are rebuilt along with the new
+    value to avoid fragmenting the tree with small leaves.
+    """
+    lo, leaf = _find_leaf(root, start)
+    value = leaf.text[:start - lo] + value
+    hi, leaf = _find_leaf(root, stop)
+    value += leaf.text[stop - hi:]
+    left, rest = _split(root, lo)
+    if rest is not None:
+        rest = _split(rest, hi + leaf.chars - lo)[1]
+    return _join(_join(left, _build(value)), rest) or Leaf("")
+
+
+def _iter_chunks(node, start, stop):
+    """Generate strings for code points between start and stop"""
+    if start >= stop:
+        return
+    if node.text is not None:
+        if start or stop < node.chars:
+            yield node.text[start:stop]
+        else:
+            yield node.text
+        return
+    size = node.left.chars
+    if start < size:
+        yield from _iter_chunks(node.left, start, min(stop, size))
+    if stop > size:
+        yield from _iter_chunks(node.right, max(start - size, 0), stop - size)
+
+
+def _char_at(node, index):
+    offset, leaf = _find_leaf(node, index)
+    return leaf.text[index - offset]
+
+
+def _char_index(node, index):
+    """Convert hexichar index to code point index"""
+    chars = 0
+    while node.text is None:
+        left = node.left
+        if index < left.units:
+            node = left
+        else:
+            index -= left.units
+            chars += left.chars
+            node = node.right
+    if node.units == node.chars:
+        return chars + index
+    for char in node.text:
+        if index <= 0:
+            break
+        index -= 2 if char > "\uffff" else 1
+        chars += 1
+    return chars
+
+
+def _unit_index(node, index):
+    """Convert code point index to hexichar index"""
+    units = 0
+    while node.text is None:
+        left = node.left
+        if index < left.chars:
+            node = left
+        else:
+            index -= left.chars
+            units += left.units
+            node = node.right
+    if node.units == node.chars:
+        return units + index
+    return units + _units(node.text[:index])
+
+
+def _find_eol(node, start, offset=0):
+    """Find the first line terminator at or after start
+
+    :returns: Code point index or -1 if not found.
+    """
+    if not node.eols or start >= node.chars:
+        return -1
+    if node.text is not None:
+        match = EOL.search(node.text, start)
+        return offset + match.start() if match is not None else -1
+    size = node.left.chars
+    if start < size:
+        index = _find_eol(node.left, start, offset)
+        if index >= 0:
+            return index
+    return _find_eol(node.right, max(start - size, 0), offset + size)
+
+
+def _rfind_eol(node, stop, offset=0):
+    """Find the last line terminator before stop
+
+    :returns: Code point index or -1 if not found.
+    """
+    if not node.eols or stop <= 0:
+        return -1
+    if node.text is not None:
+        index = max(node.text.rfind(c, 0, stop) for c in EOL_CHARS)
+        return offset + index if index >= 0 else -1
+    size = node.left.chars
+    if stop > size:
+        index = _rfind_eol(node.right, stop - size, offset + size)
+        if index >= 0:
+            return index
+    return _rfind_eol(node.left, min(stop, size), offset)
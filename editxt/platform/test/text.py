@@ -17,4 +17,8 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
-from editxt.platform.mac.text import Text
+try:
+    from editxt.platform.mac.text import composed_length, Text
+except ImportError:
+    # AppKit is not available
+    from editxt.platform.test.rope import composed_length, Text
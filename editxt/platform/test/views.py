@@ -94,6 +94,10 @@ class CommandView(object):
     def message(self, message, msg_type=INFO):
         self.output_text = message
 
+    @property
+    def message_text(self):
+        return self.output_text
+
     def is_waiting(self, waiting=None):
         if waiting is not None:
             self.waiting = waiting
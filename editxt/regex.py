@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2015 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+"""Regular expression engine with match timeouts
+
+Patterns are compiled with the third-party `regex` package if it is
+installed (it is listed in requires.txt). It can interrupt a single
+long-running match and has faster Unicode matching than `re`. Otherwise
+`re` is used, and slow matches can only be detected (and cut off)
+between matches: a single catastrophically backtracking match cannot be
+interrupted and will block the calling thread until it finishes.
+"""
+import logging
+import re
+from functools import partial
+from time import time
+
+log = logging.getLogger(__name__)
+
+try:
+    import regex as _regex
+except ImportError:
+    _regex = None
+    log.warning("regex package not available; using re (slow matches "
+                "cannot be interrupted)")
+
+ENGINE = "re" if _regex is None else "regex"
+
+error = re.error
+
+
+def compile(pattern, flags=0, timeout=None):
+    """Compile a regular expression with the best available engine
+
+    The pattern is compiled with `re` if the `regex` engine cannot
+    compile it, so the accepted syntax is at least that of `re`.
+
+    :param pattern: Regular expression string.
+    :param flags: `re` flags.
+    :param timeout: Maximum number of seconds allowed for a single
+    match. `TimeoutError` is raised by `search`, `match` or (the
+    iterator returned by) `finditer` when it is exceeded. No limit
+    if `None`. If the pattern is compiled with `re` the timeout is
+    only checked between matches of `finditer`; it cannot interrupt
+    a match in progress.
+    :returns: A `Regex` object.
+    :raises: `re.error` if the pattern is invalid.
+    """
+    if _regex is not None:
+        try:
+            compiled = _regex.compile(pattern, flags)
+        except Exception:
+            log.debug("regex cannot compile %r", pattern, exc_info=True)
+            if timeout is not None:
+                log.warning("using re for %r: slow matches cannot be "
+                            "interrupted", pattern)
+        else:
+            return Regex(compiled, timeout)
+    return Regex(re.compile(pattern, flags), timeout)
+
+
+class Regex(object):
+    """Compiled regular expression
+
+    Supports the subset of the compiled `re` pattern interface used by
+    `Text.search` and `Text.finditer`: `search`, `match` and `finditer`
+    accept `(string, pos, endpos)` arguments.
+    """
+
+    def __init__(self, compiled, timeout=None):
+        self.compiled = compiled
+        self.timeout = timeout
+        self.engine = "re" if isinstance(compiled, re.Pattern) else "regex"
+        if timeout is None:
+            self.search = compiled.search
+            self.match = compiled.match
+            self.finditer = compiled.finditer
+        elif self.engine == "re":
+            # re cannot interrupt a match in progress
+            self.search = compiled.search
+            self.match = compiled.match
+        else:
+            self.search = partial(compiled.search, timeout=timeout)
+            self.match = partial(compiled.match, timeout=timeout)
+            # regex applies the timeout of finditer to the entire iteration
+            self.finditer = self._finditer_regex
+
+    @property
+    def pattern(self):
+        return self.compiled.pattern
+
+    @property
+    def flags(self):
+        return self.compiled.flags
+
+    @property
+    def groups(self):
+        return self.compiled.groups
+
+    @property
+    def groupindex(self):
+        return self.compiled.groupindex
+
+    def finditer(self, string, pos=0, endpos=None):
+        """Iterate matches, raising TimeoutError after a slow match
+
+        This is only used with `re` patterns that have a timeout.
+        """
+        timeout = self.timeout
+        if endpos is None:
+            endpos = len(string)
+        start = time()
+        for match in self.compiled.finditer(string, pos, endpos):
+            if time() - start > timeout:
+                raise TimeoutError("match took more than {} seconds: {!r}"
+                                   .format(timeout, self.pattern))
+            yield match
+            start = time()
+
+    def _finditer_regex(self, string, pos=0, endpos=None):
+        """Iterate matches, raising TimeoutError if a match is slow
+
+        This is used with `regex` patterns that have a timeout. Each
+        match is found with a separate call so the timeout applies to
+        every match rather than to the entire iteration.
+        """
+        compiled = self.compiled
+        timeout = self.timeout
+        if endpos is None:
+            endpos = len(string)
+        match = compiled.search(string, pos, endpos, timeout=timeout)
+        while match is not None:
+            yield match
+            start, pos = match.span()
+            if start == pos:
+                # the match following an empty match may not be empty
+                # at the same position: let finditer skip it
+                matches = compiled.finditer(
+                    string, pos, endpos, timeout=timeout)
+                next(matches)
+                match = next(matches, None)
+            else:
+                match = compiled.search(string, pos, endpos, timeout=timeout)
+
+    def __repr__(self):
+        return "<{} {} {!r}>".format(
+            type(self).__name__, self.engine, self.pattern)
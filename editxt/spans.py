@@ -0,0 +1,445 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2015 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+from array import array
+from bisect import bisect
+
+
+class _Unknown(object):
+    """Info of text that has not been highlighted since it was edited
+
+    Defined here rather than with `editxt.constants.Constant` so this
+    module can be used without PyObjC.
+    """
+
+    def __repr__(self):
+        return "UNKNOWN"
+
+UNKNOWN = _Unknown()
+
+
+class OffsetTable(object):
+    """Sorted table of `(offset, value)` pairs
+
+    The first entry is always at offset zero. Offsets following an edit
+    are shifted lazily: the shift is only applied to entries between
+    successive edits, so the cost of an edit does not depend on the
+    number of entries that follow it.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self, value=None):
+        self.offsets = array("q", [0])
+        self.values = [value]
+        self._pivot = 1  # offsets[_pivot:] must be shifted by _delta
+        self._delta = 0
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def copy(self):
+        """Get a copy of this table that can be modified independently"""
+        other = type(self).__new__(type(self))
+        other.__dict__.update(self.__dict__)
+        other.offsets = array("q", self.offsets)
+        other.values = list(self.values)
+        return other
+
+    def __iter__(self):
+        """Generate `(offset, value)` pairs"""
+        for i, value in enumerate(self.values):
+            yield self._offset(i), value
+
+    def items(self, start, stop):
+        """Get a list of `(offset, value)` pairs with offsets in range
+
+        :param start: The least offset to include.
+        :param stop: The greatest offset to include.
+        """
+        i = max(self._index(start - 1), 0)
+        j = self._index(stop)
+        return [(self._offset(k), self.values[k]) for k in range(i, j)]
+
+    def _offset(self, i):
+        return self.offsets[i] + (self._delta if i >= self._pivot else 0)
+
+    def _index(self, offset):
+        """Get the index of the first entry beyond offset"""
+        offsets = self.offsets
+        pivot = self._pivot
+        if pivot < len(offsets) and offset >= offsets[pivot] + self._delta:
+            return bisect(offsets, offset - self._delta, pivot)
+        return bisect(offsets, offset, 0, pivot)
+
+    def _move_pivot(self, index):
+        offsets = self.offsets
+        index = min(index, len(offsets))
+        pivot = self._pivot
+        delta = self._delta
+        if delta:
+            if index > pivot:
+                for i in range(pivot, index):
+                    offsets[i] += delta
+            else:
+                for i in range(index, pivot):
+                    offsets[i] -= delta
+        self._pivot = index
+
+    def _splice(self, i, j, offsets, values, delta=0):
+        """Replace entries `[i:j]` and shift the following entries
+
+        :param offsets: A list of (unshifted) offsets to insert.
+        :param values: A list of values corresponding to `offsets`.
+        :param delta: Amount to shift entries following `j`.
+        """
+        self._move_pivot(j)
+        self.offsets[i:j] = array("q", offsets)
+        self.values[i:j] = values
+        self._pivot = i + len(offsets)
+        self._delta += delta
+
+    def before(self, index):
+        """Get the last `(offset, value)` pair at or before index"""
+        i = max(self._index(index) - 1, 0)
+        return self._offset(i), self.values[i]
+
+    def truncate(self, index):
+        """Discard entries beyond index"""
+        i = max(self._index(index), 1)
+        del self.offsets[i:]
+        del self.values[i:]
+        self._pivot = min(self._pivot, i)
+
+
+class Checkpoints(OffsetTable):
+    """Lexer state at line boundaries
+
+    A compact side table of `(offset, key)` pairs, sorted by offset,
+    where `key` is the `SyntaxDefinition.key` active at the beginning
+    of the line at `offset` (the empty string for the root definition).
+    The beginning of the text is always a checkpoint.
+    """
+
+    def clear(self):
+        super().clear("")
+
+    def edit(self, start, stop, delta):
+        """Update checkpoints for edit
+
+        Checkpoints within the edited range are discarded, and those
+        following it are shifted by `delta`.
+
+        :param start: Start of edited range.
+        :param stop: End of edited range (after edit).
+        :param delta: Change in length of text.
+        """
+        i = self._index(start)
+        j = max(self._index(stop - delta), i)
+        self._splice(i, j, [], [], delta)
+
+    def replace(self, start, offset, key):
+        """Set checkpoint at offset
+
+        Checkpoints between `start` and `offset` (exclusive) are
+        discarded.
+
+        :returns: The previous key at offset or `None` if there was no
+        checkpoint at offset.
+        """
+        i = self._index(start)
+        j = max(self._index(offset - 1), i)
+        if j < len(self.offsets) and self._offset(j) == offset:
+            old = self.values[j]
+            self._splice(i, j + 1, [offset], [key])
+        else:
+            old = None
+            self._splice(i, j, [offset], [key])
+        return old
+
+    def get(self, offset):
+        """Get the key of the checkpoint at offset
+
+        :returns: The key or `None` if there is no checkpoint at offset.
+        """
+        i = self._index(offset) - 1
+        if i >= 0 and self._offset(i) == offset:
+            return self.values[i]
+        return None
+
+    def update(self, start, entries):
+        """Replace a sequence of checkpoints
+
+        This is equivalent to calling `replace(start, offset, key)` for
+        each entry, passing the offset of the previous entry as `start`
+        after the first, but only shifts the table once.
+
+        :param start: Checkpoints beyond this offset, up to and
+        including the offset of the last entry, are discarded.
+        :param entries: A list of `(offset, key)` pairs sorted by
+        offset, all greater than `start`.
+        """
+        if not entries:
+            return
+        i = self._index(start)
+        j = max(self._index(entries[-1][0]), i)
+        self._splice(i, j,
+            [offset for offset, key in entries],
+            [key for offset, key in entries])
+
+
+class Symbols(OffsetTable):
+    """Definitions found in highlighted text
+
+    A side table of `(offset, name)` pairs, sorted by offset, where
+    `offset` is the start of a definition name (see
+    `SyntaxDefinition.symbol_regex`). The entry at offset zero with
+    name `None` is a placeholder, which is not iterated.
+    """
+
+    def clear(self):
+        super().clear(None)
+        self._names = None
+
+    def __iter__(self):
+        """Generate `(offset, name)` pairs"""
+        values = self.values
+        for i in range(1, len(values)):
+            yield self._offset(i), values[i]
+
+    def _first(self, offset):
+        """Get the index of the first symbol at or beyond offset"""
+        return max(self._index(offset - 1), 1)
+
+    def _splice(self, i, j, offsets, values, delta=0):
+        super()._splice(i, j, offsets, values, delta)
+        if i != j or offsets:
+            self._names = None
+
+    def edit(self, start, stop, delta):
+        """Update symbols for edit
+
+        Symbols within the edited range are discarded, and those
+        following it are shifted by `delta`.
+
+        :param start: Start of edited range.
+        :param stop: End of edited range (after edit).
+        :param delta: Change in length of text.
+        """
+        i = self._first(start)
+        j = max(self._first(stop - delta), i)
+        self._splice(i, j, [], [], delta)
+
+    def update(self, start, stop, entries):
+        """Replace symbols in range
+
+        :param start: Start of range.
+        :param stop: End of range. Symbols at offsets in `[start, stop)`
+        are discarded.
+        :param entries: A list of `(offset, name)` pairs sorted by
+        offset, all within the range.
+        """
+        i = self._first(start)
+        j = max(self._first(stop), i)
+        self._splice(i, j,
+            [offset for offset, name in entries],
+            [name for offset, name in entries])
+
+    def names(self):
+        """Get a dict of `{name: [index, ...]}`
+
+        The dict is rebuilt after symbols are added or removed.
+        """
+        names = self._names
+        if names is None:
+            names = self._names = {}
+            values = self.values
+            for i in range(1, len(values)):
+                names.setdefault(values[i], []).append(i)
+        return names
+
+    def find(self, regex):
+        """Find symbols by name
+
+        :param regex: A compiled regular expression, which must match
+        the entire name of a symbol.
+        :returns: A list of `(offset, name)` pairs sorted by offset.
+        """
+        return sorted(
+            (self._offset(i), name)
+            for name, indexes in self.names().items()
+            if regex.fullmatch(name)
+            for i in indexes)
+
+
+class Spans(OffsetTable):
+    """Highlighted token spans
+
+    A run-length array of `(start, length, info, key)` runs covering
+    the entire text. `info` is the `MatchInfo` of a matched token, the
+    color name of unmatched text, `None` for default text color, or
+    `UNKNOWN` if the text has been edited since it was highlighted.
+    `key` is the key of the syntax definition that was active when the
+    run was scanned. Adjacent runs with the same `info` object and
+    equal keys are merged; a token is never merged with unmatched text
+    having a color name equal to the token's `MatchInfo`.
+    """
+
+    def __init__(self, length=0):
+        self.clear(length)
+
+    def clear(self, length=0, info=UNKNOWN):
+        super().clear((info, ""))
+        self.length = length
+
+    def __iter__(self):
+        """Generate `(start, length, info, key)` runs"""
+        return self.iter_runs(0, self.length)
+
+    def iter_runs(self, start, stop):
+        """Generate `(start, length, info, key)` runs in range
+
+        Runs are clipped to the given range.
+        """
+        stop = min(stop, self.length)
+        if start >= stop:
+            return
+        offsets = self.offsets
+        values = self.values
+        count = len(offsets)
+        i = max(self._index(start) - 1, 0)
+        begin = start
+        while begin < stop:
+            i += 1
+            end = min(self._offset(i), stop) if i < count else stop
+            info, key = values[i - 1]
+            yield begin, end - begin, info, key
+            begin = end
+
+    def at(self, index):
+        """Get the `(start, length, info, key)` run containing index"""
+        if index < 0 or index >= self.length:
+            raise IndexError(index)
+        i = self._index(index)
+        start = self._offset(i - 1)
+        end = self._offset(i) if i < len(self.offsets) else self.length
+        info, key = self.values[i - 1]
+        return start, end - start, info, key
+
+    def key_at(self, index):
+        """Get the syntax definition key of the run containing index"""
+        if index >= self.length:
+            return ""
+        return self.values[self._index(index) - 1][1]
+
+    def edit(self, start, stop, delta):
+        """Update spans for edit
+
+        The edited range becomes a single `UNKNOWN` run, and runs
+        following it are shifted by `delta`.
+
+        :param start: Start of edited range.
+        :param stop: End of edited range (after edit).
+        :param delta: Change in length of text.
+        """
+        runs = [(start, (UNKNOWN, ""))] if stop > start else []
+        self._replace(start, stop - delta, runs, delta)
+
+    def replace(self, start, stop, runs, value=None):
+        """Replace runs in range
+
+        :param start: Start of range to replace.
+        :param stop: End of range to replace.
+        :param runs: A sequence of `(offset, (info, key))` pairs, sorted
+        by offset. The first offset must equal `start`. Each run extends
+        to the offset of the next or to `stop`.
+        :param value: A function returning the value (a color, for
+        example) of an `info` object. A range is changed only if the
+        value of its `info` has changed, and adjacent changes having
+        equal values are merged. `info` objects are compared if this
+        is `None`.
+        :returns: A list of `(start, length, info)` changes, one for
+        each range (of maximal length) whose `info` has changed.
+        """
+        if value is None:
+            value = lambda info: info
+        changes = []
+        old = self.iter_runs(start, stop)
+        new = iter(runs)
+        ostart, olen, oinfo, okey = next(old, (stop, 0, None, ""))
+        oend = ostart + olen
+        nstart, (ninfo, nkey) = next(new, (stop, (None, "")))
+        nnext, nvalue = next(new, (stop, None))
+        begin = start
+        while begin < stop:
+            while begin == nnext and nvalue is not None:
+                ninfo, nkey = nvalue
+                nnext, nvalue = next(new, (stop, None))
+            end = min(oend, nnext)
+            nval = value(ninfo)
+            if oinfo is UNKNOWN or value(oinfo) != nval:
+                if changes and changes[-1][3] == nval \
+                        and sum(changes[-1][:2]) == begin:
+                    changes[-1][1] += end - begin
+                else:
+                    changes.append([begin, end - begin, ninfo, nval])
+            begin = end
+            if begin == oend:
+                ostart, olen, oinfo, okey = next(old, (stop, 0, None, ""))
+                oend = ostart + olen
+        self._replace(start, stop, runs)
+        return [tuple(change[:3]) for change in changes]
+
+    def _replace(self, start, stop, runs, delta=0):
+        i = self._index(start - 1)
+        j = self._index(stop - 1)
+        count = len(self.offsets)
+        end = stop + delta
+        runs = [run for run in runs if run[0] < end]
+        if stop < self.length and (j >= count or self._offset(j) != stop):
+            # run containing stop continues beyond new runs
+            runs.append((end, self.values[j - 1]))
+        offsets = []
+        values = []
+        before = self.values[i - 1] if i > 0 else None
+        last = before
+        for offset, value in runs:
+            if offsets and offsets[-1] == offset:
+                # zero-length run
+                del offsets[-1], values[-1]
+                last = values[-1] if values else before
+            if _same(value, last):
+                continue
+            offsets.append(offset)
+            values.append(value)
+            last = value
+        if j < count and _same(self.values[j], last):
+            j += 1  # merge with following run
+        self._splice(i, j, offsets, values, delta)
+        self.length += delta
+        if not self.offsets:
+            self.offsets.append(0)
+            self.values.append((UNKNOWN, ""))
+            self._pivot = 1
+
+
+def _same(value, other):
+    """Check if two `(info, key)` run values can be merged"""
+    return other is not None and value[0] is other[0] and value[1] == other[1]
@@ -18,47 +18,87 @@
 # You should have received a copy of the GNU General Public License
 # along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
 import glob
+import hashlib
+import json
 import logging
 import os
 import re
 import runpy
+import sre_constants as sre
+import sre_parse
 import string
-from fnmatch import fnmatch
+import sys
+from collections import namedtuple
+from fnmatch import translate
+from functools import wraps
 from itertools import chain, count, groupby
+from threading import RLock
 from time import time
 from weakref import WeakValueDictionary
 
 import AppKit as ak
-from Foundation import NSRange, NSUnionRange, NSValueTransformer
-from objc import NULL
+from Foundation import NSRange, NSValueTransformer
 
 import editxt.constants as const
+import editxt.regex as regex
 from editxt.datatypes import WeakProperty
-from editxt.platform.events import call_later
-from editxt.util import union_range
+from editxt.platform.events import call_later, call_in_main_thread, call_in_thread
+from editxt.platform.text import Text
+from editxt.spans import UNKNOWN, Checkpoints, Spans, Symbols
+from editxt.util import atomicfile, union_range
 
 log = logging.getLogger(__name__)
 
+# maximum time (in seconds) to scan in a worker thread between updates
+BACKGROUND_SCAN_TIME = 0.02
+# approximate size (hexichars) of the windows of text scanned by a worker
+BACKGROUND_SCAN_SIZE = 256 * 1024
+# held while syntax definitions are loaded or expanded, which may happen
+# in the main thread and in a worker thread (see Highlighter.scan_in_thread)
+GRAMMAR_LOCK = RLock()
 
-SYNTAX_TOKEN = "XToken"
-SYNTAX_RANGE = "XRange"
 
 class Error(Exception): pass
 
 
+def grammar_lock(func):
+    """Decorate a function that loads or expands syntax definitions"""
+    @wraps(func)
+    def locked(*args, **kw):
+        with GRAMMAR_LOCK:
+            return func(*args, **kw)
+    return locked
+
+
 class SyntaxFactory():
 
-    def __init__(self):
+    def __init__(self, cache_dir=None):
         self.registry = {"*.txt": PLAIN_TEXT}
         self.definitions = [PLAIN_TEXT]
         self.by_id = {PLAIN_TEXT.id: PLAIN_TEXT}
+        if cache_dir:
+            path = os.path.join(cache_dir, const.SYNTAX_MANIFEST)
+            self.manifest = SyntaxManifest(path)
+            path = os.path.join(cache_dir, const.GRAMMAR_CACHE_DIR)
+            self.grammar_cache = GrammarCache(path)
+            path = os.path.join(cache_dir, const.HIGHLIGHT_CACHE_DIR)
+            self.highlight_cache = HighlightCache(path, self.grammar_cache)
+        else:
+            self.manifest = None
+            self.grammar_cache = None
+            self.highlight_cache = None
 
     def load_definitions(self, path, log_info=True):
         if path and os.path.exists(path):
             names = glob.glob(os.path.join(path, "*" + const.SYNTAX_DEF_EXTENSION))
+            manifest = self.manifest
             for filename in sorted(names, key=lambda n: n.lower()):
                 try:
-                    sdef = self.load_definition(filename)
+                    sdef = None
+                    if manifest is not None:
+                        sdef = manifest.get_definition(filename, self)
+                    if sdef is None:
+                        sdef = self.load_definition(filename)
                     file_patterns = sorted(set(sdef.file_patterns))
                     if not sdef.disabled:
                         overrides = []
@@ -80,6 +120,9 @@ class SyntaxFactory():
                     stat.append(filename)
                     if log_info:
                         log.info("syntax definition: %s", " ".join(stat))
+            if manifest is not None:
+                manifest.prune(path, names)
+                manifest.save()
 
     def load_definition(self, filename):
         ns = {
@@ -90,6 +133,7 @@ class SyntaxFactory():
             "compact_regex": compact_regex,
             "registry": self,
         }
+        mtime = os.stat(filename).st_mtime_ns if self.manifest else None
         ns = runpy.run_path(filename, ns)
         factory = ns.pop("SyntaxDefinition", SyntaxDefinition)
         kwargs = {a: ns[a] for a in factory.ARGS if a in ns}
@@ -106,8 +150,70 @@ class SyntaxFactory():
             for pat in base.file_patterns:
                 if self.registry.get(pat) is base:
                     del self.registry[pat]
+        sdef.source_files = [filename] + getattr(base, "source_files", [])
+        if self.manifest is not None:
+            # definitions with a base depend on load order: never lazy
+            self.manifest.update(filename, mtime, sdef, lazy=base is None)
+        if self.grammar_cache is not None and isinstance(sdef, SyntaxDefinition):
+            self.grammar_cache.restore(sdef)
         return sdef
 
+    def report(self):
+        """Get a report of the expanded grammars of loaded definitions
+
+        :returns: A string with one line per language: the number of
+        expanded states, cached derived definitions, total length (KB)
+        of state regular expressions, and estimated memory (KB).
+        """
+        lines = ["{:<24} {:>7} {:>8} {:>9} {:>10}".format(
+            "language", "states", "derived", "regex KB", "memory KB")]
+        defs = {}
+        for sdef in self.by_id.values():
+            if isinstance(sdef, LazyDefinition):
+                sdef = sdef._definition
+            if isinstance(sdef, SyntaxDefinition):
+                defs[id(sdef)] = sdef
+        total = 0
+        for sdef in sorted(defs.values(), key=lambda d: d.name.lower()):
+            stats = sdef.get_stats()
+            if not stats.states:
+                continue
+            total += stats.memory
+            lines.append("{:<24} {:>7} {:>8} {:>9.1f} {:>10.1f}".format(
+                sdef.name[:24],
+                stats.states,
+                stats.derived,
+                stats.regex_size / 1024,
+                stats.memory / 1024,
+            ))
+        lines.append("{:<24} {:>7} {:>8} {:>9} {:>10.1f}".format(
+            "total", "", "", "", total / 1024))
+        return "\n".join(lines)
+
+    def save_cache(self):
+        """Save expanded grammars of loaded definitions to the cache"""
+        if self.grammar_cache is None:
+            return
+        seen = set()
+        for id_, sdef in list(self.by_id.items()):
+            if isinstance(sdef, LazyDefinition):
+                sdef = sdef._definition
+            if isinstance(sdef, SyntaxDefinition) and id(sdef) not in seen:
+                seen.add(id(sdef))
+                self.grammar_cache.save(sdef)
+
+    @property
+    def registry(self):
+        """Mapping of filename patterns to syntax definitions
+
+        Patterns are matched in insertion order (see `get_definition`).
+        """
+        return self._registry
+    @registry.setter
+    def registry(self, value):
+        self._registry = PatternRegistry(value)
+        self._index = None
+
     def index_definitions(self):
         unique = dict((id(sd), sd) for sd in self.registry.values())
         defs = sorted(unique.values(), key=lambda d:(d.name.lower(), id(d)))
@@ -117,14 +223,8 @@ class SyntaxFactory():
 
     @staticmethod
     def lang_key(id_):
-        if isinstance(id_, tuple):
-            return id_
         return id_.lower().replace(" ", "-")
 
-    def __setitem__(self, id_, value):
-        assert isinstance(id_, tuple), id_
-        self.by_id[id_] = value
-
     def __getitem__(self, id_):
         return self.by_id[self.lang_key(id_)]
 
@@ -132,10 +232,99 @@ class SyntaxFactory():
         return self.by_id.get(self.lang_key(id_), default)
 
     def get_definition(self, filename):
-        for pattern, sdef in self.registry.items():
-            if fnmatch(filename, pattern):
-                return sdef
-        return PLAIN_TEXT
+        """Get the syntax definition for the given file name
+
+        :param filename: A file name (not a path).
+        :returns: The definition of the first pattern in the registry
+        matching filename or `PLAIN_TEXT` if there is no match.
+        """
+        registry = self._registry
+        index = self._index
+        if index is None or index.version != registry.version:
+            index = self._index = FilenameIndex(registry)
+        pattern = index.lookup(filename)
+        return PLAIN_TEXT if pattern is None else registry[pattern]
+
+
+class PatternRegistry(dict):
+    """Dict that tracks changes to its keys"""
+
+    version = 0
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            self.version += 1
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.version += 1
+
+    def _changes_keys(name):
+        method = getattr(dict, name)
+        def change(self, *args, **kw):
+            self.version += 1
+            return method(self, *args, **kw)
+        change.__name__ = name
+        return change
+
+    clear = _changes_keys("clear")
+    pop = _changes_keys("pop")
+    popitem = _changes_keys("popitem")
+    setdefault = _changes_keys("setdefault")
+    update = _changes_keys("update")
+    del _changes_keys
+
+
+class FilenameIndex(object):
+    """Index of filename patterns
+
+    Finds the first of an ordered sequence of `fnmatch` patterns that
+    matches a file name without testing each pattern. Patterns without
+    wildcards are looked up by name, `*.<ext>` patterns by each suffix
+    of the file name beginning with a dot, and all other patterns are
+    combined into a single regular expression.
+    """
+
+    def __init__(self, registry):
+        self.version = getattr(registry, "version", None)
+        self.patterns = patterns = list(registry)
+        self.names = {}
+        self.suffixes = {}
+        self.globs = []
+        expressions = []
+        for i, pattern in enumerate(patterns):
+            norm = os.path.normcase(pattern)
+            if not GLOB_CHARS.search(norm):
+                self.names.setdefault(norm, i)
+            elif norm.startswith("*.") and not GLOB_CHARS.search(norm[1:]):
+                self.suffixes.setdefault(norm[1:], i)
+            else:
+                self.globs.append(i)
+                expressions.append("({})".format(translate(norm)))
+        self.regex = re.compile("|".join(expressions)) if expressions else None
+
+    def lookup(self, filename):
+        """Get the first pattern matching filename
+
+        :returns: A pattern or `None` if no pattern matches.
+        """
+        filename = os.path.normcase(filename)
+        best = self.names.get(filename)
+        suffixes = self.suffixes
+        dot = filename.find(".")
+        while dot >= 0:
+            i = suffixes.get(filename[dot:])
+            if i is not None and (best is None or i < best):
+                best = i
+            dot = filename.find(".", dot + 1)
+        if self.regex is not None and (best is None or self.globs[0] < best):
+            match = self.regex.match(filename)
+            if match is not None:
+                i = self.globs[match.lastindex - 1]
+                if best is None or i < best:
+                    best = i
+        return None if best is None else self.patterns[best]
 
 
 class Highlighter(object):
@@ -145,6 +334,12 @@ class Highlighter(object):
         self.theme = theme
         self.langs = None
         self.filename = None
+        self.checkpoints = Checkpoints()
+        self.spans = Spans()
+        self.symbols = Symbols()
+        self._length = 0
+        self._version = 0
+        self.attribute_writes = 0
 
     @property
     def syntaxdef(self):
@@ -157,60 +352,165 @@ class Highlighter(object):
     def __repr__(self):
         return "<{} {}>".format(type(self).__name__, self.syntaxdef.name)
 
-    def color_text(self, text, minrange=None, timeout=None):
+    def color_text(self, text, minrange=None, timeout=None, threaded=False,
+                   priority=None):
+        """Highlight text
+
+        :param text: The `Text` object to be highlighted.
+        :param minrange: The range of text that was edited since the
+        last call. Highlight all text if `None`.
+        :param timeout: Number of seconds to scan in the main thread
+        before deferring the remainder of the scan to a later call.
+        :param threaded: Scan the text in a worker thread rather than
+        in timed slices on the main thread (see `scan_in_thread`).
+        :param priority: A range of text (usually the visible range)
+        to be highlighted before all other text (see `scan_priority`).
+        """
         if text.editedMask() == ak.NSTextStorageEditedAttributes:
             return # we don't care if only attributes changed
-        try:
-            cancel = text.__cancel_incomplete_highlight
-        except AttributeError:
-            pass
-        else:
-            del text.__cancel_incomplete_highlight
-            cancelled_range = cancel()
-            if minrange is not None:
-                minrange = union_range(cancelled_range, minrange)
+        cancelled_range = self.cancel(text)
+        if minrange is not None and cancelled_range is not None:
+            minrange = union_range(cancelled_range, minrange)
 
-        store = text.store
         lang = self.syntaxdef
+        tlen = len(text)
+        checkpoints = self.checkpoints
+        spans = self.spans
         if lang is None or not lang.wordinfo:
             if not minrange or minrange[0] == 0:
-                rng = (0, len(text))
-                rem_attribute = store.removeAttribute_range_
-                rem_attribute(SYNTAX_TOKEN, rng)
-                rem_attribute(SYNTAX_RANGE, rng)
+                checkpoints.clear()
+                spans.clear(tlen, None)
+                self.symbols.clear()
+                self._length = tlen
                 fg_name = ak.NSForegroundColorAttributeName
-                add_attribute = store.addAttribute_value_range_
-                add_attribute(fg_name, self.theme.text_color, rng)
+                add_attribute = text.store.addAttribute_value_range_
+                add_attribute(fg_name, self.theme.text_color, (0, tlen))
+                self.attribute_writes += 1
             return
 
-        tlen = len(text)
         if not tlen:
+            checkpoints.clear()
+            spans.clear()
+            self.symbols.clear()
+            self._length = 0
             return
         if minrange is not None and self.langs is not None:
-            start = max(minrange[0] - 1, 0)
-            whitespace = lang.whitespace
-            start = max(minrange[0] - 1, 0)
-            while start > 0:
-                if text[start] in whitespace:
-                    break
-                start -= 1
-            long_range = store.attribute_atIndex_longestEffectiveRange_inRange_
-            token, adjrange = long_range(SYNTAX_TOKEN, start, None, (0, tlen))
-            #log.debug("%s %s %s -> %s",
-            #    minrange, start, tuple(adjrange),
-            #    tuple(NSUnionRange(minrange, adjrange)))
-            minrange = NSUnionRange(minrange, adjrange)
-            offset = minrange[0]
+            delta = tlen - self._length
+            start = min(minrange[0], tlen)
+            stop = min(sum(minrange), tlen)
+            if stop - delta < start or stop - delta > self._length:
+                # inconsistent edit range
+                minrange = None
+        if minrange is not None and self.langs is not None:
+            checkpoints.edit(start, stop, delta)
+            spans.edit(start, stop, delta)
+            self.symbols.edit(start, stop, delta)
+            # restart at the beginning of the line before the edit
+            offset, key = checkpoints.before(max(start - 1, 0))
+            if key and key not in self.langs:
+                offset, key = 0, ""
             minend = sum(minrange)
-            #log.debug("%s %s %s %s", token, offset, minend, minrange)
         else:
             self.langs = {}
+            checkpoints.clear()
+            spans.clear(tlen)
+            self.symbols.clear()
             offset = 0
+            key = ""
             minend = tlen
+        self._length = tlen
+
+        if priority is not None:
+            stop = self.scan_priority(lang, text, priority, offset, tlen)
+            minend = max(minend, stop)
+
+        if threaded:
+            self.scan_in_thread(lang, text, offset, minend, tlen, key)
+        else:
+            self.scan(lang, text, offset, minend, tlen, timeout, key)
+
+    def cancel(self, text):
+        """Cancel incomplete highlight of text
 
-        self.scan(lang, text, offset, minend, tlen, timeout)
+        :returns: The range of text that was not highlighted or `None`
+        if there was no incomplete highlight.
+        """
+        self._version += 1
+        try:
+            cancel = text.__cancel_incomplete_highlight
+        except AttributeError:
+            return None
+        del text.__cancel_incomplete_highlight
+        return cancel()
+
+    def restore(self, text, runs, timeout=None, threaded=False):
+        """Color text with a highlight snapshot and verify it
+
+        The snapshot is applied to the text immediately. The text is
+        then rescanned as it would be by `color_text`, but only colors
+        that differ from those of the snapshot are changed.
+
+        :param runs: A list of `(offset, (info, key))` runs covering the
+        entire text (see `HighlightCache.load`).
+        """
+        lang = self.syntaxdef
+        tlen = len(text)
+        if lang is None or not lang.wordinfo or not tlen:
+            self.color_text(text, timeout=timeout, threaded=threaded)
+            return
+        self.cancel(text)
+        self.langs = {}
+        self.checkpoints.clear()
+        self.spans.clear(tlen)
+        self.symbols.clear()
+        self._length = tlen
+        store = text.store
+        store.beginEditing()
+        try:
+            batch = ScanBatch(0, tlen, runs, 0, [], {}, True, None)
+            self.apply_batch(text, batch, index_symbols=False)
+        finally:
+            store.endEditing()
+        if threaded:
+            self.scan_in_thread(lang, text, 0, tlen, tlen, "")
+        else:
+            self.scan(lang, text, 0, tlen, tlen, timeout, "")
 
-    def scan(self, lang, text, offset, minend, tlen, timeout):
+    def scan_priority(self, lang, text, priority, offset, tlen):
+        """Highlight a range of text ahead of a scan starting at offset
+
+        The range is scanned immediately, starting at the beginning of
+        its first line with the lexer state of a previous scan (or the
+        root state if unknown). Colors are corrected when the following
+        scan reaches the range if that state was wrong.
+
+        :returns: The offset at which the priority scan stopped. The
+        following scan must not stop early before this offset since the
+        text beyond it may have been highlighted with a different state.
+        """
+        start = min(priority[0], tlen)
+        end = min(sum(priority), tlen)
+        if start <= offset or end <= start:
+            return offset  # scan starting at offset will get there first
+        start = text.line_range((start, 0))[0]
+        key = self.spans.key_at(start)
+        if key not in self.langs:
+            key = ""
+        store = text.store
+        store.beginEditing()
+        try:
+            batches = self.iter_batches(lang, text, start, end, tlen, None,
+                                        key, self.checkpoints, maxend=end)
+            for batch in batches:
+                self.apply_batch(text, batch)
+                end = batch.stop
+        except Exception:
+            log.exception("syntax highlight error")
+        finally:
+            store.endEditing()
+        return end
+
+    def scan(self, lang, text, offset, minend, tlen, timeout, key=None):
         def continue_scan():
             if tlen != len(text):
                 return  # text changed -> abort
@@ -235,145 +535,906 @@ class Highlighter(object):
                     return resume_at, max(minend - resume_at, 0)
                 text.__cancel_incomplete_highlight = cancel
 
-        scanner = self.iter_scan(lang, text, offset, minend, tlen, timeout)
+        scanner = self.iter_scan(lang, text, offset, minend, tlen, timeout, key)
         continue_scan()
 
-    def iter_scan(self, lang, text, offset, minend, tlen, timeout=None):
-        x_range = SYNTAX_RANGE
-        x_token = SYNTAX_TOKEN
-        fg_name = ak.NSForegroundColorAttributeName
-        store = text.store
-        long_range = store.attribute_atIndex_longestEffectiveRange_inRange_
-        add_attribute = store.addAttribute_value_range_
-        rem_attribute = store.removeAttribute_range_
-        get_attribute = store.attribute_atIndex_effectiveRange_
+    def scan_in_thread(self, lang, text, offset, minend, tlen, key=None):
+        """Highlight text by scanning snapshots of it in a worker thread
+
+        The text is scanned in windows of about `BACKGROUND_SCAN_SIZE`
+        hexichars. A copy of each window (and of the checkpoints within
+        it) is scanned by a worker, which never touches the
+        highlighter's state. Each batch of runs it produces is applied
+        in the main thread, and the next window is copied when the scan
+        reaches the end of the current one. Batches are discarded if
+        the text is edited or a new scan is started before they are
+        applied; the unfinished range is then included in the next scan
+        (see `color_text`).
+        """
+        if key is None:
+            key = self.spans.key_at(offset) if offset > 0 else ""
+        version = self._version
+        resume_at = offset
+        limit = None
+
+        def scan_window(offset, key, prevend=None):
+            nonlocal limit
+            limit = sum(text.line_range(
+                (min(offset + BACKGROUND_SCAN_SIZE, tlen), 0)))
+            window = TextWindow(text, offset, limit)
+            checkpoints = dict(self.checkpoints.items(offset + 1, limit))
+            langs = dict(self.langs)
+            stop = limit
+
+            def worker():
+                batches = self.iter_batches(
+                    lang, window, offset, minend, tlen, BACKGROUND_SCAN_TIME,
+                    key, checkpoints, limit=stop, prevend=prevend,
+                    langs=langs)
+                try:
+                    for batch in batches:
+                        if self._version != version:
+                            break  # stale -> abort
+                        call_in_main_thread(apply, batch)
+                except Exception:
+                    log.exception("syntax highlight error")
+
+            call_in_thread(worker)
+
+        def apply(batch):
+            nonlocal resume_at
+            if self._version != version or tlen != len(text):
+                return  # stale batch
+            store = text.store
+            store.beginEditing()
+            try:
+                self.apply_batch(text, batch)
+            finally:
+                store.endEditing()
+            resume_at = batch.stop
+            if batch.done:
+                try:
+                    del text.__cancel_incomplete_highlight
+                except AttributeError:
+                    pass
+            elif batch.lines and batch.lines[-1][0] == limit:
+                # end of window: resume with the state at its end
+                scan_window(limit, batch.lines[-1][1], batch.stop)
+
+        def cancel():
+            self._version += 1
+            return resume_at, max(minend - resume_at, 0)
+
+        text.__cancel_incomplete_highlight = cancel
+        scan_window(offset, key)
+
+    def iter_scan(self, lang, text, offset, minend, tlen, timeout=None,
+                  key=None):
+        """Highlight text, generating resume offsets when out of time
+
+        Matched tokens are written to `self.spans`, and the net color
+        changes are applied to the text storage (see `apply_colors`)
+        each time the scan is suspended or finished.
+
+        :param key: The key of the syntax definition active at `offset`,
+        which must be the beginning of a line. If `None` it will be
+        looked up in `self.spans`.
+        """
+        if key is None:
+            key = self.spans.key_at(offset) if offset > 0 else ""
+        batches = self.iter_batches(
+            lang, text, offset, minend, tlen, timeout, key, self.checkpoints)
+        for batch in batches:
+            self.apply_batch(text, batch)
+            if not batch.done:
+                yield batch.stop
+
+    def iter_batches(self, lang, text, offset, minend, tlen, timeout, key,
+                     checkpoints, maxend=None, limit=None, prevend=None,
+                     langs=None):
+        """Scan text, generating a `ScanBatch` each time out of time
+
+        The scanner does not modify the highlighter's state; batches
+        must be applied in order with `apply_batch`. The last batch
+        generated has `done == True`.
+
+        The state of the scanner (the `key` of the active syntax
+        definition) is recorded in each batch at line boundaries
+        passed. The scan stops early at the first line boundary beyond
+        `minend` having the same state as recorded in `checkpoints` by
+        a previous scan since everything after that point is already
+        highlighted.
+
+        :param key: The key of the syntax definition active at `offset`,
+        which must be the beginning of a line.
+        :param checkpoints: `Checkpoints` of a previous scan (or a dict
+        of their keys by offset). Only entries beyond the last batch
+        generated are read, so batches may be applied while the scan is
+        in progress.
+        :param maxend: Stop at the first line boundary beyond this
+        offset regardless of the state recorded in `checkpoints`.
+        :param limit: The end of the text available to the scanner if
+        it is less than `tlen` (see `TextWindow`). This must be a line
+        boundary. The scan is suspended at this offset unless it stops
+        earlier: the last batch is not done and ends at the end of the
+        last token, and its last line checkpoint is at `limit`.
+        :param prevend: The end of the last token before `offset` when
+        resuming a suspended scan. Defaults to `offset`.
+        :param langs: A dict of syntax definitions by key in which to
+        look up `key`. Defaults to `self.langs`. Definitions entered by
+        the scanner are recorded in the batches.
+        """
+        line_range = text.line_range
         end_time = (time() + timeout) if timeout else None
+        if limit is None:
+            limit = tlen
 
-        theme = self.theme
-        langs = self.langs
         nexts = {}
-        end = prevend = offset
-        key = ""
-        null = NULL
-        can_exit_early = False
-        if offset > 0:
-            xkey, ignore = get_attribute(x_range, offset, null)
-            if xkey:
-                key = xkey
-                lang = langs[xkey]
-
-        while lang is not None:
-            wordinfo = lang.wordinfo
-            text_color = theme.get_syntax_color(lang.text_color)
-            #log.debug("key=%s offset=%s", key, offset)
-            for match in text.finditer(lang.regex, offset):
-                info = wordinfo[match.lastgroup]
-                #log.debug("    %s %r\n        %s\n        key: %s",
-                #            match.lastgroup, info, match, key)
-                start, end = match.span()
-
-                if prevend != start:
-                    # clear unhighlighted range
-                    assert prevend < start, (prevend, start)
-                    prevrange = (prevend, start - prevend)
-                    rem_attribute(x_token, prevrange)
-                    add_attribute(fg_name, text_color, prevrange)
-                prevend = end
-
-                if start != end:
-                    rng = (start, end - start)
-
-                    if end > minend and end + 1 < tlen and start:
-                        # check for early exit (same color & language)
-                        rplus = ((start - 1), end - start + 2)
-                        if info.event:
-                            # extend if at beginning or end of delimited range
-                            if info.next and info.next.text_color == info:
-                                alt = (info, (rng[0], rng[1] + 1))
-                            else:
-                                alt = None
-                        else:
-                            alt = None
-                        info_rng = long_range(x_token, start, None, rplus)
-                        if (info, rng) == info_rng or alt == info_rng:
-                            xkey, ignore = get_attribute(x_range, start, null)
-                            if xkey == (key or None):
-                                # require two token matches before early exit
-                                if can_exit_early:
-                                    xrng = (offset, end - offset)
-                                    if key:
-                                        add_attribute(x_range, key, xrng)
-                                    else:
-                                        rem_attribute(x_range, xrng)
-                                    return
-                                else:
-                                    can_exit_early = True
-                            else:
-                                can_exit_early = False
-                        else:
-                            can_exit_early = False
-
-                    color = theme.get_syntax_color(info)
-                    #log.debug("%s %s %r", rng, info, color)
-                    if color:
-                        add_attribute(x_token, info, rng)
-                        add_attribute(fg_name, color, rng)
-
-                elif not info.event:
-                    if start == tlen:
-                        lang = None
-                        break
-                    raise Error("non-advancing match: "
-                                "index={} group={} {} {}".format(
-                                    start,
-                                    match.lastgroup,
-                                    lang.regex,
-                                    lang,
-                                ))
-                if info.event:
-                    #log.debug("key=%s offset=%s rng=%s", key, offset, rng)
-                    if key:
-                        add_attribute(x_range, key, (offset, end - offset))
-                    else:
-                        rem_attribute(x_range, (offset, end - offset))
-
-                    lang = info.next
-                    if start == end and lang and nexts.get(lang.key) == end:
-                        raise Error("non-advancing range: index={} {} {} {}".format(
-                            start,
-                            match,
-                            info.next.regex,
-                            lang,
-                        ))
-
-                    if lang is not None:
-                        langs[lang.key] = lang
-                        nexts[lang.key] = start
-                        key = lang.key
-                    else:
-                        key = ''
+        if prevend is None:
+            prevend = offset
+        end = prevend
+        if key:
+            lang = (self.langs if langs is None else langs)[key]
+
+        runs = []
+        lines = []
+        found = {}
+        flushed = prevend
+        prevline = lines_from = offset
+
+        def batch(stop, done=False, truncate=None):
+            nonlocal runs, lines, found, flushed, lines_from
+            value = ScanBatch(
+                flushed, stop, runs, lines_from, lines, found, done, truncate)
+            runs = []
+            lines = []
+            found = {}
+            flushed = stop
+            lines_from = prevline
+            return value
+
+        def line_after(index):
+            if index >= tlen:
+                return tlen + 1
+            return sum(line_range((index, 0)))
+
+        def converged(offset):
+            # state matches previous scan (the rest of the text has
+            # already been highlighted) or scanned beyond maxend
+            return offset > minend and (
+                checkpoints.get(offset) == key or
+                (maxend is not None and offset > maxend))
+
+        nextline = line_after(offset)
 
-                    offset = end
-                    #log.debug("info=%r key=%s offset=%s", info, key, offset)
+        try:
+            while lang is not None:
+                wordinfo = lang.wordinfo
+                text_color = lang.text_color
+                #log.debug("key=%s offset=%s", key, offset)
+                for match in text.finditer(lang.regex, offset):
+                    info = wordinfo[match.lastgroup]
+                    #log.debug("    %s %r\n        %s\n        key: %s",
+                    #            match.lastgroup, info, match, key)
+                    start, end = match.span()
+                    if start >= limit and limit < tlen:
+                        break  # end of window
+
+                    while nextline <= start:
+                        # line boundary between tokens: record lexer state
+                        lines.append((nextline, key))
+                        if converged(nextline):
+                            if prevend < nextline:
+                                runs.append((prevend, (text_color, key)))
+                            yield batch(nextline, True)
+                            return
+                        prevline = nextline
+                        nextline = line_after(nextline)
+                    if nextline < end:
+                        # skip line boundaries within token
+                        nextline = line_after(end - 1)
+
+                    if prevend != start:
+                        # unhighlighted range
+                        assert prevend < start, (prevend, start)
+                        runs.append((prevend, (text_color, key)))
+                    prevend = end
+
+                    if start != end:
+                        runs.append((start, (info, key)))
+
+                    elif not info.event:
+                        if start == tlen:
+                            lang = None
+                            break
+                        raise Error("non-advancing match: "
+                                    "index={} group={} {} {}".format(
+                                        start,
+                                        match.lastgroup,
+                                        lang.regex,
+                                        lang,
+                                    ))
+                    if info.event:
+                        lang = info.next
+                        if start == end and lang and nexts.get(lang.key) == end:
+                            raise Error("non-advancing range: index={} {} {} {}".format(
+                                start,
+                                match,
+                                info.next.regex,
+                                lang,
+                            ))
+
+                        if lang is not None:
+                            found[lang.key] = lang
+                            nexts[lang.key] = start
+                            key = lang.key
+                        else:
+                            key = ''
+
+                        offset = end
+                        #log.debug("info=%r key=%s offset=%s", info, key, offset)
+                        if end_time is not None and time() > end_time:
+                            yield batch(end)
+                            end_time = (time() + timeout) if timeout else None
+                        break # exit for
                     if end_time is not None and time() > end_time:
-                        yield end
+                        yield batch(end)
                         end_time = (time() + timeout) if timeout else None
-                    break # exit for
-                if end_time is not None and time() > end_time:
-                    yield end
-                    end_time = (time() + timeout) if timeout else None
-            else:
-                break # exit while
-        if offset < end:
+                else:
+                    break # exit while
+                if start >= limit and limit < tlen:
+                    break # end of window
+        except TimeoutError:
+            # leave the rest of the text unhighlighted
+            log.warn("syntax highlight timed out at %s: %s", end, lang,
+                     exc_info=True)
+        else:
+            if limit < tlen:
+                # end of window: record line boundaries after the last
+                # token and suspend the scan at limit. The range following
+                # the last token is highlighted when the scan is resumed.
+                while nextline < limit:
+                    lines.append((nextline, key))
+                    nextline = line_after(nextline)
+                lines.append((limit, key))
+                yield batch(prevend)
+                return
+        if end < tlen:
+            runs.append((end, (None, "")))
+        yield batch(tlen, True, max(prevline, end))
+
+    def apply_batch(self, text, batch, index_symbols=True):
+        """Apply a `ScanBatch` to the highlighter and text storage
+
+        :param index_symbols: Update `symbols` in the range of the batch.
+        """
+        self.langs.update(batch.langs)
+        checkpoints = self.checkpoints
+        checkpoints.update(batch.lines_from, batch.lines)
+        if batch.truncate is not None:
+            checkpoints.truncate(batch.truncate)
+        colors = self.theme.color_table(self.syntaxdef)
+        default = self.theme.text_color
+        def get_color(info):
+            return colors[info] if info else default
+        changes = self.spans.replace(
+            batch.start, batch.stop, batch.runs, get_color)
+        self.apply_colors(text, changes)
+        if index_symbols:
+            self.index_symbols(text, batch.start, batch.stop)
+
+    def index_symbols(self, text, start, stop):
+        """Update `symbols` in the given range
+
+        Definitions are matched with the `symbol_regex` of the syntax
+        definition, beginning at the checkpoint (a line boundary) at or
+        before `start`. A definition extending beyond `stop` is found
+        when the following range is indexed.
+        """
+        regex = self.syntaxdef.symbol_regex
+        if regex is None:
+            return
+        start = self.checkpoints.before(start)[0]
+        entries = []
+        for match in text.finditer(regex, start, stop):
+            group = match.lastgroup
+            entries.append((match.start(group), match.group(group)))
+        self.symbols.update(start, stop, entries)
+
+    def apply_colors(self, text, changes):
+        """Apply color changes to the text storage
+
+        The number of attribute writes is added to `attribute_writes`.
+
+        :param changes: A sequence of `(start, length, info)` triples as
+        returned by `Spans.replace`.
+        """
+        fg_name = ak.NSForegroundColorAttributeName
+        add_attribute = text.store.addAttribute_value_range_
+        colors = self.theme.color_table(self.syntaxdef)
+        default = self.theme.text_color
+        for start, length, info in changes:
+            color = colors[info] if info else default
+            add_attribute(fg_name, color, (start, length))
+        self.attribute_writes += len(changes)
+
+
+ScanBatch = namedtuple("ScanBatch", [
+    "start",        # start of highlighted range
+    "stop",         # end of highlighted range
+    "runs",         # runs for `Spans.replace(start, stop, runs)`
+    "lines_from",   # start offset for `Checkpoints.update`
+    "lines",        # line checkpoints for `Checkpoints.update`
+    "langs",        # syntax definitions entered by key
+    "done",         # true if this is the last batch of the scan
+    "truncate",     # offset beyond which checkpoints are stale or None
+])
+
+
+class TextWindow(object):
+    """A copy of a range of text that can be scanned in any thread
+
+    Implements the subset of the `Text` API used by
+    `Highlighter.iter_batches`. Indexes are those of the text from
+    which the copy was made.
+    """
+
+    def __init__(self, text, start, stop):
+        self.start = start
+        self.text = Text(text[start:stop])
+
+    def line_range(self, rng):
+        start, length = self.text.line_range((rng[0] - self.start, rng[1]))
+        return (start + self.start, length)
+
+    def finditer(self, regex, pos=None, endpos=None):
+        start = self.start
+        pos = 0 if pos is None else pos - start
+        if endpos is not None:
+            endpos -= start
+        return (WindowMatch(match, start)
+            for match in self.text.finditer(regex, pos, endpos))
+
+
+class WindowMatch:
+
+    def __init__(self, match, offset):
+        self.match = match
+        self.offset = offset
+
+    def __getattr__(self, name):
+        return getattr(self.match, name)
+
+    def start(self, *group):
+        return self.match.start(*group) + self.offset
+
+    def end(self, *group):
+        return self.match.end(*group) + self.offset
+
+    def span(self, *group):
+        start, end = self.match.span(*group)
+        return start + self.offset, end + self.offset
+
+
+class SyntaxManifest(object):
+    """On-disk index of syntax definition files
+
+    Records the attributes needed to register each definition (name,
+    id, file patterns, etc.) so definition files need not be executed
+    until a document needs them. An entry is discarded when the
+    modification time of its definition file changes.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.changed = False
+        try:
+            with open(path, encoding="utf-8") as fh:
+                data = json.load(fh)
+            if data.get("version") == self.VERSION:
+                self.entries = data["definitions"]
+        except FileNotFoundError:
+            pass
+        except Exception:
+            log.warn("cannot load syntax manifest: %s", path, exc_info=True)
+
+    def get_definition(self, filename, registry):
+        """Get a lazy definition for filename
+
+        :returns: A `LazyDefinition` or `None` if the manifest has no
+        current entry for the given file.
+        """
+        entry = self.entries.get(filename)
+        if entry is None or not entry.get("lazy"):
+            return None
+        try:
+            mtime = os.stat(filename).st_mtime_ns
+        except OSError:
+            return None
+        if entry["mtime"] != mtime:
+            return None
+        return LazyDefinition(filename, registry, **entry)
+
+    def update(self, filename, mtime, sdef, lazy=True):
+        entry = {
+            "mtime": mtime,
+            "name": sdef.name,
+            "id": sdef.id,
+            "file_patterns": list(sdef.file_patterns),
+            "disabled": bool(sdef.disabled),
+            "lazy": lazy,
+        }
+        if self.entries.get(filename) != entry:
+            self.entries[filename] = entry
+            self.changed = True
+
+    def prune(self, path, filenames):
+        """Discard entries for definition files no longer in path"""
+        filenames = set(filenames)
+        for filename in list(self.entries):
+            if os.path.dirname(filename) == path and filename not in filenames:
+                del self.entries[filename]
+                self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+        data = {"version": self.VERSION, "definitions": self.entries}
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with atomicfile(self.path, encoding="utf-8") as fh:
+                json.dump(data, fh, indent=1, sort_keys=True)
+        except Exception:
+            log.error("cannot write %s", self.path, exc_info=True)
+        else:
+            self.changed = False
+
+
+class LazyDefinition(object):
+    """Syntax definition placeholder
+
+    The definition file is executed the first time an attribute not
+    recorded in the manifest is accessed. All other attributes are
+    delegated to the loaded definition.
+    """
+
+    def __init__(self, filename, registry, *, name, id, file_patterns,
+                 disabled=False, **ignore):
+        self.filename = filename
+        self.name = name
+        self.id = id
+        self.file_patterns = file_patterns
+        self.disabled = disabled
+        self._registry = registry
+        self._definition = None
+
+    @property
+    def definition(self):
+        """The loaded syntax definition"""
+        if self._definition is None:
+            self._load()
+        return self._definition
+
+    @grammar_lock
+    def _load(self):
+        if self._definition is not None:
+            return
+        log.debug("loading syntax definition: %s", self.filename)
+        try:
+            self._definition = self._registry.load_definition(self.filename)
+        except Exception:
+            log.error("error loading syntax definition: %s",
+                      self.filename, exc_info=True)
+            self._definition = NoHighlight(self.name, "", _id=self.id)
+
+    def __getattr__(self, name):
+        if name.startswith("__") or name in ["_definition", "_registry"]:
+            raise AttributeError(name)
+        return getattr(self.definition, name)
+
+    def __repr__(self):
+        state = "" if self._definition is None else " loaded"
+        return "<{} {} {}{}>".format(
+            type(self).__name__, self.filename, self.name, state)
+
+
+class GrammarCache(object):
+    """Persistent cache of expanded syntax definition grammars
+
+    Each (root) syntax definition is cached in its own file containing
+    the group pattern, `wordinfo` and text color of every nested
+    definition state that has been initialized, and references between
+    them. States that were not initialized when the cache was saved are
+    restored as `DeferredDefinition`s, which are expanded on demand.
+
+    The cache is keyed by a hash of the definition file, its `__base__`
+    chain, and all other definition files referenced while expanding it.
+    """
+
+    VERSION = 2
+
+    def __init__(self, path):
+        self.path = path
+
+    def _cache_file(self, sdef):
+        name = hashlib.sha1(sdef.filename.encode("utf-8")).hexdigest()
+        return os.path.join(self.path, name[:16] + ".json")
+
+    def signature(self, sdef, deps):
+        """Get the cache key of a syntax definition
+
+        :returns: A hash of all source files or `None` if any of them
+        could not be read.
+        """
+        from editxt import __version__
+        sig = hashlib.sha1("{} {}".format(self.VERSION, __version__).encode())
+        for filename in chain(getattr(sdef, "source_files", []), sorted(deps)):
+            try:
+                with open(filename, "rb") as fh:
+                    data = fh.read()
+            except OSError:
+                return None
+            sig.update(filename.encode("utf-8"))
+            sig.update(data)
+        return sig.hexdigest()
+
+    def restore(self, sdef):
+        """Restore expanded grammar of a syntax definition
+
+        :returns: True if the grammar was restored from the cache.
+        """
+        filename = self._cache_file(sdef)
+        try:
+            with open(filename, encoding="utf-8") as fh:
+                data = json.load(fh)
+        except FileNotFoundError:
+            return False
+        except Exception:
+            log.warn("cannot load grammar cache: %s", filename, exc_info=True)
+            return False
+        if data.get("version") != self.VERSION \
+                or data.get("filename") != sdef.filename \
+                or data.get("signature") != self.signature(sdef, data["deps"]):
+            return False
+        try:
+            self.load_states(sdef, data)
+        except Exception:
+            log.warn("cannot restore grammar: %s", filename, exc_info=True)
+            for attr in ["_wordinfo", "_pattern", "_text_color"]:
+                sdef.__dict__.pop(attr, None)
+            return False
+        sdef.deps.update(data["deps"])
+        sdef._cached = data
+        return True
+
+    def save(self, sdef):
+        """Save expanded grammar of a syntax definition
+
+        Nothing is written if the definition has not been initialized
+        or if nothing has changed since it was restored.
+        """
+        if "_wordinfo" not in sdef.__dict__:
+            return
+        with GRAMMAR_LOCK:
+            data = self.dump_states(sdef)
+        cached = getattr(sdef, "_cached", None)
+        if cached is not None and all(data[k] == cached.get(k) for k in data):
+            return
+        data["version"] = self.VERSION
+        data["filename"] = sdef.filename
+        data["signature"] = self.signature(sdef, data["deps"])
+        if data["signature"] is None:
+            return
+        filename = self._cache_file(sdef)
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            with atomicfile(filename, encoding="utf-8") as fh:
+                json.dump(data, fh, separators=(",", ":"), sort_keys=True)
+        except Exception:
+            log.error("cannot write %s", filename, exc_info=True)
+        else:
+            sdef._cached = data
+
+    @staticmethod
+    def dump_states(root):
+        """Serialize the expanded grammar of a root syntax definition
+
+        States expanded after the grammar was restored belong to a fresh
+        copy of the root definition (see `SyntaxDefinition.replay`), so
+        equivalent states of both are merged. States are renumbered so
+        keys of restored states cannot collide with keys generated when
+        a deferred state is expanded.
+        """
+        def expanded(sdef):
+            return getattr(sdef, "root", None) is root \
+                and "_wordinfo" in sdef.__dict__
+        keys = {id(root): ""}
+        if root._fresh is not None:
+            keys[id(root._fresh)] = ""
+        keygen = ("@%x" % i for i in count(1))
+        states = {}
+        deferred = {}
+        queue = [([root, root._fresh], "", [])]
+        def ref(defs, path):
+            if all(sdef is None for sdef in defs):
+                return None
+            live = []
+            for sdef in defs:
+                if isinstance(sdef, DeferredDefinition) \
+                        and sdef._definition is not None:
+                    sdef = sdef._definition
+                if sdef is not None:
+                    if id(sdef) in keys:
+                        return keys[id(sdef)]
+                    live.append(sdef)
+            key = next(keygen)
+            for sdef in live:
+                keys[id(sdef)] = key
+            queue.append((live, key, path))
+            return key
+        while queue:
+            defs, key, path = queue.pop(0)
+            defs = [sdef for sdef in defs if expanded(sdef)]
+            if not defs:
+                deferred[key] = path
+                continue
+            sdef = defs[0]
+            wordinfo = {}
+            for ident, info in sdef.wordinfo.items():
+                infos = [d.wordinfo[ident] for d in defs]
+                wordinfo[ident] = [
+                    str(info),
+                    ref([i.next for i in infos], path + [[ident, 0]]),
+                    ref([i.lang for i in infos], path + [[ident, 1]]),
+                ]
+            states[key] = {
+                "name": sdef.name,
+                "id": sdef.id,
+                "flags": int(sdef.flags),
+                "pattern": sdef._pattern,
+                "text_color": sdef.text_color,
+                "wordinfo": wordinfo,
+            }
+        return {"states": states, "deferred": deferred, "deps": sorted(root.deps)}
+
+    @staticmethod
+    def load_states(root, data):
+        """Restore expanded grammar states of a root syntax definition"""
+        states = data["states"]
+        defs = {"": root}
+        for key, path in data["deferred"].items():
+            defs[key] = DeferredDefinition(root, key, path)
+        for key, state in states.items():
             if key:
-                add_attribute(x_range, key, (offset, end - offset))
+                defs[key] = type(root)(
+                    root.filename,
+                    state["name"],
+                    flags=state["flags"],
+                    registry=root.registry,
+                    _id=state["id"],
+                    _lang_ids=root.lang_ids,
+                    _key=key,
+                    _root=root,
+                )
+        for key, state in states.items():
+            sdef = defs[key]
+            get = lambda key: None if key is None else defs[key]
+            sdef._wordinfo = {
+                ident: MatchInfo(info, get(next_key), get(lang_key))
+                for ident, (info, next_key, lang_key)
+                in state["wordinfo"].items()
+            }
+            sdef._pattern = state["pattern"]
+            sdef._text_color = state["text_color"]
+
+
+class DeferredDefinition(object):
+    """Placeholder for a grammar state that has not been expanded
+
+    The state is expanded (see `SyntaxDefinition.replay`) the first
+    time an attribute other than `key` is accessed.
+    """
+
+    def __init__(self, root, key, path):
+        self.root = root
+        self.key = key
+        self.path = path
+        self._definition = None
+
+    @property
+    def definition(self):
+        if self._definition is None:
+            with GRAMMAR_LOCK:
+                if self._definition is None:
+                    self._definition = self.root.replay(self.path)
+        return self._definition
+
+    def __getattr__(self, name):
+        if name.startswith("__") or name == "_definition":
+            raise AttributeError(name)
+        return getattr(self.definition, name)
+
+    def __repr__(self):
+        return "<{} {} {}>".format(type(self).__name__, self.key, self.path)
+
+
+class HighlightCache(object):
+    """Persistent cache of highlight snapshots
+
+    A snapshot holds the color name and length of each run of
+    highlighted text of a file. Each is stored in its own file (one per
+    document path) and is used only if the path, size and modification
+    time of the file and the grammar signature (see
+    `GrammarCache.signature`) of the syntax definition match those
+    recorded when it was saved. The length of the text and a hash of
+    its first and last `SAMPLE_SIZE` characters are checked when a
+    snapshot is loaded; the entire text is never copied or hashed
+    since snapshots are meant for very large documents. The grammar
+    signature includes files of definitions referenced while expanding
+    the grammar, so it is stable across sessions only while the grammar
+    is restored from a valid grammar cache.
+
+    Least recently used snapshots are removed when the total size of
+    the cache exceeds `max_size` bytes.
+    """
+
+    VERSION = 2
+    SAMPLE_SIZE = 4096
+
+    def __init__(self, path, grammar_cache,
+                 max_size=const.HIGHLIGHT_CACHE_SIZE):
+        self.path = path
+        self.grammar_cache = grammar_cache
+        self.max_size = max_size
+
+    def _cache_file(self, path):
+        name = hashlib.sha1(path.encode("utf-8")).hexdigest()
+        return os.path.join(self.path, name[:16] + ".json")
+
+    def key(self, path, sdef):
+        """Get the key of a highlight snapshot
+
+        :returns: A dict or `None` if the file does not exist or the
+        grammar signature cannot be computed.
+        """
+        if not getattr(sdef, "source_files", None):
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        grammar = self.grammar_cache.signature(sdef, sdef.deps)
+        if grammar is None:
+            return None
+        return {
+            "version": self.VERSION,
+            "path": path,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "grammar": grammar,
+        }
+
+    def sample(self, text):
+        """Hash the first and last `SAMPLE_SIZE` characters of text
+
+        This detects most differences between a file and the text it
+        was decoded to (a different character encoding, for example)
+        without copying the entire text.
+        """
+        length = len(text)
+        size = min(self.SAMPLE_SIZE, length)
+        digest = hashlib.sha1()
+        for start in sorted({0, length - size}):
+            chars = str(text[start:start + size])
+            digest.update(chars.encode("utf-8", "surrogatepass"))
+        return digest.hexdigest()
+
+    def load(self, path, text, sdef):
+        """Load highlight snapshot
+
+        :returns: A list of `(offset, (info, key))` runs covering the
+        entire text (see `Highlighter.restore`) or `None` if there is
+        no valid snapshot.
+        """
+        filename = self._cache_file(path)
+        if not os.path.exists(filename):
+            return None
+        key = self.key(path, sdef)
+        if key is None:
+            return None
+        try:
+            with open(filename, encoding="utf-8") as fh:
+                data = json.load(fh)
+        except Exception:
+            log.warn("cannot load highlight snapshot: %s", filename,
+                     exc_info=True)
+            return None
+        if data.get("key") != key or data.get("length") != len(text) \
+                or data.get("sample") != self.sample(text):
+            return None
+        names = [None] + data["names"]
+        lengths = iter(data["runs"])
+        runs = []
+        offset = 0
+        for length, index in zip(lengths, lengths):
+            runs.append((offset, (names[index], "")))
+            offset += length
+        if offset != len(text):
+            return None
+        try:
+            os.utime(filename)  # recently used
+        except OSError:
+            pass
+        return runs
+
+    def save(self, path, text, spans, sdef):
+        """Save highlight snapshot
+
+        Nothing is saved if any part of the text has not been
+        highlighted.
+
+        :param spans: `Spans` of the highlighted text.
+        :returns: True if the snapshot was saved.
+        """
+        names = {}
+        runs = []
+        for start, length, info, key in spans:
+            if info is UNKNOWN:
+                return False
+            index = 0 if info is None else \
+                names.setdefault(str(info), len(names) + 1)
+            if runs and runs[-1] == index:
+                runs[-2] += length
             else:
-                rem_attribute(x_range, (offset, end - offset))
-        if end < tlen:
-            rng = (end, tlen - end)
-            rem_attribute(x_range, rng)
-            rem_attribute(x_token, rng)
-            add_attribute(fg_name, self.theme.text_color, rng)
+                runs.extend([length, index])
+        key = self.key(path, sdef)
+        if key is None:
+            return False
+        data = {
+            "key": key,
+            "length": len(text),
+            "sample": self.sample(text),
+            "names": sorted(names, key=names.get),
+            "runs": runs,
+        }
+        filename = self._cache_file(path)
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            with atomicfile(filename, encoding="utf-8") as fh:
+                json.dump(data, fh, separators=(",", ":"))
+        except Exception:
+            log.error("cannot write %s", filename, exc_info=True)
+            return False
+        self.evict()
+        return True
+
+    def evict(self):
+        """Remove least recently used snapshots in excess of max size"""
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return
+        files = []
+        for name in names:
+            filename = os.path.join(self.path, name)
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, filename))
+        total = sum(size for mtime, size, filename in files)
+        for mtime, size, filename in sorted(files):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                log.warn("cannot remove %s", filename, exc_info=True)
+                continue
+            total -= size
 
 
 class NoHighlight(object):
@@ -389,6 +1450,11 @@ class NoHighlight(object):
     def __repr__(self):
         return "<%s %s %s>" % (type(self).__name__, self.name, self.id)
 
+    def iter_color_names(self, _seen=None):
+        return iter(())
+
+    symbol_regex = None
+
 
 class SyntaxDefinition(NoHighlight):
     """Syntax definition
@@ -448,6 +1514,9 @@ class SyntaxDefinition(NoHighlight):
         - ag_filetype_options: optional list of `ag` options used to
             limit search by file type (example: ["--py"]).
         - delimiters: list of delimiter start/end pairs (tuples).
+        - name_pattern: optional regular expression matching a name
+            between delimiters (default: `\\w+`). Used to index
+            definitions as text is highlighted (see `symbol_regex`).
     :param disabled: True if this definition is disabled.
     :param flags: Regular expression flags for this language.
     """
@@ -477,7 +1546,8 @@ class SyntaxDefinition(NoHighlight):
             comment_token="", definition_rules=None,
             disabled=False, flags=re.MULTILINE,
             whitespace=whitespace, default_text_color="", registry=None,
-            _id=None, _lang_ids=None, _ends=None, _next=None, _key=""):
+            _id=None, _lang_ids=None, _ends=None, _next=None, _key="",
+            _root=None):
         super().__init__(name, comment_token, disabled, _id=_id)
         self.filename = filename
         self.file_patterns = list(file_patterns)
@@ -498,20 +1568,34 @@ class SyntaxDefinition(NoHighlight):
         self.default_text_color = default_text_color
         self.registry = registry
         self.lang_ids = _lang_ids or ("%x" % i for i in count())
+        self.root = _root or self
+        if _root is None:
+            self.deps = set()  # files of definitions referenced by rules
+            self._fresh = None
+            self.derived = {}  # derived definitions (see make_definition)
+            self.key_ids = {}  # interned parts of derived definition keys
 
     def __repr__(self):
         return "<{} {} {}>".format(type(self).__name__, self.filename, self.name)
 
+    @grammar_lock
     def _init(self):
+        if "_wordinfo" in self.__dict__:
+            return  # initialized in another thread
+        # `_wordinfo` is set last: it is used without locking once set
         wordinfo = {}
         groups = []
         idgen = ("%X" % i for i in count())
         for phrase, ident, info in self.iter_group_info(idgen):
             groups.append(phrase)
             wordinfo[ident] = info
-        self._wordinfo = wordinfo
+        pattern = "|".join(groups)
+        guard = first_char_guard(pattern, self.flags)
+        if guard is not None:
+            pattern = "{}(?:{})".format(guard, pattern)
         try:
-            self._regex = re.compile("|".join(groups), self.flags)
+            compiled = regex.compile(
+                pattern, self.flags, const.SYNTAX_MATCH_TIMEOUT)
         except re.error as err:
             msg = "cannot compile groups for %s: %s\n%r" \
                     % (self.name, err, "|".join(groups))
@@ -521,7 +1605,10 @@ class SyntaxDefinition(NoHighlight):
         if color_name == const.DELIMITER:
             # use theme default if parent has not specified a color
             color_name = "text_color"
+        self._pattern = pattern
+        self._regex = compiled
         self._text_color = self.get_color(color_name)
+        self._wordinfo = wordinfo
         log.debug("file: %s\n"
                   "name: %s\n"
                   "id: %s\n"
@@ -530,7 +1617,7 @@ class SyntaxDefinition(NoHighlight):
             self.filename,
             self.name,
             self.id,
-            self._regex.pattern,
+            compiled.pattern,
             wordinfo,
         )
 
@@ -542,12 +1629,41 @@ class SyntaxDefinition(NoHighlight):
             self._init()
         return self._wordinfo
 
+    @property
+    def symbol_regex(self):
+        """Regex matching definitions or `None` if there are no
+        `definition_rules` delimiters
+
+        The `lastgroup` of a match is the name of the group matching the
+        name of the definition.
+        """
+        try:
+            return self._symbol_regex
+        except AttributeError:
+            pass
+        rules = self.definition_rules
+        delims = getattr(rules, "delimiters", None)
+        if delims:
+            name = getattr(rules, "name_pattern", r"\w+")
+            self._symbol_regex = re.compile("|".join(
+                "{}(?P<s{}>{}){}".format(start, i, name, end)
+                for i, (start, end) in enumerate(delims)
+            ), self.flags)
+        else:
+            self._symbol_regex = None
+        return self._symbol_regex
+
     @property
     def regex(self):
         try:
             return self._regex
         except AttributeError:
-            self._init()
+            if "_pattern" in self.__dict__:
+                # restored from grammar cache
+                self._regex = regex.compile(
+                    self._pattern, self.flags, const.SYNTAX_MATCH_TIMEOUT)
+            else:
+                self._init()
         return self._regex
 
     @property
@@ -715,6 +1831,55 @@ class SyntaxDefinition(NoHighlight):
             except Exception:
                 log.error("%s rule error: %s", self, rule, exc_info=True)
 
+    def iter_color_names(self, _seen=None):
+        """Generate color names of tokens reachable from this definition
+
+        Rules of this definition and of nested and referenced syntax
+        definitions are walked without being compiled. Names of dynamic
+        ranges are not generated since they depend on matched text.
+        """
+        seen = {self} if _seen is None else _seen
+
+        def walk_syntax(sdef):
+            if sdef in seen or isinstance(sdef, DynamicRange):
+                return
+            if hasattr(sdef, "iter_color_names"):
+                seen.add(sdef)
+                yield from sdef.iter_color_names(seen)
+            elif is_syntax_class(sdef):
+                seen.add(sdef)
+                color_name = getattr(sdef, "default_text_color", None)
+                if color_name and color_name is not const.DELIMITER:
+                    yield self.get_color(color_name)
+                rules = getattr(sdef, "rules", None)
+                if rules is None:
+                    rules = chain(getattr(sdef, "word_groups", ()),
+                                  getattr(sdef, "delimited_ranges", ()))
+                yield from walk_rules(rules)
+            elif sdef is not None:
+                try:
+                    ref = self.registry[sdef]
+                except Exception:
+                    return
+                yield from walk_syntax(ref)
+
+        def walk_rules(rules):
+            for rule in rules:
+                yield self.get_color(rule[0])
+                if len(rule) < 3:
+                    continue
+                name, start, ends, *sdef = rule
+                for item in chain([start], ends):
+                    if not isinstance(item, (str, RE)):
+                        yield from walk_syntax(item)
+                for item in sdef:
+                    yield from walk_syntax(item)
+
+        yield self.get_color()
+        if self.default_text_color not in ("", const.DELIMITER):
+            yield self.get_color(self.default_text_color)
+        yield from walk_rules(self.rules)
+
     def get_color(self, name="text_color"):
         if " " in name:
             value = name.replace(" ", "_")
@@ -733,16 +1898,55 @@ class SyntaxDefinition(NoHighlight):
         except Exception:
             log.debug("bad syntax key: %s", key, exc_info=True)
             sdef = default
+        else:
+            filename = getattr(sdef, "filename", None)
+            if filename:
+                self.root.deps.add(filename)
+        return sdef
+
+    @grammar_lock
+    def replay(self, path):
+        """Expand the grammar state at path
+
+        Used to expand states that were not initialized when the grammar
+        cache was saved. States are expanded in a fresh copy of this
+        (root) definition.
+
+        :param path: A list of `[<group name>, <0: next or 1: lang>]`
+        pairs leading from the root state to the desired state.
+        """
+        assert self.root is self, "replay must start at root definition"
+        if self._fresh is None:
+            NA = object()
+            args = {}
+            for attr in self.ARGS:
+                value = getattr(self, attr, NA)
+                if value is not NA:
+                    args[attr] = value
+            self._fresh = type(self)(self.filename, _id=self.id, _root=self, **args)
+        sdef = self._fresh
+        for ident, lang in path:
+            info = sdef.wordinfo[ident]
+            sdef = info.lang if lang else info.next
         return sdef
 
+    @grammar_lock
     def make_definition(self, source_definition, name, ends, next_def=None,
                         *, overrides=None):
-        end_key = (self.next,) if self.next else ()
-        end_key += (next_def,) if next_def else ()
-        def_key = (name, source_definition) + end_key + tuple(unique(ends))
+        """Get or make a definition derived from source_definition
+
+        Derived definitions are cached by the root definition, and are
+        freed with it. Cache keys are tuples of small integers, one for
+        each interned part of the key.
+        """
+        root = self.root
+        ids = root.key_ids
+        parts = [name, source_definition, self.next, next_def]
+        parts.extend(unique(ends))
         if overrides:
-            def_key += tuple(sorted(overrides.items()))
-        sdef = self.registry.get(def_key)
+            parts.append(tuple(sorted(overrides.items())))
+        def_key = tuple([ids.setdefault(part, len(ids)) for part in parts])
+        sdef = root.derived.get(def_key)
         if sdef is None:
             NA = object()
             args = {
@@ -760,6 +1964,7 @@ class SyntaxDefinition(NoHighlight):
             args.update(
                 _id=ident,
                 _lang_ids=self.lang_ids,
+                _root=self.root,
                 _ends=ends,
                 _next=next_def,
                 _key=(self.key + " " + ident) if self.key else ident
@@ -770,9 +1975,58 @@ class SyntaxDefinition(NoHighlight):
             #    "\n  ".join("%s: %r" % it for it in sorted(args.items())))
             #print(self.name, (self.id, args["_key"]), name)
             sdef = type(self)(self.filename, **args)
-            self.registry[def_key] = sdef
+            root.derived[def_key] = sdef
         return sdef
 
+    def get_stats(self):
+        """Get statistics of the expanded states of this (root) grammar
+
+        States that have not been expanded are not counted. Memory is an
+        estimate of the size of patterns, compiled regular expressions,
+        match info, and cached derived definitions.
+
+        :returns: `GrammarStats`
+        """
+        assert self.root is self, "stats must start at root definition"
+        seen = set()
+        queue = [self, self._fresh]
+        queue.extend(self.derived.values())
+        states = regex_size = 0
+        memory = sys.getsizeof(self.derived) + sys.getsizeof(self.key_ids)
+        while queue:
+            sdef = queue.pop()
+            if isinstance(sdef, DeferredDefinition):
+                sdef = sdef._definition
+            if sdef is None or id(sdef) in seen:
+                continue
+            seen.add(id(sdef))
+            if "_wordinfo" not in sdef.__dict__:
+                continue
+            states += 1
+            pattern = sdef.__dict__.get("_pattern", "")
+            regex_size += len(pattern)
+            memory += sys.getsizeof(pattern)
+            compiled = sdef.__dict__.get("_regex")
+            if compiled is not None:
+                memory += sys.getsizeof(getattr(compiled, "compiled", compiled))
+            wordinfo = sdef._wordinfo
+            memory += sys.getsizeof(wordinfo)
+            for info in wordinfo.values():
+                memory += sys.getsizeof(info)
+                if getattr(info.next, "root", None) is self:
+                    queue.append(info.next)
+                if getattr(info.lang, "root", None) is self:
+                    queue.append(info.lang)
+        return GrammarStats(states, len(self.derived), regex_size, memory)
+
+
+GrammarStats = namedtuple("GrammarStats", [
+    "states",      # number of expanded states
+    "derived",     # number of cached derived definitions
+    "regex_size",  # total length of state patterns
+    "memory",      # estimated size in bytes
+])
+
 
 class MatchInfo(str):
 
@@ -791,6 +2045,7 @@ class MatchInfo(str):
 
 PLAIN_TEXT = NoHighlight("Plain Text", "x")
 EMPTY_REGEX = re.compile("")
+GLOB_CHARS = re.compile(r"[*?[]")
 WORD_CHAR = re.compile(r"\w", re.UNICODE)
 MATCH_ANYTHING = re.compile(r"^(\\B\|\\b|\\b\|\\B)?$")
 
@@ -804,6 +2059,7 @@ class DynamicRange:
             lang_pattern = re.compile(lang_pattern, re.MULTILINE)
         self.lang_pattern = lang_pattern
         self.color_name = color_name
+    @grammar_lock
     def make_definition(self, parent, lookup_syntax, *args, **kw):
         ident = next(parent.lang_ids)
         none = parent.make_definition(self._none, *args, **kw)
@@ -816,6 +2072,7 @@ class DynamicRange:
         sdef.syntax_args = (args, kw)
         sdef.color = parent.get_color(self.color_name)
         sdef.none = MatchInfo(parent.get_color(), none, parent)
+        sdef.infos = {}
         return sdef
     @property
     def regex(self):
@@ -829,20 +2086,54 @@ class DynamicRange:
     def finditer(self, string, offset):
         match = self.lang_pattern.match(string, offset)
         if match:
-            self.last_match_value = match.group(0).strip()
+            name = match.group(0).strip()
         else:
-            self.last_match_value = ""
+            name = ""
             match = EMPTY_REGEX.match(string, offset)
-        return [match]
-    def __getitem__(self, key):
-        # HACK must be called after `finditer` as in `Highlighter.scan`
-        name = self.last_match_value
+        return [DynamicMatch(match, name)]
+    def __getitem__(self, name):
+        """Get `MatchInfo` for language name (`lastgroup` of a match)
+
+        Resolved languages are cached: `lookup_syntax` is called once per
+        name rather than for every range that names it.
+        """
+        try:
+            return self.infos[name]
+        except KeyError:
+            pass
+        return self._lookup(name)
+
+    @grammar_lock
+    def _lookup(self, name):
+        try:
+            return self.infos[name]  # resolved in another thread
+        except KeyError:
+            pass
+        info = self.none
         if name:
             args, kw = self.syntax_args
             sdef = self.lookup_syntax(name, *args, **kw)
             if sdef is not None:
-                return MatchInfo(self.color, sdef, self.parent)
-        return self.none
+                info = MatchInfo(self.color, sdef, self.parent)
+        self.infos[name] = info
+        return info
+
+
+class DynamicMatch(object):
+    """Match of `DynamicRange` with the language name as `lastgroup`"""
+
+    __slots__ = ("match", "lastgroup")
+
+    def __init__(self, match, name):
+        self.match = match
+        self.lastgroup = name
+
+    def __getattr__(self, name):
+        return getattr(self.match, name)
+
+    def __repr__(self):
+        return "<{} {!r} {!r}>".format(
+            type(self).__name__, self.lastgroup, self.match)
 
 
 class RE(object):
@@ -895,6 +2186,118 @@ def lookahead(pattern):
     return r"(?={})".format(pattern)
 
 
+def first_char_guard(pattern, flags=0):
+    """Get a lookahead assertion for the first character of any match
+
+    The assertion matches at every position where the pattern may
+    match, and can be prepended to the pattern to quickly skip
+    positions that cannot begin a match without changing the result
+    of any match (including `lastgroup`).
+
+    :returns: A regular expression or `None` if a match of the pattern
+    may begin with (almost) any character or be empty.
+    """
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+        if _parsed_flags(parsed) != _parsed_flags(sre_parse.parse("", flags)):
+            return None  # global inline flags
+        chars = []
+        nullable, at_end = _first_chars(parsed.data, chars)
+    except _AnyChar:
+        return None
+    if nullable:
+        return None
+    guard = "[{}]".format("".join(sorted(set(chars)))) if chars else ""
+    if at_end:
+        guard = r"{}|\Z".format(guard) if guard else r"\Z"
+    return "(?={})".format(guard)
+
+
+class _AnyChar(Exception):
+    pass
+
+
+def _parsed_flags(parsed):
+    # SubPattern.pattern was renamed to SubPattern.state in Python 3.8
+    state = getattr(parsed, "state", None) or parsed.pattern
+    return state.flags
+
+
+_CATEGORIES = {
+    sre.CATEGORY_DIGIT: r"\d",
+    sre.CATEGORY_SPACE: r"\s",
+    sre.CATEGORY_WORD: r"\w",
+}
+
+
+def _first_chars(items, chars):
+    """Collect character class items that may match the first character
+
+    :param items: A sequence of parsed regular expression items.
+    :param chars: A list to which character class items are appended.
+    :returns: A tuple `(nullable, at_end)`. `nullable` is true if
+    the items may match without consuming a character and without
+    being at the end of a line. `at_end` is true if the items may
+    match at the end of the string.
+    :raises: `_AnyChar` if the items may match (almost) any character
+    or contain constructs that are not understood.
+    """
+    def char(code):
+        if code < 128 and chr(code).isalnum():
+            return chr(code)
+        return "\\U%08x" % code
+
+    at_end = False
+    for op, av in items:
+        if op is sre.LITERAL:
+            chars.append(char(av))
+            return False, at_end
+        if op is sre.IN:
+            for item, value in av:
+                if item is sre.LITERAL:
+                    chars.append(char(value))
+                elif item is sre.RANGE:
+                    chars.append("{}-{}".format(char(value[0]), char(value[1])))
+                elif item is sre.CATEGORY and value in _CATEGORIES:
+                    chars.append(_CATEGORIES[value])
+                else:
+                    raise _AnyChar(item)  # NEGATE, negated category, ...
+            return False, at_end
+        if op is sre.SUBPATTERN:
+            group, add_flags, del_flags, sub = av
+            if add_flags or del_flags:
+                raise _AnyChar(op)
+            subs = [sub]
+            minimum = 1
+        elif op is sre.BRANCH:
+            subs = av[1]
+            minimum = 1
+        elif op is sre.MAX_REPEAT or op is sre.MIN_REPEAT:
+            minimum, maximum, sub = av
+            subs = [sub]
+        elif op is sre.AT:
+            if av is sre.AT_END or av is sre.AT_END_LINE:
+                chars.append(char(ord("\n")))
+                return False, True
+            if av is sre.AT_END_STRING:
+                return False, True
+            # other zero-width assertions restrict where a match may
+            # begin, but do not consume characters
+            continue
+        elif op is sre.ASSERT or op is sre.ASSERT_NOT:
+            continue
+        else:
+            raise _AnyChar(op)  # ANY, NOT_LITERAL, GROUPREF, ...
+        nullable = False
+        for sub in subs:
+            sub_nullable, sub_at_end = _first_chars(sub, chars)
+            nullable = nullable or sub_nullable
+            at_end = at_end or sub_at_end
+        if not nullable and minimum > 0:
+            return False, at_end
+    return True, at_end
+
+
 def escape(token, word_char=None):
     if hasattr(token, "pattern"):
         return token.pattern
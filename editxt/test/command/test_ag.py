@@ -135,6 +135,37 @@ def test_ag():
     yield test("ag xyz", "please specify a search path", state="window project editor*")
 
 
+def test_goto_symbol():
+    from editxt.command.parser import RegexPattern
+    from editxt.spans import Symbols
+
+    @gentest
+    def test(pattern, selection, expect):
+        symbols = Symbols()
+        symbols.update(0, 100, [(6, "C"), (17, "f"), (40, "f"), (60, "fx")])
+        scrolled = []
+        editor = TestConfig(
+            selection=selection,
+            text_view=TestConfig(scrollRangeToVisible_=scrolled.append),
+            document=TestConfig(syntaxer=TestConfig(symbols=symbols)),
+        )
+        result = mod.goto_symbol(editor, RegexPattern(pattern))
+        eq_(result, expect is not None)
+        if expect is not None:
+            eq_(editor.selection, expect)
+            eq_(scrolled, [expect])
+        else:
+            eq_(editor.selection, selection)
+            eq_(scrolled, [])
+
+    yield test("f", (0, 0), (17, 1))
+    yield test("f", (17, 1), (40, 1))
+    yield test("f", (40, 1), (17, 1))
+    yield test("f.*", (40, 1), (60, 2))
+    yield test("C", (6, 1), None)
+    yield test("c", (0, 0), None)
+    yield test("x", (0, 0), None)
+
 def test_exec_shell():
     if not mod.is_ag_installed():
         raise SkipTest("ag not installed")
@@ -23,7 +23,7 @@ from functools import partial
 import Foundation as fn
 
 import editxt.platform.mac.text as mod
-from editxt.test.util import assert_raises, eq_, gentest, TestConfig
+from editxt.test.util import assert_raises, eq_, gentest, replattr, TestConfig
 
 
 def test_Text_len():
@@ -118,6 +118,55 @@ def test_Text_finditer():
     yield test, r" .(?= |$)", [(6, 9)], 4, 9
 
 
+def test_Text_iter_line_ranges():
+    def test(string, expect, start=0, stop=None, batch_size=2):
+        text = mod.Text(string)
+        with replattr(mod, "LINE_BATCH_SIZE", batch_size):
+            result = [tuple(rng) for rng in text.iter_line_ranges(start, stop)]
+        eq_(result, expect)
+
+    yield test, "", []
+    yield test, "abc", [(0, 3)]
+    yield test, "abc\n", [(0, 4)]
+    yield test, "abc\ndef", [(0, 4), (4, 3)]
+    yield test, "a\nb\nc\n", [(0, 2), (2, 2), (4, 2)]
+    yield test, "a\r\nb\rc\n", [(0, 3), (3, 2), (5, 2)]
+    yield test, "a\nb\r\nc\n", [(0, 2), (2, 3), (5, 2)], 0, None, 3
+    yield test, "a\n\u2028\u2029c", [(0, 2), (2, 1), (3, 1), (4, 1)]
+    yield test, "a\n\U0001f612\U0001f612\nb", [(0, 2), (2, 5), (7, 1)]
+    yield test, "a\n\U0001f612b\U0001f612\nb", [(0, 2), (2, 6), (8, 1)], 0, None, 3
+    yield test, "abc\ndef\nghi", [(4, 4), (8, 3)], 5
+    yield test, "abc\ndef\nghi", [(0, 4), (4, 4)], 0, 5
+    yield test, "abc\ndef\nghi", [(0, 4), (4, 4), (8, 3)], 0, None, 4096
+
+
+def test_Text_convert_index():
+    def test(string, edits=()):
+        text = mod.Text(string)
+        for rng, value in edits:
+            text[rng] = value
+            string = str(text)
+        units = [0]
+        for char in string:
+            units.append(units[-1] + (2 if char > "\uffff" else 1))
+        for index, unit in reversed(list(enumerate(units))):
+            eq_(text._hexichar_index(index), unit, (string, index))
+            eq_(text._codepoint_index(unit), index, (string, unit))
+        surrogates = [u for u, c in zip(units, string) if c > "\uffff"]
+        eq_(list(text._surrogates or []), surrogates)
+        eq_(list(text._surrogate_codepoints or []),
+            [u - i for i, u in enumerate(surrogates)])
+
+    yield test, "plain text"
+    yield test, "\U0001f612"
+    yield test, "lol \U0001f612 \U0001f34c slip \U0001f34c"
+    yield test, "lol \U0001f612 \U0001f34c slip", [((6, 3), "")]
+    yield test, "lol \U0001f612 \U0001f34c slip", [((4, 2), "x")]
+    yield test, "lol \U0001f612 slip", [((0, 0), "\U0001f34c ")]
+    yield test, "plain text", [((5, 0), " \U0001f34c")]
+    yield test, "\U0001f34c text", [((0, 2), "")]
+
+
 def test_composed_length():
     def test(text, length, enumerate=False):
         string = str(mod.Text(text))
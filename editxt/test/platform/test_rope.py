@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2015 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+import random
+import re
+
+import editxt.platform.test.rope as mod
+from editxt.test.util import assert_raises, eq_, replattr
+
+
+def test_Text_len():
+    def test(string, length, pylen=None):
+        eq_(len(mod.Text(string)), length, string)
+        eq_(len(string), length if pylen is None else pylen, string)
+
+    yield test, '', 0
+    yield test, 'a', 1
+    yield test, 'ab', 2
+    yield test, 'é', 1
+    yield test, 'é', 2
+    yield test, '\U0001f612', 2, 1
+
+
+def test_Text_getitem():
+    def test(rng, expect):
+        with assert_raises(expect if not isinstance(expect, str) else None):
+            if callable(rng):
+                result = rng(text)
+            else:
+                result = text[rng]
+        if isinstance(expect, str):
+            eq_(result, expect)
+
+    text = mod.Text("the quick brown fox")
+    yield test, 0, 't'
+    yield test, 1, 'h'
+    yield test, 18, 'x'
+    yield test, 19, IndexError
+
+    yield test, (lambda s: s[:3]), "the"
+    yield test, (lambda s: s[0:3]), "the"
+    yield test, (lambda s: s[-3:]), "fox"
+    yield test, (lambda s: s[-3:-1]), "fo"
+
+    yield test, (0, 0), ""
+    yield test, (0, 3), "the"
+    yield test, (1, 3), "he "
+    yield test, (16, 3), "fox"
+    yield test, (16, 4), IndexError
+
+    text = mod.Text("lol \U0001f612 awé \U0001f34c")
+    yield test, (0, 3), 'lol'
+    yield test, (4, 2), '\U0001f612'
+    yield test, 10, '́'
+    yield test, (12, 2), '\U0001f34c'
+
+
+def test_Text_setitem():
+    def test(rng, value, expect, edit):
+        text = mod.Text("lol \U0001f612 awé")
+        edits = []
+        text.on_edit(lambda rng: edits.append(rng))
+        text[rng] = value
+        eq_(str(text), expect)
+        eq_(edits, [edit])
+
+    yield test, (0, 0), "a", "alol \U0001f612 awé", (0, 1)
+    yield test, (0, 3), "", " \U0001f612 awé", (0, 0)
+    yield test, (4, 2), "x", "lol x awé", (4, 1)
+    yield test, (7, 0), "\U0001f34c", "lol \U0001f612 \U0001f34cawé", (7, 2)
+    yield test, slice(-2, None), "e", "lol \U0001f612 awe", (9, 1)
+    yield test, (11, 0), mod.Text("!"), "lol \U0001f612 awé!", (11, 1)
+
+
+def test_Text_on_edit():
+    text = mod.Text("abc")
+    edits = []
+    remove = text.on_edit(lambda rng: edits.append(rng))
+    text[(1, 1)] = "xy"
+    remove()
+    text[(0, 0)] = "z"
+    eq_(edits, [(1, 2)])
+    eq_(str(text), "zaxyc")
+
+
+def test_Text_edits():
+    def check(node):
+        if node.text is not None:
+            assert 0 < len(node.text) <= mod.LEAF_SIZE or node is root, node
+            return 0
+        left = check(node.left)
+        right = check(node.right)
+        assert abs(left - right) <= 1, (left, right)
+        eq_(node.height, max(left, right) + 1)
+        eq_(node.chars, node.left.chars + node.right.chars)
+        eq_(node.units, node.left.units + node.right.units)
+        eq_(node.eols, node.left.eols + node.right.eols)
+        return node.height
+
+    rand = random.Random(42)
+    chars = "ab \n\r \U0001f612"
+    with replattr(mod, "LEAF_SIZE", 4):
+        string = "".join(rand.choice(chars) for x in range(100))
+        text = mod.Text(string)
+        for x in range(300):
+            start = rand.randint(0, len(string))
+            stop = rand.randint(start, min(start + 10, len(string)))
+            value = "".join(rand.choice(chars) for x in range(rand.randint(0, 8)))
+            string = string[:start] + value + string[stop:]
+            start = text._hexichar_index(start)
+            stop = text._hexichar_index(stop)
+            text[(start, stop - start)] = value
+            root = text._root
+            eq_(str(text), string)
+            eq_(len(text), len(string.encode("utf-16-le")) // 2)
+            check(root)
+
+
+def test_Text_line_range():
+    def test(string, rng, expect):
+        eq_(mod.Text(string).line_range(rng), expect)
+
+    yield test, "", (0, 0), (0, 0)
+    yield test, "abc", (1, 0), (0, 3)
+    yield test, "abc\ndef", (1, 0), (0, 4)
+    yield test, "abc\ndef", (3, 0), (0, 4)
+    yield test, "abc\ndef", (4, 0), (4, 3)
+    yield test, "abc\ndef", (7, 0), (4, 3)
+    yield test, "abc\n", (4, 0), (4, 0)
+    yield test, "abc\ndef\nghi", (1, 4), (0, 8)
+    yield test, "abc\ndef\nghi", (1, 3), (0, 4)
+    yield test, "abc\r\ndef", (3, 0), (0, 5)
+    yield test, "abc\r\ndef", (4, 0), (0, 5)
+    yield test, "abc\r\ndef", (5, 0), (5, 3)
+    yield test, "abc\rdef", (4, 0), (4, 3)
+    yield test, "abc\n\rdef", (4, 0), (4, 1)
+    yield test, "abc def ghi", (5, 0), (4, 4)
+    yield test, "abc\x85def", (4, 0), (4, 3)
+    yield test, "\U0001f612\n\U0001f34c\n", (3, 0), (3, 3)
+    yield test, "\U0001f612\n\U0001f34c\n", (0, 4), (0, 6)
+
+
+def test_Text_iter_line_ranges():
+    def test(string, expect, *args):
+        eq_(list(mod.Text(string).iter_line_ranges(*args)), expect)
+        eq_(list(mod.Text(string).iterlines(*args)),
+            [string[x:x + n] for x, n in expect])
+
+    yield test, "", []
+    yield test, "abc", [(0, 3)]
+    yield test, "abc\n", [(0, 4)]
+    yield test, "abc\ndef", [(0, 4), (4, 3)]
+    yield test, "abc\r\n\rdef\n", [(0, 5), (5, 1), (6, 4)]
+    yield test, "abc\ndef\nghi", [(4, 4), (8, 3)], 5
+    yield test, "abc\ndef\nghi", [(0, 4), (4, 4)], 0, 5
+
+
+def test_Text_ends_with_newline():
+    def test(string, expect):
+        eq_(mod.Text(string).ends_with_newline(), expect)
+
+    yield test, "", False
+    yield test, "abc", False
+    yield test, "abc\n", True
+    yield test, "abc\r", True
+    yield test, "abc ", True
+    yield test, "abc\n\U0001f612", False
+
+
+def test_Text_find_range():
+    text = mod.Text("lol \U0001f612 Lol \U0001f612")
+    def test(args, expect):
+        eq_(text.find_range(*args), expect)
+
+    yield test, ("lol",), (0, 3)
+    yield test, ("lol", 1), (-1, 0)
+    yield test, ("lol", 1, None, False, False), (7, 3)
+    yield test, ("\U0001f612",), (4, 2)
+    yield test, ("\U0001f612", None, None, True), (11, 2)
+    yield test, ("\U0001f612", None, 11, True), (4, 2)
+    yield test, ("x",), (-1, 0)
+
+
+def test_Text_search():
+    text = mod.Text("WATCHOUT! \U0001f34c don't slip eeée")
+    def test(pattern, expect_span, *args):
+        match = text.search(re.compile(pattern), *args)
+        eq_(text[match.start():match.end()], match.group(0))
+        eq_(match.span(), expect_span)
+
+    yield test, r"AT", (1, 3)
+    yield test, r" . ", (9, 13)
+    yield test, r"e*.e", (25, 29), 25
+    yield test, r"o", (14, 15), 10, 15
+
+    text = mod.Text("plain text")
+    yield test, r"xt", (8, 10)
+
+
+def test_Text_finditer():
+    text = mod.Text("lol \U0001f612 \U0001f34c slipping awé \U0001f34c")
+    def test(pattern, expect_spans, *args):
+        spans = []
+        texts = []
+        matches = []
+        for match in text.finditer(re.compile(pattern), *args):
+            span = match.span()
+            spans.append(span)
+            texts.append(text[span[0]:span[1]])
+            matches.append(match.group(0))
+        eq_(texts, matches)
+        eq_(spans, expect_spans)
+
+    yield test, r" [^ ]+", [(3, 6), (6, 9), (9, 18), (18, 23), (23, 26)]
+    yield test, r" .(?= |$)", [(6, 9), (23, 26)], 4
+    yield test, r" .(?= |$)", [(6, 9)], 4, 9
+
+
+def test_Text_count_chars():
+    text = mod.Text("  \t\U0001f612 x")
+    def test(chars, start, expect, end=None):
+        eq_(text.count_chars(chars, start, end), expect)
+
+    yield test, " ", 0, 2
+    yield test, " \t", 0, 3
+    yield test, " \t", 0, 1, 1
+    yield test, " \t", 3, 0
+    yield test, " \U0001f612", 3, 3
+    yield test, " ", 7, 0
+
+
+def test_composed_length():
+    def test(text, length):
+        eq_(mod.composed_length(mod.Text(text)), length)
+
+    yield test, '\u00e9', 1
+    yield test, 'e\u0301', 1
+    yield test, 'e\u0301 e\u0301', 3
+    yield test, '\U0001f612', 1
@@ -94,7 +94,8 @@ def test_init_syntax_definitions():
     app = Application(profile='/editxtdev')
     rsrc_path = m.method(app.resource_path)() >> "/tmp/resources"
     SyntaxFactory = m.replace(syntax, 'SyntaxFactory', spec=False)
-    sf = SyntaxFactory() >> m.mock(syntax.SyntaxFactory)
+    sf = SyntaxFactory(join('/editxtdev', const.CACHE_DIR)) \
+        >> m.mock(syntax.SyntaxFactory)
     app_log = m.replace("editxt.application.log")
     for path, info in [(rsrc_path, False), ('/editxtdev', True)]:
         sf.load_definitions(join(path, const.SYNTAX_DEFS_DIR), info)
@@ -967,6 +968,28 @@ def test_will_terminate():
     with m:
         app.will_terminate()
 
+def test_will_terminate_saves_grammar_cache():
+    from editxt.syntax import SyntaxFactory
+    app = Application()
+    m = Mocker()
+    m.method(app.save_window_states)() >> None
+    sf = app.syntax_factory = m.mock(SyntaxFactory)
+    sf.save_cache()
+    with m:
+        app.will_terminate()
+
+def test_will_terminate_saves_highlight_snapshots():
+    with test_app("editor(a) editor(b)") as app:
+        m = Mocker()
+        m.method(app.save_window_states)() >> None
+        app.syntax_factory = None
+        docs = list(app.documents)
+        eq_(len(docs), 2)
+        for doc in docs:
+            m.method(doc.save_highlight)()
+        with m:
+            app.will_terminate()
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # OpenPathController tests
 from editxt.application import OpenPathController
@@ -161,6 +161,7 @@ def test_Config_schema():
         {"error": ["soft_wrap: expected one of (none|word), got 'xyz'"]}
 
     yield test, {}, "updates_path_on_file_move", True
+    yield test, {}, "highlight_snapshots", True
 
     yield test, {}, "diff_program", "opendiff"
     yield test, {"diff_program": "gdiff -u"}, "diff_program", "gdiff -u"
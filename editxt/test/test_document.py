@@ -450,6 +450,77 @@ def test_TextDocument__load():
     yield test, "abs-exists"
 
 
+def test_TextDocument_load_progressively():
+    def test(content, expect_progress, eol=const.NEWLINE_MODE_UNIX,
+             expect_text=None):
+        with tempdir() as tmp, test_app() as app, \
+                replattr(const, "PROGRESSIVE_LOAD_SIZE", 20), \
+                replattr(const, "LOAD_CHUNK_SIZE", 10):
+            path = os.path.join(tmp, "file.txt")
+            with open(path, "wb") as file:
+                if isinstance(content, str):
+                    content = content.encode("utf-8")
+                file.write(content)
+            doc = app.document_with_path(path)
+            progress = []
+            loaded = doc._loaded
+            def _loaded(loader, text, value):
+                progress.append(value)
+                loaded(loader, text, value)
+            doc._loaded = _loaded
+            colored = []
+            color_text = doc.syntaxer.color_text
+            def color(*args, **kw):
+                colored.append(doc.is_loading)
+                color_text(*args, **kw)
+            doc.syntaxer.color_text = color
+            if expect_text is None:
+                expect_text = content.decode("utf-8")
+            eq_(doc.text, expect_text) # triggers doc._load()
+            eq_(progress, expect_progress)
+            eq_(doc.newline_mode, eol)
+            assert not doc.is_loading
+            # highlighting is deferred until loading is complete
+            assert True not in colored, colored
+            if progress:
+                eq_(colored[-1:], [False])
+    yield test, "line one\nline two\n", []
+    yield test, "line one\nline two\nthree\n", [19 / 24, 1.0, None]
+    yield test, "line one\r\nline two\r\n\u00e9\u00e9\u00e9\r\n", \
+        [20 / 28, 1.0, None], const.NEWLINE_MODE_WINDOWS
+    yield test, "line one two three four\n", []
+    # not UTF-8 after the first chunk: reload the whole file
+    yield test, b"line one\nline two\n\xe9\xe9\n", [19 / 22, None], \
+        const.NEWLINE_MODE_UNIX, "line one\nline two\n\u00e9\u00e9\n"
+
+def test_TextDocument_load_progressively_read_only():
+    from editxt.editor import Editor
+    content = b"line one\nline two\n\xe9\xe9\n"
+    with tempdir() as tmp, test_app("project") as app, \
+            replattr(const, "PROGRESSIVE_LOAD_SIZE", 20), \
+            replattr(const, "LOAD_CHUNK_SIZE", 10):
+        path = os.path.join(tmp, "file.txt")
+        with open(path, "wb") as file:
+            file.write(content)
+        project = app.windows[0].projects[0]
+        doc = app.document_with_path(path)
+        edits = []
+        loaded = doc._loaded
+        def _loaded(loader, text, value):
+            assert doc.is_loading
+            editor = Editor(project, document=doc)
+            edits.append(editor.put("edit", (0, 0)))
+            loaded(loader, text, value)
+        doc._loaded = _loaded
+        # the second chunk cannot be decoded: the whole file is reloaded
+        eq_(doc.text, "line one\nline two\n\u00e9\u00e9\n")
+        eq_(edits, [False, False])
+        assert not doc.is_loading
+        editor = Editor(project, document=doc)
+        assert editor.put("edit", (0, 0))
+        eq_(doc.text, "editline one\nline two\n\u00e9\u00e9\n")
+
+
 def setup_path(tmp, path):
     if path is not None:
         if os.path.isabs(path):
@@ -743,19 +814,96 @@ def test_TextDocument_comment_token(app):
     with m:
         eq_(doc.comment_token, "#")
 
-@test_app
-def test_TextDocument_on_text_edit(app):
+def test_TextDocument_on_text_edit():
     from editxt.syntax import Highlighter
-    m = Mocker()
-    doc = TextDocument(app)
-    with m.off_the_record():
-        ts = doc.text_storage = m.mock(ak.NSTextStorage)
-    ts.editedMask() >> -1
-    syn = doc.syntaxer = m.mock(Highlighter)
-    range = (0, 20)
-    syn.color_text(ts, range, timeout=0.05)
-    with m:
-        doc.on_text_edit(range)
+    @test_app
+    def test(app, length, threaded):
+        m = Mocker()
+        doc = TextDocument(app)
+        with m.off_the_record():
+            ts = doc.text_storage = m.mock(ak.NSTextStorage)
+        ts.editedMask() >> -1
+        len(ts) >> length
+        syn = doc.syntaxer = m.mock(Highlighter)
+        range = (0, 20)
+        syn.color_text(ts, range, timeout=0.05,
+                       threaded=threaded, priority=None)
+        with m:
+            doc.on_text_edit(range)
+    yield test, 20, False
+    yield test, const.BACKGROUND_HIGHLIGHT_LENGTH + 1, True
+
+def test_TextDocument_color_text_with_highlight_snapshot():
+    from editxt.syntax import Highlighter
+    @test_app
+    def test(app, runs):
+        m = Mocker()
+        doc = TextDocument(app)
+        with m.off_the_record():
+            ts = doc.text_storage = m.mock(ak.NSTextStorage)
+        len(ts) >> 20
+        m.method(doc.load_highlight)() >> runs
+        syn = doc.syntaxer = m.mock(Highlighter)
+        if runs is None:
+            syn.color_text(ts, None, timeout=0.05,
+                           threaded=False, priority=None)
+        else:
+            syn.restore(ts, runs, timeout=0.05, threaded=False)
+        with m:
+            doc.color_text()
+    yield test, None
+    yield test, [(0, (None, ""))]
+
+def test_TextDocument_save_highlight():
+    from editxt.syntax import HighlightCache, SyntaxFactory
+    @gentest
+    def test(saved=True, length=const.HIGHLIGHT_SNAPSHOT_LENGTH, mtime=1,
+             dirty=False, enabled=True):
+        m = Mocker()
+        with test_app(config={"highlight_snapshots": enabled}) as app:
+            doc = TextDocument(app)
+            path = doc.file_path
+            spans = doc.syntaxer.spans
+            sdef = doc.syntaxdef
+            with m.off_the_record():
+                ts = doc.text_storage = m.mock(ak.NSTextStorage)
+            sf = app.syntax_factory = m.mock(SyntaxFactory)
+            cache = sf.highlight_cache >> m.mock(HighlightCache)
+            m.property(doc, "file_mtime").value >> mtime
+            if mtime is not None:
+                len(ts) >> length
+                if length >= const.HIGHLIGHT_SNAPSHOT_LENGTH and enabled:
+                    m.method(doc.is_dirty)() >> dirty
+            if saved:
+                cache.save(path, ts, spans, sdef)
+            with m:
+                doc.save_highlight()
+    yield test()
+    yield test(False, length=const.HIGHLIGHT_SNAPSHOT_LENGTH - 1)
+    yield test(False, mtime=None)
+    yield test(False, dirty=True)
+    yield test(False, enabled=False)
+
+def test_TextDocument_visible_range():
+    @gentest
+    def test(visible, result):
+        m = Mocker()
+        with test_app("editor(a) editor(a)") as app:
+            doc = app.windows[0].projects[0].editors[0].document
+            editors = list(app.iter_editors_of_document(doc))
+            eq_(len(editors), 2)
+            for editor, rng in zip(editors, visible):
+                if rng is None:
+                    editor.text_view = None
+                else:
+                    editor.text_view = m.mock()
+                    editor.text_view.get_visible_char_range() >> rng
+                    break
+            with m:
+                eq_(doc.visible_range(), result)
+    yield test([None, (5, 10)], (5, 10))
+    yield test([(1, 2)], (1, 2))
+    yield test([None, None], None)
 
 @test_app
 def test_TextDocument_color_text_with_null_text_storage(app):
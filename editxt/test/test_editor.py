@@ -763,6 +763,26 @@ def test_Editor_do_command():
         return True
     yield test, const.ESCAPE, setup_mocks
 
+@test_app("editor")
+def test_Editor_show_load_progress(app):
+    editor = app.windows[0].projects[0].editors[0]
+    view = editor.command_view = CommandView()
+    editor.show_load_progress(0.25)
+    eq_(view.output_text, "Loading {}... 25%".format(editor.name))
+    assert view.is_waiting()
+    editor.show_load_progress(None)
+    eq_(view.output_text, "")
+    assert not view.is_waiting()
+
+    # other messages are not replaced or cleared
+    editor.show_load_progress(0.25)
+    editor.message("command result")
+    editor.show_load_progress(0.5)
+    eq_(view.output_text, "command result")
+    editor.show_load_progress(None)
+    eq_(view.output_text, "command result")
+    assert not view.is_waiting()
+
 @test_app("editor(a)")
 def test_Editor_highlight_selection_after_close(app):
     m = Mocker()
@@ -17,13 +17,15 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+import unicodedata
 from functools import partial
 
 from editxt.constants import Constant
+import editxt.platform.text as platform_text
 from editxt.linenumbers import LineNumbers
 from editxt.platform.text import Text
 
-from editxt.test.util import assert_raises, eq_, gentest
+from editxt.test.util import assert_raises, eq_, gentest, replattr
 
 END = Constant("END")
 
@@ -151,6 +153,36 @@ def test_delitem_len_bug():
     assert lines.newline_at_end, 'no newline at end: ' + repr(text)
     eq_(len(lines), 2, repr(text))
 
+
+def test_edit():
+    @gentest
+    def test(rng, value, known, text=TEXT, preset=END):
+        text = Text(text)
+        lines = LineNumbers(text)
+        if preset is END:
+            list(lines.iter_from(0))
+        elif preset is not None:
+            lines[preset]
+        text[rng] = value
+        eq_(list(lines.lines), known)
+        eq_(lines.end, None)
+        eq_(list(lines.iter_from(0)),
+            list(LineNumbers(Text(str(text))).iter_from(0)))
+
+    yield test((0, 0), "x", [0, 5, 9, 10, 15])
+    yield test((1, 1), "", [0, 3, 7, 8, 13])
+    yield test((5, 0), "\n", [0, 4, 6, 9, 10, 15])
+    yield test((3, 1), "", [0, 7, 8, 13])
+    yield test((3, 6), "", [0, 8])
+    yield test((8, 0), "x\ny", [0, 4, 8, 10, 12, 17])
+    yield test((3, 1), "\r", [0, 4, 8, 9, 14])
+    yield test((3, 0), "\n", [0], "\r\n\n", None)
+    yield test((1, 0), "\n", [0], "\r\n", 1)
+    yield test((1, 0), "\n", [0, 2], "\rb")
+    yield test((1, 0), "x", [0], "\r\n", 1)
+    yield test((15, 0), "x", [0, 4, 8, 9], TEXT, 10)
+    yield test((17, 1), "", [0, 4, 8, 9, 14])
+
 def test_len():
     @gentest
     def test(expect, text, iter_to_line=None):
@@ -287,3 +319,67 @@ def test_index_of_line():
         yield test(5, 14, iter_to_line=to)
         yield test(6, 18, iter_to_line=to)
         yield test(7, ValueError, iter_to_line=to)
+
+def test_LineStarts():
+    from editxt.linenumbers import LineStarts
+    lines = LineStarts()
+    eq_(list(lines), [0])
+    for offset in [4, 8, 9]:
+        lines.append(offset)
+    eq_(list(lines), [0, 4, 8, 9])
+    eq_((len(lines), lines[1], lines[-1]), (4, 4, 9))
+    eq_(lines.offsets.itemsize, 8)
+    eq_(lines.bisect(4), 2)
+
+    lines.splice(1, 2, [3, 5], 2)
+    eq_(list(lines), [0, 3, 5, 10, 11])
+    copy = lines.copy()
+    lines.append(14)
+    eq_(list(lines), [0, 3, 5, 10, 11, 14])
+    eq_(lines.pop(), 14)
+    del lines[3:]
+    eq_(list(lines), [0, 3, 5])
+    eq_(list(copy), [0, 3, 5, 10, 11])
+    copy.append(15)
+    eq_(list(copy), [0, 3, 5, 10, 11, 15])
+
+def test_Columns():
+    from editxt.linenumbers import Columns
+    text = Text("abc\ne\u0301 \U0001f612 xyz\n" + "x" * 20)
+    columns = Columns(text)
+    counts = []
+    def composed_length(string, enumerate=False):
+        counts.append(len(string))
+        return len(unicodedata.normalize("NFC", str(string)))
+    def test(line_start, index, expect, counted):
+        del counts[:]
+        with replattr(platform_text, "composed_length", composed_length):
+            eq_(columns(line_start, index), expect)
+        eq_(sum(counts), counted)
+
+    with replattr(Columns, "ANCHOR_SPACING", 2):
+        test(0, 0, 0, 0)
+        test(0, 2, 2, 2)
+        test(0, 3, 3, 1)
+        test(4, 6, 1, 2)
+        test(4, 9, 3, 2)
+        test(4, 13, 7, 4)
+        test(4, 12, 6, 1)
+        test(4, 7, 2, 1)
+        test(4, 5, 1, 1)  # closer to line start
+
+        # anchors are kept for each line
+        test(14, 34, 20, 20)
+        test(4, 13, 7, 0)
+        test(14, 33, 19, 1)
+        test(0, 2, 2, 0)
+
+        text[(13, 0)] = "!"  # edit after anchor at 9
+        test(4, 12, 6, 3)
+        test(4, 14, 8, 2)
+        test(15, 35, 20, 20)  # line start moved
+        text[(12, 0)] = "\u0301"  # combine with "y" at anchor 12
+        test(4, 13, 6, 4)
+        text[(4, 0)] = "_"  # edit at line start
+        test(4, 8, 3, 4)
+    columns.close()
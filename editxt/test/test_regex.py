@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2015 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+import logging
+import re
+
+from nose.plugins.skip import SkipTest
+from testil import replattr
+
+import editxt.regex as mod
+from editxt.platform.text import Text
+from editxt.test.util import assert_raises, eq_, gentest
+
+log = logging.getLogger(__name__)
+
+
+def engines():
+    yield None
+    if mod._regex is not None:
+        yield mod._regex
+
+
+def test_compile():
+    @gentest
+    def test(engine, pattern, string, expect, flags=0, pos=0, endpos=None,
+             text_expect=None):
+        with replattr(mod, "_regex", engine):
+            regex = mod.compile(pattern, flags, timeout=1)
+            name = "re" if engine is None else "regex"
+            eq_(regex.engine, name)
+            eq_(repr(regex), "<Regex {} {!r}>".format(name, pattern))
+            eq_(regex.pattern, pattern)
+            args = (pos,) if endpos is None else (pos, endpos)
+            eq_([m.span() for m in regex.finditer(string, *args)], expect)
+            match = regex.search(string, *args)
+            eq_(match and match.span(), expect[0] if expect else None)
+            text = Text(string)
+            if text_expect is not None:
+                expect = text_expect  # NSString (UTF-16) indexes
+            eq_([m.span() for m in text.finditer(regex, *args)], expect)
+            match = text.search(regex, *args)
+            eq_(match and match.span(), expect[0] if expect else None)
+
+    for engine in engines():
+        yield test(engine, "b", "abcb", [(1, 2), (3, 4)])
+        yield test(engine, "b", "abcb", [(3, 4)], pos=2)
+        yield test(engine, "b", "abcb", [(1, 2)], endpos=3)
+        yield test(engine, "x", "abcb", [])
+        yield test(engine, "a*|b", "b", [(0, 0), (0, 1), (1, 1)])
+        yield test(engine, "B", "abcb", [(1, 2), (3, 4)], re.IGNORECASE)
+        yield test(engine, "^b", "a\nb", [(2, 3)], re.MULTILINE)
+        yield test(engine, "(?P<x>é)", "eé", [(1, 2)])
+        yield test(engine, "\U0001f34b", "a\U0001f34b\U0001f34b",
+                   [(1, 2), (2, 3)], text_expect=[(1, 3), (3, 5)])
+
+def test_compile_error():
+    for engine in engines():
+        with replattr(mod, "_regex", engine):
+            with assert_raises(re.error):
+                mod.compile("(")
+
+def test_compile_without_timeout():
+    for engine in engines():
+        with replattr(mod, "_regex", engine):
+            regex = mod.compile("b")
+            eq_(regex.finditer, regex.compiled.finditer)
+            eq_(regex.search, regex.compiled.search)
+
+def test_re_finditer_timeout():
+    clock = iter([0, 1, 1, 3])
+    with replattr((mod, "_regex", None), (mod, "time", lambda: next(clock))):
+        regex = mod.compile("b", timeout=1.5)
+        matches = regex.finditer("abcb")
+        eq_(next(matches).span(), (1, 2))
+        with assert_raises(TimeoutError, msg="match took more than 1.5 "
+                                              "seconds: 'b'"):
+            next(matches)
+
+def test_regex_match_timeout():
+    if mod._regex is None:
+        raise SkipTest("regex package not installed")
+    regex = mod.compile(r"(a|aa)+b|x", timeout=0.1)
+    string = "xx" + "a" * 40
+    matches = regex.finditer(string)
+    eq_(next(matches).span(), (0, 1))
+    eq_(next(matches).span(), (1, 2))
+    with assert_raises(TimeoutError):
+        next(matches)
+    with assert_raises(TimeoutError):
+        regex.search(string, 2)
+
+def test_regex_finditer_timeout_applies_to_each_match():
+    if mod._regex is None:
+        raise SkipTest("regex package not installed")
+    regex = mod.compile(r"a", timeout=0.01)
+    string = "ab" * 200000
+    eq_(sum(1 for m in regex.finditer(string)), 200000)
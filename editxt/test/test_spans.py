@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2015 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+import re
+
+from editxt.spans import Checkpoints, Spans, Symbols, UNKNOWN
+
+from editxt.test.util import assert_raises, eq_, gentest
+
+X = (UNKNOWN, "")
+
+
+def test_Checkpoints():
+    cp = Checkpoints()
+    eq_(list(cp), [(0, "")])
+    eq_(cp.replace(0, 4, "a"), None)
+    eq_(cp.replace(4, 8, "a"), None)
+    eq_(cp.replace(8, 12, ""), None)
+    eq_(list(cp), [(0, ""), (4, "a"), (8, "a"), (12, "")])
+    eq_(cp.before(3), (0, ""))
+    eq_(cp.before(4), (4, "a"))
+    eq_(cp.before(100), (12, ""))
+
+    cp.edit(5, 7, 2)  # insert 2 chars at 5
+    eq_(list(cp), [(0, ""), (4, "a"), (10, "a"), (14, "")])
+    cp.edit(1, 1, -2)  # delete 2 chars at 1
+    eq_(list(cp), [(0, ""), (2, "a"), (8, "a"), (12, "")])
+    eq_(cp.replace(0, 8, "b"), "a")
+    eq_(list(cp), [(0, ""), (8, "b"), (12, "")])
+    eq_(cp.replace(8, 13, "b"), None)
+    eq_(list(cp), [(0, ""), (8, "b"), (13, "b")])
+    cp.truncate(8)
+    eq_(list(cp), [(0, ""), (8, "b")])
+    cp.truncate(0)
+    eq_(list(cp), [(0, "")])
+
+def test_Checkpoints_update():
+    cp = Checkpoints()
+    cp.update(0, [(4, "a"), (8, "a"), (12, "")])
+    eq_(list(cp), [(0, ""), (4, "a"), (8, "a"), (12, "")])
+    eq_(cp.get(0), "")
+    eq_(cp.get(8), "a")
+    eq_(cp.get(9), None)
+
+    copy = cp.copy()
+    cp.edit(5, 7, 2)  # insert 2 chars at 5
+    cp.update(4, [(6, "b"), (10, "b")])
+    eq_(list(cp), [(0, ""), (4, "a"), (6, "b"), (10, "b"), (14, "")])
+    eq_(list(copy), [(0, ""), (4, "a"), (8, "a"), (12, "")])
+    eq_(cp.items(5, 10), [(6, "b"), (10, "b")])
+    eq_(cp.items(0, 4), [(0, ""), (4, "a")])
+    eq_(cp.items(11, 100), [(14, "")])
+    eq_(cp.items(15, 100), [])
+
+    # equivalent to a sequence of replace calls
+    copy.replace(4, 6, "b")
+    copy.replace(6, 10, "b")
+    eq_(list(copy), [(0, ""), (4, "a"), (6, "b"), (10, "b"), (12, "")])
+
+    cp.update(0, [(20, "c")])
+    eq_(list(cp), [(0, ""), (20, "c")])
+    cp.update(20, [])
+    eq_(list(cp), [(0, ""), (20, "c")])
+
+def test_Symbols():
+    sym = Symbols()
+    eq_(list(sym), [])
+    sym.update(0, 20, [(0, "a"), (4, "b"), (12, "c")])
+    eq_(list(sym), [(0, "a"), (4, "b"), (12, "c")])
+    eq_(sym.names(), {"a": [1], "b": [2], "c": [3]})
+
+    sym.edit(5, 7, 2)  # insert 2 chars at 5
+    eq_(list(sym), [(0, "a"), (4, "b"), (14, "c")])
+    sym.edit(0, 0, -1)  # delete 1 char at 0
+    eq_(list(sym), [(3, "b"), (13, "c")])
+    sym.edit(0, 1, 1)  # insert 1 char at 0
+    eq_(list(sym), [(4, "b"), (14, "c")])
+
+    sym.update(0, 10, [(0, "a"), (6, "b")])
+    eq_(list(sym), [(0, "a"), (6, "b"), (14, "c")])
+    sym.update(6, 15, [(8, "a")])
+    eq_(list(sym), [(0, "a"), (8, "a")])
+    sym.update(20, 30, [])
+    eq_(list(sym), [(0, "a"), (8, "a")])
+    sym.clear()
+    eq_(list(sym), [])
+    eq_(sym.names(), {})
+
+def test_Symbols_find():
+    sym = Symbols()
+    sym.update(0, 100, [(0, "abc"), (10, "bcd"), (20, "abc"), (30, "ab")])
+    eq_(sym.find(re.compile("abc")), [(0, "abc"), (20, "abc")])
+    eq_(sym.find(re.compile("b")), [])
+    eq_(sym.find(re.compile("a.*")), [(0, "abc"), (20, "abc"), (30, "ab")])
+
+    names = sym.names()
+    sym.edit(5, 6, 1)  # shift does not invalidate names
+    assert sym.names() is names
+    eq_(sym.find(re.compile("abc")), [(0, "abc"), (21, "abc")])
+    sym.edit(10, 12, 0)  # discard bcd
+    eq_(sym.find(re.compile("b.*")), [])
+    eq_(sym.find(re.compile("abc")), [(0, "abc"), (21, "abc")])
+
+def test_Spans():
+    def make(*runs, length):
+        spans = Spans(length)
+        spans.replace(0, length, [(r[0], r[1:]) for r in runs])
+        return spans
+
+    sp = Spans()
+    eq_(list(sp), [])
+    eq_(sp.key_at(0), "")
+    with assert_raises(IndexError):
+        sp.at(0)
+
+    sp = Spans(10)
+    eq_(list(sp), [(0, 10, UNKNOWN, "")])
+    eq_(sp.replace(0, 10, [(0, ("a", "")), (4, ("b", "1")), (6, ("a", ""))]),
+        [(0, 4, "a"), (4, 2, "b"), (6, 4, "a")])
+    eq_(list(sp), [(0, 4, "a", ""), (4, 2, "b", "1"), (6, 4, "a", "")])
+    eq_(sp.at(5), (4, 2, "b", "1"))
+    eq_(sp.key_at(5), "1")
+    eq_(list(sp.iter_runs(3, 7)),
+        [(3, 1, "a", ""), (4, 2, "b", "1"), (6, 1, "a", "")])
+
+    # unchanged runs are not reported
+    eq_(sp.replace(2, 8, [(2, ("a", "")), (4, ("c", "1")), (6, ("a", ""))]),
+        [(4, 2, "c")])
+    eq_(list(sp), [(0, 4, "a", ""), (4, 2, "c", "1"), (6, 4, "a", "")])
+
+    # adjacent runs are merged
+    eq_(sp.replace(4, 6, [(4, ("a", ""))]), [(4, 2, "a")])
+    eq_(list(sp), [(0, 10, "a", "")])
+
+def test_Spans_edit():
+    @gentest
+    def test(start, stop, delta, runs, length=10):
+        sp = Spans(length)
+        sp.replace(0, length, [(0, ("a", "")), (4, ("b", "")), (6, ("c", ""))])
+        sp.edit(start, stop, delta)
+        eq_(list(sp), runs)
+        eq_(sp.length, length + delta)
+
+    yield test(0, 0, 0, [(0, 4, "a", ""), (4, 2, "b", ""), (6, 4, "c", "")])
+    yield test(0, 1, 1, [(0, 1) + X, (1, 4, "a", ""), (5, 2, "b", ""), (7, 4, "c", "")])
+    yield test(5, 5, -1, [(0, 4, "a", ""), (4, 1, "b", ""), (5, 4, "c", "")])
+    yield test(4, 4, -2, [(0, 4, "a", ""), (4, 4, "c", "")])
+    yield test(3, 5, 0, [(0, 3, "a", ""), (3, 2) + X, (5, 1, "b", ""), (6, 4, "c", "")])
+    yield test(10, 12, 2, [(0, 4, "a", ""), (4, 2, "b", ""), (6, 4, "c", ""), (10, 2) + X])
+    yield test(0, 3, -7, [(0, 3) + X])
+    yield test(0, 0, -10, [], 10)
+
+def test_Spans_replace_changes():
+    @gentest
+    def test(runs, changes, stop=10):
+        sp = Spans(10)
+        sp.replace(0, 10, [(0, ("a", "")), (4, ("b", "")), (6, ("c", ""))])
+        sp.edit(4, 6, 0)
+        eq_(sp.replace(0, stop, runs), changes)
+
+    # edited (unknown) ranges are always changed
+    yield test([(0, ("a", "")), (4, ("b", "")), (6, ("c", ""))], [(4, 2, "b")])
+    yield test([(0, ("a", "")), (6, ("c", ""))], [(4, 2, "a")])
+    yield test([(0, ("c", ""))], [(0, 6, "c")])
+    yield test([(0, ("a", "")), (5, ("d", ""))], [(4, 1, "a"), (5, 1, "d")], 6)
+    yield test([(0, ("a", "")), (2, ("a", "1"))], [(4, 2, "a")], 6)
+
+def test_Spans_replace_changes_by_value():
+    @gentest
+    def test(runs, changes):
+        sp = Spans(10)
+        sp.replace(0, 10, [(0, ("a", "")), (4, ("b", "")), (6, ("c", ""))])
+        sp.edit(8, 9, 0)
+        value = {"a": "x", "b": "x", "c": "y", "d": "y"}.get
+        eq_(sp.replace(0, 10, runs, value), changes)
+
+    # edited (unknown) ranges are always changed
+    yield test([(0, ("a", "")), (4, ("b", "")), (6, ("c", ""))], [(8, 1, "c")])
+    yield test([(0, ("b", "")), (4, ("a", "")), (6, ("d", ""))], [(8, 1, "d")])
+    yield test([(0, ("c", ""))], [(0, 6, "c"), (8, 1, "c")])
+    yield test([(0, ("c", "")), (2, ("d", ""))], [(0, 6, "c"), (8, 1, "d")])
+
+def test_Spans_never_merge_token_with_text_color():
+    class Info(str):
+        pass
+    text_color = "string"
+    token = Info("string")
+    sp = Spans(6)
+    sp.replace(0, 6, [(0, (token, "")), (1, (text_color, "1")), (5, (token, "1"))])
+    eq_(list(sp), [(0, 1, token, ""), (1, 4, text_color, "1"), (5, 1, token, "1")])
+    assert type(list(sp)[2][2]) is Info, list(sp)
+
+def test_Spans_lazy_shift():
+    sp = Spans(1000)
+    sp.replace(0, 1000, [(i, ("ab"[i // 10 % 2], "")) for i in range(0, 1000, 10)])
+    for i in range(10):
+        # insert a character at the start of each of the first 10 runs
+        start = i * 11
+        sp.edit(start, start + 1, 1)
+        sp.replace(start, start + 1, [(start, ("ab"[i % 2], ""))])
+    eq_(sp.length, 1010)
+    eq_(len(sp), 100)
+    eq_(sp.at(1009), (1000, 10, "b", ""))
+    eq_(sp.at(100), (99, 11, "b", ""))
+    eq_(sp.at(110), (110, 10, "a", ""))
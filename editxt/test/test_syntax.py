@@ -38,6 +38,7 @@ import editxt.syntax as mod
 from editxt.config import Config, String
 from editxt.syntax import SyntaxFactory, Highlighter, SyntaxDefinition
 from editxt.syntax import NoHighlight, PLAIN_TEXT, RE
+from editxt.theme import ColorTable
 
 log = logging.getLogger(__name__)
 
@@ -138,6 +139,242 @@ def test_SyntaxFactory_load_definition():
     yield test, c(info=dict(name="text", file_patterns=["*.txt"], comment_token="X"))
     yield test, c(info=dict(name="text", file_patterns=["*.txt"]))
 
+def test_SyntaxFactory_load_definitions_with_manifest():
+    from editxt.syntax import LazyDefinition
+    FOO = ("name = 'Foo'\n"
+           "file_patterns = ['*.foo']\n"
+           "comment_token = '#'\n"
+           "rules = [('keyword', ['foo'])]\n")
+    BAR = ("name = 'Bar'\n"
+           "file_patterns = ['*.bar']\n")
+    QUX = ("__base__ = registry['foo']\n"
+           "name = 'Qux'\n"
+           "file_patterns = ['*.qux']\n")
+
+    class Factory(SyntaxFactory):
+        loaded = []
+        def load_definition(self, filename):
+            self.loaded.append(os.path.basename(filename))
+            return super().load_definition(filename)
+
+    def load(path, cache):
+        Factory.loaded = []
+        sf = Factory(cache)
+        with CaptureLogging(mod) as log:
+            sf.load_definitions(path, False)
+        eq_(log.data.get("error"), None)
+        return sf
+
+    with tempdir() as tmp:
+        defs = os.path.join(tmp, "defs")
+        cache = os.path.join(tmp, "cache")
+        os.mkdir(defs)
+        def write(name, content):
+            filename = os.path.join(defs, name + const.SYNTAX_DEF_EXTENSION)
+            with open(filename, "w", encoding="utf-8") as fh:
+                fh.write(content)
+            return filename
+        foo = write("foo", FOO)
+        bar = write("bar", BAR)
+
+        sf = load(defs, cache)
+        eq_(Factory.loaded, ["bar.syntax.py", "foo.syntax.py"])
+        assert os.path.exists(os.path.join(cache, const.SYNTAX_MANIFEST))
+        eq_(sorted(sf.registry), ["*.bar", "*.foo", "*.txt"])
+
+        # definitions are not executed until needed
+        sf = load(defs, cache)
+        eq_(Factory.loaded, [])
+        eq_(sorted(sf.registry), ["*.bar", "*.foo", "*.txt"])
+        sdef = sf.get_definition("file.foo")
+        assert isinstance(sdef, LazyDefinition), sdef
+        eq_(sdef.name, "Foo")
+        eq_(sf["foo"], sdef)
+        eq_(Factory.loaded, [])
+        eq_(sdef.comment_token, "#")
+        eq_(Factory.loaded, ["foo.syntax.py"])
+        eq_(sorted(sdef.wordinfo.values()), ["Foo keyword"])
+        eq_(Factory.loaded, ["foo.syntax.py"])
+
+        # changed definition file is reloaded
+        mtime = os.stat(bar).st_mtime_ns + 10 ** 9
+        os.utime(bar, ns=(mtime, mtime))
+        sf = load(defs, cache)
+        eq_(Factory.loaded, ["bar.syntax.py"])
+
+        # definition with a base is always loaded (after its base)
+        qux = write("qux", QUX)
+        for i in range(2):
+            sf = load(defs, cache)
+            eq_(Factory.loaded, ["qux.syntax.py", "foo.syntax.py"])
+            eq_(sf.get_definition("file.qux").comment_token, "#")
+
+        # removed definition file is dropped
+        os.remove(foo)
+        write("qux", "name = 'Qux'\n")
+        sf = load(defs, cache)
+        eq_(Factory.loaded, ["qux.syntax.py"])
+        sf = load(defs, cache)
+        eq_(Factory.loaded, [])
+        eq_(sorted(sf.registry), ["*.bar", "*.txt"])
+        eq_(sorted(sf.manifest.entries), [bar, qux])
+
+def test_SyntaxFactory_grammar_cache():
+    from editxt.platform.text import Text
+    FOO = ("name = 'Foo'\n"
+           "file_patterns = ['*.foo']\n"
+           "rules = [\n"
+           "    ('keyword', ['foo']),\n"
+           "    ('string', '\"', ['\"']),\n"
+           "    ('comment', '/*', ['*/']),\n"
+           "    ('tag', '<', ['>'], 'bar'),\n"
+           "]\n")
+    BAR = ("name = 'Bar'\n"
+           "file_patterns = ['*.bar']\n"
+           "rules = [('keyword', ['bar'])]\n")
+
+    class theme:
+        text_color = "text_color"
+        def get_syntax_color(name):
+            return name
+        def color_table(sdef):
+            return ColorTable(theme.get_syntax_color)
+
+    def load(path, cache):
+        sf = SyntaxFactory(cache)
+        sf.load_definitions(path, False)
+        return sf
+
+    def highlight(sf, string):
+        hl = Highlighter(theme)
+        hl.syntaxdef = sf.get_definition("file.foo")
+        hl.color_text(Text(string))
+        return token_ranges(hl)
+
+    init = SyntaxDefinition._init
+    def count_init(sdef):
+        count_init.calls += 1
+        return init(sdef)
+    count_init.calls = 0
+
+    with tempdir() as tmp, \
+            replattr(SyntaxDefinition, "_init", count_init, sigcheck=False):
+        defs = os.path.join(tmp, "defs")
+        cache = os.path.join(tmp, "cache")
+        os.mkdir(defs)
+        def write(name, content):
+            filename = os.path.join(defs, name + const.SYNTAX_DEF_EXTENSION)
+            with open(filename, "w", encoding="utf-8") as fh:
+                fh.write(content)
+        write("foo", FOO)
+        write("bar", BAR)
+        simple = 'foo "x" foo'
+        nested = 'foo /* foo */ <bar foo> "y"'
+        expect_simple = highlight(load(defs, None), simple)
+        expect_nested = highlight(load(defs, None), nested)
+
+        sf = load(defs, cache)
+        eq_(highlight(sf, simple), expect_simple)
+        sf.save_cache()
+
+        # expanded states are restored from cache
+        sf = load(defs, cache)
+        sdef = sf.get_definition("file.foo")
+        count_init.calls = 0
+        eq_(highlight(sf, simple), expect_simple)
+        eq_(count_init.calls, 0)
+
+        # unexpanded (deferred) states are expanded on demand
+        eq_(highlight(sf, nested), expect_nested)
+        assert count_init.calls, "deferred states not expanded"
+        sf.save_cache()
+
+        sf = load(defs, cache)
+        count_init.calls = 0
+        eq_(highlight(sf, nested), expect_nested)
+        eq_(count_init.calls, 0)
+
+        # cache is invalidated when a referenced definition changes
+        write("bar", BAR.replace("bar']", "bar', 'baz']"))
+        sf = load(defs, cache)
+        count_init.calls = 0
+        eq_(highlight(sf, nested), expect_nested)
+        assert count_init.calls, "stale cache used"
+
+def test_HighlightCache():
+    from editxt.platform.text import Text
+    from editxt.syntax import GrammarCache, HighlightCache
+
+    class theme:
+        text_color = "text_color"
+        def get_syntax_color(name):
+            return name
+        def color_table(sdef):
+            return ColorTable(theme.get_syntax_color)
+
+    python = get_syntax_definition("python")
+    content = "def f(x):\n    return 'x'  # comment\n" * 3
+
+    def highlight(text, sdef=python):
+        hl = Highlighter(theme)
+        hl.syntaxdef = sdef
+        hl.color_text(text)
+        return hl
+
+    def colors(spans):
+        runs = []
+        for start, length, info, key in spans:
+            info = None if info is None else str(info)
+            if runs and runs[-1][2] == info:
+                runs[-1][1] += length
+            else:
+                runs.append([start, length, info])
+        return runs
+
+    with tempdir() as tmp:
+        grammars = GrammarCache(os.path.join(tmp, "grammars"))
+        cache = HighlightCache(os.path.join(tmp, "highlights"), grammars)
+        path = os.path.join(tmp, "file.py")
+        with open(path, "w", encoding="utf-8") as fh:
+            fh.write(content)
+        text = Text(content)
+        hl = highlight(text)
+        assert cache.save(path, text, hl.spans, python)
+        runs = cache.load(path, text, python)
+        spans = mod.Spans(len(text))
+        spans.replace(0, len(text), runs)
+        eq_(colors(spans), colors(hl.spans))
+
+        # snapshot is not used if the key has changed
+        eq_(cache.load(path, Text(content + "x"), python), None)
+        eq_(cache.load(path, Text(content.upper()), python), None)
+        eq_(cache.load(path, text, get_syntax_definition("xml")), None)
+        eq_(cache.load(path, text, PLAIN_TEXT), None)
+        eq_(cache.load(path + "x", text, python), None)
+        stat = os.stat(path)
+        os.utime(path, (stat.st_atime, stat.st_mtime + 1))
+        eq_(cache.load(path, text, python), None)
+
+        # incomplete highlight is not saved
+        hl.spans.edit(5, 6, 0)
+        assert not cache.save(path, text, hl.spans, python)
+        eq_(cache.load(path, text, python), None)
+
+        # least recently used snapshots are evicted
+        os.remove(cache._cache_file(path))
+        paths = [os.path.join(tmp, name) for name in ["a.py", "b.py", "c.py"]]
+        for i, path in enumerate(paths):
+            with open(path, "w", encoding="utf-8") as fh:
+                fh.write(content)
+            assert cache.save(path, text, highlight(text).spans, python)
+            os.utime(cache._cache_file(path), (i, i))
+        cache.load(paths[0], text, python)  # mark recently used
+        cache.max_size = sum(os.path.getsize(cache._cache_file(path))
+                             for path in [paths[0], paths[2]])
+        cache.evict()
+        eq_([bool(cache.load(path, text, python)) for path in paths],
+            [True, False, True])
+
 def test_SyntaxFactory_index_definitions():
     from editxt.valuetrans import SyntaxDefTransformer
     class FakeDef(object):
@@ -171,66 +408,109 @@ def test_SyntaxFactory_get_definition():
     eq_(sf.get_definition("somefile.txt"), "<syntax def>")
     eq_(sf.get_definition("somefile.text"), PLAIN_TEXT)
 
+def test_SyntaxFactory_get_definition_precedence():
+    @gentest
+    def test(filename, expect):
+        sf = SyntaxFactory()
+        sf.registry = {
+            "*.txt": "text",
+            "*.tar.gz": "tarball",
+            "*.gz": "gzip",
+            "Makefile": "make",
+            "*.mk": "make",
+            "[Rr]akefile": "ruby",
+            "*.py[cod]": "bytecode",
+            "*.py": "python",
+            "*file": "anyfile",
+            "?": "char",
+        }
+        eq_(sf.get_definition(filename), expect)
+
+    yield test("a.txt", "text")
+    yield test(".txt", "text")
+    yield test("txt", PLAIN_TEXT)
+    yield test("a.txt.gz", "gzip")
+    yield test("a.tar.gz", "tarball")
+    yield test("a.gz.tar", PLAIN_TEXT)
+    yield test("Makefile", "make")
+    yield test("makefile", "anyfile")
+    yield test("rakefile", "ruby")
+    yield test("a.pyc", "bytecode")
+    yield test("a.py", "python")
+    yield test("a.pyfile", "anyfile")
+    yield test("a.py.txt", "text")
+    yield test("x", "char")
+    yield test("", PLAIN_TEXT)
+
+def test_SyntaxFactory_get_definition_after_registry_change():
+    sf = SyntaxFactory()
+    sf.registry["*.py"] = "python"
+    eq_(sf.get_definition("a.py"), "python")
+    sf.registry["*.py"] = "python 3"
+    eq_(sf.get_definition("a.py"), "python 3")
+    sf.registry["*"] = "any"
+    eq_(sf.get_definition("a.py"), "python 3")
+    eq_(sf.get_definition("a.js"), "any")
+    del sf.registry["*.py"]
+    eq_(sf.get_definition("a.py"), "any")
+    sf.registry.pop("*")
+    eq_(sf.get_definition("a.py"), PLAIN_TEXT)
+    sf.registry = {"*.py": "python"}
+    eq_(sf.get_definition("a.py"), "python")
+
 def test_Highlighter_syntaxdef_default():
     syn = Highlighter(None)
     eq_(syn.syntaxdef, PLAIN_TEXT) # check default
     eq_(syn.filename, None) # check default
 
 def test_Highlighter_color_text():
-    from objc import NULL
     from textwrap import dedent
     from editxt.platform.text import Text as BaseText
-    from editxt.syntax import SYNTAX_RANGE, SYNTAX_TOKEN
+    from editxt.syntax import MatchInfo
 
     class Text(BaseText):
         def colors(self, highlighter):
-            seen = set()
             lines = []
-            length = len(self)
-            full = rng = (0, length)
             fg_color = ak.NSForegroundColorAttributeName
             long_range = self.attribute_atIndex_longestEffectiveRange_inRange_
-            while rng[1] > 0:
-                key, xrng = long_range(SYNTAX_RANGE, rng[0], None, rng)
+            get_syntax_color = highlighter.theme.get_syntax_color
+            runs = []
+            for start, length, info, key in highlighter.spans:
+                if not isinstance(info, MatchInfo) or not get_syntax_color(info):
+                    info = None
+                if info and runs and runs[-1][2] == info:
+                    # merge adjacent tokens (with different keys)
+                    runs[-1][1] += length
+                    continue
+                runs.append([start, length, info, key])
+            for start, length, attr, key in runs:
+                rng = (start, length)
                 lang = (highlighter.langs[key].name if key else "")
                 if lang == highlighter.syntaxdef.name:
                     lang = ""
-                #print(lang.strip(), xrng)
                 level = 1 if lang else 0
-                xend = sum(xrng)
-                while True:
-                    attr, attr_rng = long_range(SYNTAX_TOKEN, xrng[0], None, full)
-                    color, color_rng = long_range(fg_color, xrng[0], None, full)
+                color, color_rng = long_range(fg_color, start, None, rng)
+                assert tuple(color_rng) == rng, (color_rng, rng, color)
+                text = self[rng]
+                if attr or color and color != "text_color" and text.strip():
                     if attr:
-                        color_rng = attr_rng
+                        attr_name = attr
                     else:
-                        color_rng = intersect_ranges(attr_rng, color_rng)
-                    text = self[color_rng]
-                    if attr or color and color != "text_color" and text.strip():
-                        if attr:
-                            attr_name = attr
-                        else:
-                            # default text color, not a matched token
-                            attr_name = "{} {} -".format(lang, color)
-                        print(
-                            attr_name.ljust(30),
-                            (key or '').ljust(15),
-                            repr(text)[1:-1],
-                        )
-                        print_lang = lang and attr and attr.startswith(lang)
-                        attr = attr.rsplit(" ", 1)[-1] if attr else color
-                        lines.append("{}{} {}{}".format(
-                            "  " * level,
-                            text,
-                            attr if attr == color else "{} {}".format(attr, color),
-                            (" " + lang) if print_lang else "",
-                        ))
-                    start = sum(attr_rng)
-                    if start >= xend:
-                        xend = start
-                        break
-                    xrng = (start, xend - start)
-                rng = (xend, length - xend)
+                        # default text color, not a matched token
+                        attr_name = "{} {} -".format(lang, color)
+                    print(
+                        attr_name.ljust(30),
+                        (key or '').ljust(15),
+                        repr(text)[1:-1],
+                    )
+                    print_lang = lang and attr and attr.startswith(lang)
+                    attr = attr.rsplit(" ", 1)[-1] if attr else color
+                    lines.append("{}{} {}{}".format(
+                        "  " * level,
+                        text,
+                        attr if attr == color else "{} {}".format(attr, color),
+                        (" " + lang) if print_lang else "",
+                    ))
             return lines
     @gentest
     def test(lang, string, expect, edit=None):
@@ -1169,6 +1449,477 @@ def test_Highlighter_color_text():
     lang = make_definition(lang)
     yield test_err, "max recursion exceeded", lang, "a", ""
 
+def test_Highlighter_color_text_stops_at_checkpoint():
+    from editxt.platform.text import Text as BaseText
+
+    class Text(BaseText):
+        lines_scanned = 0
+        def line_range(self, rng):
+            self.lines_scanned += 1
+            return super().line_range(rng)
+
+    class theme:
+        text_color = "text_color"
+        def get_syntax_color(name):
+            return name
+        def color_table(sdef):
+            return ColorTable(theme.get_syntax_color)
+
+    @gentest
+    def test(string, edit, max_lines):
+        hl = Highlighter(theme)
+        hl.syntaxdef = get_syntax_definition("python")
+        text = Text(string)
+        hl.color_text(text)
+        start, length, insert = edit
+        text[(start, length)] = insert
+        text.lines_scanned = 0
+        hl.color_text(text, (start, len(insert)))
+        assert text.lines_scanned <= max_lines, text.lines_scanned
+
+        expect = Text(str(text))
+        full = Highlighter(theme)
+        full.syntaxdef = hl.syntaxdef
+        full.color_text(expect)
+        eq_(token_ranges(hl), token_ranges(full))
+        eq_(list(hl.spans), list(full.spans))
+        eq_(list(hl.checkpoints), list(full.checkpoints))
+        eq_(color_ranges(text), color_ranges(expect))
+
+    lines = "x = 1\n" * 1000
+    yield test(lines, (6, 0, "2"), 3)
+    yield test(lines, (6, 0, "'"), 3)
+    yield test(lines, (600, 0, "'''"), 1000)
+    yield test('"""\n' + lines, (604, 0, "y"), 3)
+    yield test('"""\n' + lines, (0, 1, ""), 1000)
+    yield test("x = '''\n" + lines, (600, 0, "\n\n"), 4)
+
+def test_Highlighter_attribute_writes():
+    from editxt.platform.text import Text
+
+    def make_theme(colors):
+        class theme:
+            text_color = "text_color"
+            def get_syntax_color(name):
+                token = name.rsplit(" ", 1)[-1].split(".")[0]
+                return colors.get(token, "text_color")
+            def color_table(sdef):
+                return ColorTable(theme.get_syntax_color)
+        return theme
+
+    @gentest
+    def test(colors, string, edit, writes, edit_writes):
+        theme = make_theme(colors)
+        hl = Highlighter(theme)
+        hl.syntaxdef = get_syntax_definition("python")
+        text = Text(string)
+        hl.color_text(text)
+        eq_(hl.attribute_writes, writes)
+        start, length, insert = edit
+        text[(start, length)] = insert
+        hl.color_text(text, (start, len(insert)))
+        eq_(hl.attribute_writes - writes, edit_writes)
+
+        full = Highlighter(theme)
+        full.syntaxdef = hl.syntaxdef
+        expect = Text(str(text))
+        full.color_text(expect)
+        eq_(color_ranges(text), color_ranges(expect))
+
+    colors = {"keyword": "blue", "string": "red", "comment": "red"}
+    lines = "def f(): pass  # x\n" * 3
+    yield test(colors, lines, (4, 1, "g"), 18, 1)
+    yield test(colors, lines, (4, 1, "'"), 18, 1)
+    yield test(colors, lines, (15, 3, "'x'"), 18, 1)
+    yield test(colors, lines, (0, 0, "'''"), 18, 4)
+    yield test({}, lines, (4, 1, "'"), 1, 1)
+
+def test_Highlighter_restore():
+    from editxt.platform.text import Text
+
+    class theme:
+        text_color = "text_color"
+        def get_syntax_color(name):
+            return name
+        def color_table(sdef):
+            return ColorTable(theme.get_syntax_color)
+
+    string = "def f(x):\n    return 'x'  # comment\n" * 3
+    full = Highlighter(theme)
+    full.syntaxdef = get_syntax_definition("python")
+    expect = Text(string)
+    full.color_text(expect)
+    snapshot = [(start, (info, "")) for start, length, info, key in full.spans]
+
+    @gentest
+    def test(runs, writes, threaded=False):
+        hl = Highlighter(theme)
+        hl.syntaxdef = full.syntaxdef
+        text = Text(string)
+        with replattr(mod, "BACKGROUND_SCAN_TIME", 1e-9):
+            hl.restore(text, runs, threaded=threaded)
+        eq_(color_ranges(text), color_ranges(expect))
+        eq_(token_ranges(hl), token_ranges(full))
+        eq_(list(hl.checkpoints), list(full.checkpoints))
+        eq_(hl.attribute_writes, writes)
+
+    # 24 color runs written by snapshot, none by verifying scan
+    yield test(snapshot, 24)
+    yield test(snapshot, 24, True)
+    # stale snapshot is corrected by verifying scan
+    yield test([(0, (None, ""))], 1 + 23)
+    yield test([(0, (None, "")), (4, ("Python keyword", ""))], 2 + 22, True)
+
+def test_Highlighter_symbols():
+    from editxt.platform.text import Text
+
+    class theme:
+        text_color = "text_color"
+        def get_syntax_color(name):
+            return name
+        def color_table(sdef):
+            return ColorTable(theme.get_syntax_color)
+
+    @gentest
+    def test(string, edit, expect, threaded=False):
+        hl = Highlighter(theme)
+        hl.syntaxdef = get_syntax_definition("python")
+        text = Text(string)
+        with replattr(mod, "BACKGROUND_SCAN_TIME", 1e-9):
+            hl.color_text(text, threaded=threaded)
+        if edit is not None:
+            start, length, insert = edit
+            text[(start, length)] = insert
+            hl.color_text(text, (start, len(insert)))
+        eq_(list(hl.symbols), expect)
+
+        full = Highlighter(theme)
+        full.syntaxdef = hl.syntaxdef
+        full.color_text(Text(str(text)))
+        eq_(list(hl.symbols), list(full.symbols))
+
+    src = "class C:\n    def f(self):\n        x = 1\n"
+    yield test(src, None, [(6, "C"), (17, "f"), (34, "x")])
+    yield test(src, None, [(6, "C"), (17, "f"), (34, "x")], True)
+    yield test(src, (17, 1, "gg"), [(6, "C"), (17, "gg"), (35, "x")])
+    yield test(src, (0, 0, "y = 2\n"),
+               [(0, "y"), (12, "C"), (23, "f"), (40, "x")])
+    yield test(src, (9, 18, ""), [(6, "C"), (16, "x")])
+    yield test("x = '''\n" + src + "'''\n", (4, 3, ""),
+               [(0, "x"), (11, "C"), (22, "f"), (39, "x")])
+    yield test(src * 500, (len(src) * 250 + 6, 1, "D"), [
+        (len(src) * i + offset, "D" if i == 250 and name == "C" else name)
+        for i in range(500)
+        for offset, name in [(6, "C"), (17, "f"), (34, "x")]
+    ])
+
+def test_Highlighter_symbols_without_definition_rules():
+    from editxt.platform.text import Text
+
+    class theme:
+        text_color = "text_color"
+        def get_syntax_color(name):
+            return name
+        def color_table(sdef):
+            return ColorTable(theme.get_syntax_color)
+
+    hl = Highlighter(theme)
+    hl.syntaxdef = get_syntax_definition("javascript")
+    hl.color_text(Text("function f() {}\nvar x = 1\n"))
+    eq_(list(hl.symbols), [])
+
+def test_Highlighter_color_text_dynamic_range_lookups():
+    from editxt.platform.text import Text
+
+    class theme:
+        text_color = "text_color"
+        def get_syntax_color(name):
+            return name
+        def color_table(sdef):
+            return ColorTable(theme.get_syntax_color)
+
+    lookups = []
+    get_compiled = SyntaxDefinition.get_compiled_definition
+    def get_compiled_definition(self, key, default=None):
+        lookups.append(key)
+        return get_compiled(self, key, default)
+
+    hl = Highlighter(theme)
+    hl.syntaxdef = get_syntax_definition("markdown")
+    text = Text((
+        "```Python\ndef f(): pass\n```\n"
+        "```unknown\ndef f(): pass\n```\n"
+    ) * 100)
+    with replattr(
+            SyntaxDefinition,
+            "get_compiled_definition",
+            get_compiled_definition):
+        hl.color_text(text)
+    assert lookups.count("Python") <= 1, lookups
+    assert lookups.count("unknown") <= 1, lookups
+    eq_(sum(1 for rng, token in token_ranges(hl)
+            if token == "Python keyword"), 200)
+
+def test_Highlighter_color_text_expand_grammar_in_threads():
+    from itertools import count
+    from os.path import abspath, dirname, join
+    from threading import Barrier, Thread
+    from time import sleep
+    from editxt.platform.text import Text
+
+    class theme:
+        text_color = "text_color"
+        def get_syntax_color(name):
+            return name
+        def color_table(sdef):
+            return ColorTable(theme.get_syntax_color)
+
+    def slow_ids():
+        for i in count():
+            sleep(0.001)  # let the other thread run
+            yield "%x" % i
+
+    root = dirname(dirname(dirname(abspath(__file__))))
+    factory = SyntaxFactory()
+    factory.load_definitions(join(root, "resources/syntax"), False)
+    markdown = factory.get("markdown")
+    markdown.lang_ids = slow_ids()
+    text = Text((
+        "# title\n```Python\ndef f(): pass\n```\n"
+        "```javascript\nfunction f() {}\n```\n"
+    ) * 10)
+    barrier = Barrier(2)
+    results = []
+    errors = []
+
+    def highlight():
+        hl = Highlighter(theme)
+        hl.syntaxdef = markdown
+        barrier.wait()
+        try:
+            hl.color_text(text)
+        except Exception as err:
+            errors.append(err)
+        results.append(token_ranges(hl))
+
+    threads = [Thread(target=highlight) for x in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    eq_(errors, [])
+    eq_(len(results), 2)
+    eq_(results[0], results[1])
+    assert any(token == "Python keyword" for rng, token in results[0])
+
+def test_Highlighter_color_text_match_timeout():
+    import editxt.regex
+    from editxt.platform.text import Text
+
+    class theme:
+        text_color = "text_color"
+        def get_syntax_color(name):
+            return name
+        def color_table(sdef):
+            return ColorTable(theme.get_syntax_color)
+
+    class lang:
+        rules = [("keyword", ["def"])]
+
+    # the third match takes longer than SYNTAX_MATCH_TIMEOUT
+    clock = iter([0, 0, 0, 0, 0, const.SYNTAX_MATCH_TIMEOUT + 1])
+    with replattr(
+            (editxt.regex, "_regex", None),
+            (editxt.regex, "time", lambda: next(clock))):
+        hl = Highlighter(theme)
+        hl.syntaxdef = make_definition(lang)
+        text = Text("def x def y def z")
+        with CaptureLogging(mod) as log:
+            hl.color_text(text)
+    eq_(token_ranges(hl), [
+        ((0, 3), "lang keyword"),
+        ((6, 3), "lang keyword"),
+    ])
+    eq_(log.data["warn"], [Regex("syntax highlight timed out at 9: ")])
+    eq_(color_ranges(text)[-1], ((9, 8), "text_color"))
+
+def test_Highlighter_color_text_in_thread():
+    from editxt.platform.text import Text
+
+    class theme:
+        text_color = "text_color"
+        def get_syntax_color(name):
+            return name
+        def color_table(sdef):
+            return ColorTable(theme.get_syntax_color)
+
+    def highlight(string, edit=None, threaded=False):
+        hl = Highlighter(theme)
+        hl.syntaxdef = get_syntax_definition("python")
+        text = Text(string)
+        hl.color_text(text, threaded=threaded)
+        if edit is not None:
+            start, length, insert = edit
+            text[(start, length)] = insert
+            hl.color_text(text, (start, len(insert)), threaded=threaded)
+        return hl, text
+
+    @gentest
+    def test(string, edit=None, size=mod.BACKGROUND_SCAN_SIZE):
+        with replattr(mod, "BACKGROUND_SCAN_TIME", 1e-9), \
+                replattr(mod, "BACKGROUND_SCAN_SIZE", size):
+            hl, text = highlight(string, edit, threaded=True)
+        full, expect = highlight(str(text))
+        eq_(token_ranges(hl), token_ranges(full))
+        if size == mod.BACKGROUND_SCAN_SIZE:
+            eq_(list(hl.checkpoints), list(full.checkpoints))
+        else:
+            # the end of each window is also a checkpoint
+            eq_(set(full.checkpoints) - set(hl.checkpoints), set())
+        eq_(color_ranges(text), color_ranges(expect))
+        eq_(set(full.langs) - set(hl.langs), set())
+
+    lines = "x = 1\n" * 100
+    yield test(lines)
+    yield test('"""\n' + lines)
+    yield test(lines, (6, 0, "'"))
+    yield test('"""\n' + lines, (0, 1, ""))
+    yield test("x = '''\n" + lines, (60, 0, "\n\n"))
+    yield test(lines, size=20)
+    yield test('"""\n' + lines, size=20)
+    yield test(lines, (6, 0, "'"), size=20)
+    yield test('"""\n' + lines, (0, 1, ""), size=20)
+    yield test("x = '''\n" + lines, (60, 0, "\n\n"), size=20)
+    yield test("x = 1" * 100, size=20)
+
+def test_Highlighter_color_text_in_thread_copies_window():
+    from editxt.platform.text import Text
+
+    class theme:
+        text_color = "text_color"
+        def get_syntax_color(name):
+            return name
+        def color_table(sdef):
+            return ColorTable(theme.get_syntax_color)
+
+    windows = []
+    class TextWindow(mod.TextWindow):
+        def __init__(self, text, start, stop):
+            windows.append((start, stop))
+            super().__init__(text, start, stop)
+
+    hl = Highlighter(theme)
+    hl.syntaxdef = get_syntax_definition("python")
+    text = Text("if x: pass\n" * 1000)
+    with replattr(mod, "BACKGROUND_SCAN_SIZE", 600), \
+            replattr(mod, "TextWindow", TextWindow):
+        hl.color_text(text, threaded=True)
+        eq_(windows[:2], [(0, 605), (605, 1210)])
+        eq_(windows[-1], (10890, 11000))
+        del windows[:]
+
+        text[(5500, 0)] = "y"
+        hl.color_text(text, (5500, 1), threaded=True)
+        eq_(windows, [(5489, 6095)])
+
+def test_Highlighter_color_text_in_thread_discards_stale_batches():
+    from editxt.platform.text import Text
+
+    class theme:
+        text_color = "text_color"
+        def get_syntax_color(name):
+            return name
+        def color_table(sdef):
+            return ColorTable(theme.get_syntax_color)
+
+    batches = []
+    def call_in_main_thread(_callback, *args, **kw):
+        batches.append((_callback, args[0]))
+
+    hl = Highlighter(theme)
+    hl.syntaxdef = get_syntax_definition("python")
+    lines = "if x: pass\n" * 10
+    text = Text(lines + 'x = """\n' + lines)
+    with replattr(mod, "BACKGROUND_SCAN_TIME", 1e-9), \
+            replattr(mod, "call_in_main_thread", call_in_main_thread):
+        hl.color_text(text, threaded=True)
+    assert len(batches) > 2, batches
+    for apply, batch in batches[:2]:
+        apply(batch)
+    stale = batches[2:]
+
+    text[(114, 3)] = "1"  # remove triple quote
+    hl.color_text(text, (114, 1), threaded=True)
+    for apply, batch in stale:
+        apply(batch)
+
+    full = Highlighter(theme)
+    full.syntaxdef = hl.syntaxdef
+    expect = Text(str(text))
+    full.color_text(expect)
+    eq_(token_ranges(hl), token_ranges(full))
+    eq_(list(hl.checkpoints), list(full.checkpoints))
+    eq_(color_ranges(text), color_ranges(expect))
+
+def test_Highlighter_color_text_priority_range():
+    from editxt.platform.text import Text
+
+    class theme:
+        text_color = "text_color"
+        def get_syntax_color(name):
+            return name
+        def color_table(sdef):
+            return ColorTable(theme.get_syntax_color)
+
+    def highlight(hl, text, minrange=None, **kw):
+        calls = []
+        def call_later(delay, callback):
+            calls.append(callback)
+            return lambda: None
+        with replattr(mod, "call_later", call_later, sigcheck=False):
+            hl.color_text(text, minrange, timeout=1e-9, **kw)
+            partial = color_ranges(text)
+            while calls:
+                calls.pop()()
+        return partial
+
+    def colors_in(colors, rng):
+        return [r for r in colors if intersect_ranges(r[0], rng)[1]]
+
+    @gentest
+    def test(string, priority, correct=True, edit=None):
+        hl = Highlighter(theme)
+        hl.syntaxdef = get_syntax_definition("python")
+        text = Text(string)
+        if edit is not None:
+            highlight(hl, text)
+            start, length, insert = edit
+            text[(start, length)] = insert
+            edit = (start, len(insert))
+        partial = highlight(hl, text, edit, priority=priority)
+
+        full = Highlighter(theme)
+        full.syntaxdef = hl.syntaxdef
+        expect = Text(str(text))
+        full.color_text(expect)
+        eq_(token_ranges(hl), token_ranges(full))
+        eq_(list(hl.checkpoints), list(full.checkpoints))
+        eq_(color_ranges(text), color_ranges(expect))
+
+        visible = colors_in(partial, priority)
+        if correct:
+            eq_(visible, colors_in(color_ranges(expect), priority))
+        else:
+            assert visible != colors_in(color_ranges(expect), priority)
+
+    lines = "if x: pass\n" * 100
+    yield test(lines, (550, 55))
+    yield test(lines, (555, 0))
+    yield test(lines + '"""\n' + lines, (1050, 5))
+    yield test('"""\n' + lines + '"""\n' + lines, (554, 55), False)
+    yield test(lines, (550, 55), edit=(5, 0, "x"))
+    yield test(lines, (550, 55), False, edit=(5, 0, "'''"))
+
 def test_NoHighlight_wordinfo():
     nh = NoHighlight("Test", "")
     eq_(nh.wordinfo, None)
@@ -1180,6 +1931,239 @@ def test_SyntaxDefinition_comment_token():
     lang = make_definition(Lang)
     eq_(lang.comment_token, "")
 
+def test_SyntaxDefinition_iter_color_names():
+    from editxt.syntax import DynamicRange
+    class Ref:
+        name = "Ref"
+        rules = [("tag", ["<"])]
+    class Lang:
+        class attr:
+            default_text_color = "attr"
+            rules = [("value", ["v"])]
+        class start:
+            rules = [("open", ["{"])]
+        name = "Lang"
+        default_text_color = "body"
+        rules = [
+            ("keyword", ["def"]),
+            ("string", "'", ["'"]),
+            ("attribute", "[", ["]"], attr),
+            ("block", start, ["}"]),
+            ("ref", "<", [">"], "ref"),
+            ("dyn", "@", ["@"], DynamicRange("(?P<lang>x)", "dyn")),
+        ]
+    lang = make_definition(Lang)
+    lang.registry["ref"] = make_definition(Ref)
+    eq_(set(lang.iter_color_names()), {
+        "Lang text_color",
+        "Lang body",
+        "Lang keyword",
+        "Lang string",
+        "Lang attribute",
+        "Lang attr",
+        "Lang value",
+        "Lang block",
+        "Lang open",
+        "Lang ref",
+        "Ref text_color",
+        "Ref tag",
+        "Lang dyn",
+    })
+    eq_(list(PLAIN_TEXT.iter_color_names()), [])
+
+def test_SyntaxDefinition_iter_color_names_covers_highlighted_tokens():
+    from os.path import abspath, dirname, join
+    from editxt.platform.text import Text
+    from editxt.syntax import MatchInfo
+    root = dirname(dirname(dirname(abspath(__file__))))
+
+    class theme:
+        text_color = "text_color"
+        def get_syntax_color(name):
+            return name
+        def color_table(sdef):
+            return ColorTable(theme.get_syntax_color)
+
+    @gentest
+    def test(lang, path):
+        with open(join(root, path), encoding="utf-8") as fh:
+            text = Text(fh.read()[:5000])
+        hl = Highlighter(theme)
+        hl.syntaxdef = get_syntax_definition(lang)
+        hl.color_text(text)
+        names = set(hl.syntaxdef.iter_color_names())
+        tokens = {str(info) for start, length, info, key in hl.spans
+                  if isinstance(info, MatchInfo)}
+        assert tokens, "nothing highlighted"
+        eq_(tokens - names, set())
+
+    yield test("python", "editxt/syntax.py")
+    yield test("xml", "resources/Sparkle-1.18.1/SampleAppcast.xml")
+
+def test_SyntaxDefinition_make_definition():
+    from editxt.syntax import End
+    class Lang:
+        name = "Lang"
+        rules = [("keyword", ["def"])]
+    class Sub:
+        rules = [("tag", ["<"])]
+    lang = make_definition(Lang)
+    end = End(">", None, "Lang tag", lang)
+    sub = lang.make_definition(Sub, "sub", [end])
+    eq_(sub.root, lang)
+    eq_(list(lang.derived.values()), [sub])
+    eq_({type(part) for key in lang.derived for part in key}, {int})
+    eq_(lang.make_definition(Sub, "sub", [End(">", None, "Lang tag", lang)]),
+        sub)
+    assert lang.make_definition(Sub, "sub", [end, end]) is sub
+    assert lang.make_definition(Sub, "other", [end]) is not sub
+    assert lang.make_definition(Sub, "sub", [End("]", None, "", lang)]) \
+        is not sub
+    # derived definitions of derived definitions are cached by the root
+    subsub = sub.make_definition(Sub, "sub", [end], sub)
+    assert subsub is not sub
+    eq_(subsub.root, lang)
+    eq_(sub.make_definition(Sub, "sub", [end], sub), subsub)
+    eq_(len(lang.derived), 4)
+    assert not hasattr(sub, "derived"), sub.derived
+
+def test_SyntaxDefinition_get_stats():
+    from editxt.platform.text import Text
+
+    class theme:
+        text_color = "text_color"
+        def get_syntax_color(name):
+            return name
+        def color_table(sdef):
+            return ColorTable(theme.get_syntax_color)
+
+    class Lang:
+        name = "Lang"
+        rules = [
+            ("keyword", ["def"]),
+            ("string", "'", ["'"]),
+            ("comment", "#", ["\n"]),
+        ]
+    lang = make_definition(Lang)
+    eq_(lang.get_stats().states, 0)
+
+    hl = Highlighter(theme)
+    hl.syntaxdef = lang
+    hl.color_text(Text("def f(): 'x'"))
+    stats = lang.get_stats()
+    eq_(stats.states, 2)  # root and string states (comment not expanded)
+    eq_(stats.derived, 2)
+    eq_(stats.regex_size, len(lang._pattern) + len(
+        next(d for d in lang.derived.values() if "_pattern" in d.__dict__
+             )._pattern))
+    assert stats.memory > stats.regex_size, stats
+
+def test_SyntaxFactory_report():
+    from editxt.platform.text import Text
+    from testil import Regex as RX
+
+    class theme:
+        text_color = "text_color"
+        def get_syntax_color(name):
+            return name
+        def color_table(sdef):
+            return ColorTable(theme.get_syntax_color)
+
+    class Lang:
+        name = "Lang"
+        rules = [("keyword", ["def"]), ("string", "'", ["'"])]
+    factory = SyntaxFactory()
+    lang = make_definition(Lang)
+    factory.by_id["lang"] = lang
+    factory.by_id["plain"] = PLAIN_TEXT
+    eq_(factory.report().split("\n"), [
+        "language                  states  derived  regex KB  memory KB",
+        RX(r"^total +0\.0$"),
+    ])
+
+    hl = Highlighter(theme)
+    hl.syntaxdef = lang
+    hl.color_text(Text("def f(): 'x'"))
+    eq_(factory.report().split("\n"), [
+        "language                  states  derived  regex KB  memory KB",
+        RX(r"^Lang +2 +1 +0\.\d +\d+\.\d$"),
+        RX(r"^total +\d+\.\d$"),
+    ])
+
+def test_first_char_guard():
+    from editxt.syntax import first_char_guard as guard
+    eq_(guard("abc|def"), "(?=[ad])")
+    eq_(guard(r"(?P<a>\bif\b)|(?P<b>[0-9]+)|(?P<c>\s*#)"),
+        r"(?=[0-9\U00000023\si])")
+    eq_(guard(r"x*$"), r"(?=[\U0000000ax]|\Z)")
+    eq_(guard(r"(?P<e>\Z)|y"), r"(?=[y]|\Z)")
+    eq_(guard(r"(?<=a)b|(?!c)d"), "(?=[bd])")
+    eq_(guard(r"x{0,2}"), None)
+    eq_(guard(r"a|.b"), None)
+    eq_(guard(r"a|[^b]"), None)
+    eq_(guard(r"(a)\1|b"), "(?=[ab])")
+    eq_(guard(r"(a?)\1b"), None)
+    eq_(guard(r"(?i)a"), None)
+    eq_(guard(r"(?i:a)"), None)
+    eq_(guard(r"a", re.IGNORECASE), "(?=[a])")
+
+def test_first_char_guard_differential():
+    # guarded regex of every grammar state matches exactly like unguarded
+    from itertools import count
+    from os.path import abspath, dirname, join
+    from editxt.syntax import first_char_guard
+    root = dirname(dirname(dirname(abspath(__file__))))
+    corpus = []
+    for path in [
+        "editxt/syntax.py",
+        "resources/syntax/xml.syntax.py",
+        "resources/Sparkle-1.18.1/SampleAppcast.xml",
+    ]:
+        with open(join(root, path), encoding="utf-8") as fh:
+            corpus.append(fh.read()[:10000])
+    ascii = "".join(chr(c) for c in range(32, 127))
+    corpus.append(ascii + "\n" + " ".join(ascii) + "\n\t\r\n")
+    corpus.append("é ſ K ß İ ﬁ Σσς 𝔘   \\n \\x41 0x1F 1e-3 $x @y #z\n")
+    corpus = "".join(corpus)
+
+    def iter_states(sdef, depth=2):
+        seen = set()
+        states = [sdef]
+        for i in range(depth + 1):
+            nexts = []
+            for state in states:
+                if id(state) in seen or not isinstance(state, SyntaxDefinition):
+                    continue
+                seen.add(id(state))
+                yield state
+                nexts.extend(info.next for info in state.wordinfo.values()
+                             if getattr(info, "next", None) is not None)
+            states = nexts
+
+    def matches(regex):
+        return [(m.span(), m.lastgroup) for m in regex.finditer(corpus)]
+
+    @gentest
+    def test(sdef):
+        for state in iter_states(sdef):
+            idgen = ("%X" % i for i in count())
+            pattern = "|".join(phrase for phrase, ident, info
+                               in state.iter_group_info(idgen))
+            guard = first_char_guard(pattern, state.flags)
+            if guard is None:
+                eq_(state.regex.pattern, pattern)
+                continue
+            eq_(state.regex.pattern, "{}(?:{})".format(guard, pattern))
+            raw = re.compile(pattern, state.flags)
+            eq_(matches(state.regex), matches(raw), state)
+
+    factory = SyntaxFactory()
+    factory.load_definitions(join(root, "resources/syntax"), False)
+    factory.index_definitions()
+    for sdef in factory.definitions:
+        if sdef is not PLAIN_TEXT:
+            yield test(sdef)
+
 def get_syntax_definition(name, cache={}):
     if isinstance(name, NoHighlight):
         return name
@@ -1207,6 +2191,28 @@ def make_definition(rules):
     return sdef
 
 
+def token_ranges(highlighter):
+    """Get a list of `(range, token)` pairs for all tokens highlighted"""
+    from editxt.syntax import MatchInfo
+    return [((start, length), str(info))
+        for start, length, info, key in highlighter.spans
+        if isinstance(info, MatchInfo)]
+
+
+def color_ranges(text):
+    """Get a list of `(range, color)` pairs for all text"""
+    long_range = text.attribute_atIndex_longestEffectiveRange_inRange_
+    fg_color = ak.NSForegroundColorAttributeName
+    full = (0, len(text))
+    index = 0
+    colors = []
+    while index < full[1]:
+        color, rng = long_range(fg_color, index, None, full)
+        colors.append((tuple(rng), color))
+        index = sum(rng)
+    return colors
+
+
 def intersect_ranges(rng1, rng2):
     """Get the intersection range of the given ranges
 
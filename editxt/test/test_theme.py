@@ -88,3 +88,29 @@ def test_Theme_get_syntax_color():
     yield test, "C comment", "112233"
     yield test, "C keyword", "332211"
     yield test, "C string", "accafe"
+
+def test_Theme_color_table():
+    config = Config(None, {"theme": {
+        "text_color": ColorString("000000"),
+        "syntax": {"default": {"keyword": ColorString("eeeeee")}},
+    }})
+    config.data = {"theme": {"syntax": {"A": {"string": "accafe"}}}}
+    theme = mod.Theme(config)
+    calls = []
+    class sdef:
+        def iter_color_names():
+            calls.append("iter")
+            return iter(["A keyword", "A string"])
+    get_color = lambda v: v
+    with replattr(mod, "get_color", get_color, sigcheck=False):
+        table = theme.color_table(sdef)
+        eq_(dict(table), {"A keyword": "eeeeee", "A string": "accafe"})
+        assert theme.color_table(sdef) is table
+        eq_(table["A comment"], "000000")
+        eq_(table["A comment"], theme.get_syntax_color("A comment"))
+        eq_(calls, ["iter"])
+
+        config.data = {"theme": {"syntax": {"A": {"string": "cafe00"}}}}
+        theme.reset()
+        eq_(theme.color_table(sdef)["A string"], "cafe00")
+        eq_(calls, ["iter", "iter"])
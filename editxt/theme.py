@@ -18,6 +18,7 @@
 # You should have received a copy of the GNU General Public License
 # along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
 import logging
+from weakref import WeakKeyDictionary
 
 import AppKit as ak
 
@@ -49,6 +50,7 @@ class Theme(object):
     def reset(self):
         self.syntax = self.config.lookup("theme.syntax", True)
         self.default = self.syntax.get("default", {})
+        self.color_tables = WeakKeyDictionary()
         assert self.default is not self.config.get("theme.syntax.default"), \
             "{!r} will be mutated".format(self.default)
         for name in self.cached:
@@ -92,6 +94,24 @@ class Theme(object):
             self.default[name] = value
         return value
 
+    def color_table(self, sdef):
+        """Get the color table of a syntax definition
+
+        The table is built once per definition with colors of all token
+        names reachable from the definition's rules. Tables are
+        discarded when the theme is reset.
+
+        :param sdef: A `SyntaxDefinition` object.
+        :returns: A `ColorTable` mapping color names to colors.
+        """
+        try:
+            return self.color_tables[sdef]
+        except KeyError:
+            pass
+        table = ColorTable(self.get_syntax_color, sdef.iter_color_names())
+        self.color_tables[sdef] = table
+        return table
+
     def _get(self, lang, name):
         data = self.syntax.get(lang)
         if data:
@@ -102,3 +122,20 @@ class Theme(object):
                     pass
                 name = name.rpartition(".")[0]
         return None
+
+
+class ColorTable(dict):
+    """Syntax color lookup table
+
+    Colors of names not known when the table was built (for example,
+    names of dynamically resolved definitions) are looked up with
+    `get_color` on first access.
+    """
+
+    def __init__(self, get_color, names=()):
+        self.get_color = get_color
+        super().__init__((name, get_color(name)) for name in names)
+
+    def __missing__(self, name):
+        value = self[name] = self.get_color(name)
+        return value
@@ -148,7 +148,7 @@ setup_args = dict(
         # when switching to EditXT with Exposé). Luckily everything seems to
         # work as expected without it!!
         #argv_emulation=True,
-        packages=["editxt"],
+        packages=["editxt", "regex"],
         frameworks=["resources/Sparkle-1.18.1/Sparkle.framework"],
         plist=dict(
             CFBundleGetInfoString = "%s %s.%s" % (version, revision, gitrev),